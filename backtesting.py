@@ -3,6 +3,9 @@
 
 from trade_logic import Stocks,AcceptParameters
 from yahoo_api import YahooAPI
+from bar_store import BarStore
+from ticker_metadata import TickerMetadata
+from session_index import SessionIndex
 
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
@@ -13,6 +16,8 @@ from matplotlib import cm
 import pandas as pd
 import numpy as np
 import utils
+import http_client
+import rate_limiter
 import os
 
 class Indicators:
@@ -51,8 +56,14 @@ class BackTesting(Stocks):
         self.indicators = Indicators()
 
         self.conf = utils.read_config("./config/config.json")
+        http_client.configure(self.conf['http'])
+        rate_limiter.configure(self.conf['rate_limit'])
+        if self.conf['trade_logic']['yahoo_bar_store']:
+            self.bar_store = BarStore(self.conf['trade_logic']['yahoo_bar_store'])
+        self.ticker_metadata = TickerMetadata(self.conf['trade_logic']['ticker_metadata_file'])
         self.logger=utils.configure_logger("default","./GLENNY_LOG.txt",self.conf["logging"])
         self.initialize_stocks(start,self.logger,self.conf,number_of_stocks,update_nasdaq_file=False,stocks=stocks)
+        self.ticker_metadata.flush()
 
         self.results = {"stock":[],"bought":[],"price_bought":[],
                         "number":[],"result":[],"start_date":[],"comment":[],
@@ -257,10 +268,11 @@ class BackTesting(Stocks):
             
         return Pi,bought
 
-    def get_sell_info(self,df,bought,N):
+    def get_sell_info(self,df,bought,N,sessions=None):
         '''
         returns: tuple(list of tuples,comment)
         ([(selling time, price when selling, number of stocks sold)],comment)
+        sessions : SessionIndex of df, computed here if not provided
         '''
         if self.sell_criterium=='EMA':
             df_sold = df[(df.timestamps>bought) & (df.cross_sEMA_bEMA==1)].set_index('timestamps')
@@ -295,20 +307,18 @@ class BackTesting(Stocks):
             comment = "Bought and sold"
             return ([(t_sold,Pe,N)],comment)
         elif self.sell_criterium=='advanced':
-            df_after_bought = df[df.timestamps>=bought].set_index('timestamps')
-            timestamps = df[df.timestamps>=bought].timestamps
-            diff = timestamps.diff()
-            diff_gaps = diff[diff>timedelta(hours=8)]
-            if diff_gaps.empty:
-                eod_index = timestamps.index[-1]
-            else:
-                eod_index = diff[diff>timedelta(hours=8)].index[0]-1
-            eod_time = timestamps.loc[eod_index]
-            Peod = df_after_bought.loc[eod_time].close
-            sold_series_eod = (eod_time,Peod,N)
-
-            if df_after_bought.empty:
+            if sessions is None:
+                sessions = SessionIndex(df.timestamps)
+            first = sessions.locate(bought)
+            if first>=len(sessions):
                 return False
+            df_after_bought = df.iloc[first:].set_index('timestamps')
+
+            # End of the session of the bought bar
+            eod = sessions.session_end(first)
+            eod_time = df.timestamps.iloc[eod]
+            Peod = df.close.iloc[eod]
+            sold_series_eod = (eod_time,Peod,N)
 
             P_bought = df_after_bought.loc[bought].close
             time_first_stop = pd.NaT
@@ -415,60 +425,100 @@ class BackTesting(Stocks):
         else:
             raise Exception("No valid sell criterium ({}) has been provided. Valid options are EMA, price or simple.".format(self.sell_criterium))
 
-    def get_time_diff_bod(self,df,bought):
-        df_before_bought = df[df.timestamps<=bought]
-        if df_before_bought.empty:
+    def get_time_diff_bod(self,df,bought,sessions=None):
+        '''
+        Returns the time (s) from the start of the session until bought.
+        sessions : SessionIndex of df, computed here if not provided
+        '''
+        if sessions is None:
+            sessions = SessionIndex(df.timestamps)
+        last = sessions.locate(bought,side='right')-1
+        if last<0:
             return False
 
-        timestamps = df_before_bought.timestamps
-        diff = timestamps.diff()
-        diff_gaps = diff[diff>timedelta(hours=8)]
-        if diff_gaps.empty:
-            bod_index = timestamps.index[0]
-        else:
-            bod_index = diff[diff>timedelta(hours=8)].index[-1]
-        bod_time = timestamps.loc[bod_index]
+        bod_time = df.timestamps.iloc[sessions.session_start(last)]
 
         return (bought-bod_time).total_seconds()
 
-    def get_time_diff_eod(self,df,bought):
-        df_after_bought = df[df.timestamps>bought]
-        if df_after_bought.empty:
+    def get_time_diff_eod(self,df,bought,sessions=None):
+        '''
+        Returns the time (s) from bought until the first bar of the next session (the last
+        bar if there is none).
+        sessions : SessionIndex of df, computed here if not provided
+        '''
+        if sessions is None:
+            sessions = SessionIndex(df.timestamps)
+        first = sessions.locate(bought,side='right')
+        if first>=len(sessions):
             return False
 
-        timestamps = df_after_bought.timestamps
-        diff = timestamps.diff()
-        diff_gaps = diff[diff>timedelta(hours=8)]
-        if diff_gaps.empty:
-            eod_index = timestamps.index[-1]
-        else:
-            eod_index = diff[diff>timedelta(hours=8)].index[0]
-        eod_time = timestamps.loc[eod_index]
+        eod = sessions.next_session_start(first)
+        if eod is None:
+            eod = len(sessions)-1
+        eod_time = df.timestamps.iloc[eod]
 
         return (eod_time-bought).total_seconds()
 
-    def calculate_result(self,stock):
+    def get_data_window(self):
+        '''
+        Returns the start and end of the data used to calculate the results.
+        '''
+        start_data = self.start - timedelta(days=self.conf['trade_logic']['yahoo_period_historic_data'])
+        end_data = start_data + timedelta(days=59)
+        if end_data>datetime.now():
+            end_data = datetime.now()
+
+        return start_data,end_data
+
+    def calculate_results(self):
+        FUNCTION='calculate_results'
+        '''
+        Calculates the result of every monitored stock. The data of all stocks is
+        downloaded first, so the indicators can be calculated in one batch. The rate limiter
+        is charged for the yahoo requests of the ranges the bar store doesn't have.
+        '''
+        start_data,end_data = self.get_data_window()
+
+        # Only the bars that aren't in the bar store are downloaded
+        limiter = rate_limiter.get_limiter()
+        for stock in self.monitored_stocks:
+            calls = self.get_request_count(stock,start_data,end_data,self.conf['trade_logic']['yahoo_interval'])
+            if calls:
+                limiter.acquire(rate_limiter.BACKTESTING,stock,cost=calls,wait=True)
+
+        self.logger.info(f"Getting data of {len(self.monitored_stocks)} stocks.",extra={'function':FUNCTION})
+        data = self.get_data_batch(
+            self.monitored_stocks,
+            start_data,
+            end_data,
+            self.conf['trade_logic']['yahoo_interval'],
+            self.conf['trade_logic']['yahoo_period_small_EMA'],
+            self.conf['trade_logic']['yahoo_period_big_EMA'],
+            self.logger)
+
+        for stock in self.monitored_stocks:
+            self.calculate_result(stock,df=data[stock])
+
+    def calculate_result(self,stock,df=None):
         FUNCTION='calculate_result'
         if not stock in self.monitored_stocks:
             return False
 
         self.logger.info(f"Ticker: {stock}, calculating result.",extra={'function':FUNCTION})
 
-        start_data = self.start - timedelta(days=self.conf['trade_logic']['yahoo_period_historic_data'])
-        end_data = start_data + timedelta(days=59)
-        if end_data>datetime.now():
-            end_data = datetime.now()
-
-        interval = self.conf['trade_logic']['yahoo_interval']
-        period_small_EMA = self.conf['trade_logic']['yahoo_period_small_EMA']
-        period_big_EMA = self.conf['trade_logic']['yahoo_period_big_EMA']
-        df = self.get_data(stock,start_data,end_data,interval,period_small_EMA,period_big_EMA,self.logger)
+        if df is None:
+            start_data,end_data = self.get_data_window()
+            interval = self.conf['trade_logic']['yahoo_interval']
+            period_small_EMA = self.conf['trade_logic']['yahoo_period_small_EMA']
+            period_big_EMA = self.conf['trade_logic']['yahoo_period_big_EMA']
+            df = self.get_data(stock,start_data,end_data,interval,period_small_EMA,period_big_EMA,self.logger)
 
         if df.empty:
             return False
 
         self.logger.debug(f"Ticker: {stock}, getting bought df.",extra={'function':FUNCTION})
         df = self.get_df_full(df)
+        sessions = SessionIndex(df.timestamps)
         
         # get accept parameters
         params = AcceptParameters(stock,self.current_status[stock]['exchange'],df,self.conf)
@@ -491,28 +541,17 @@ class BackTesting(Stocks):
         Pi,bought = buy_response
         N = round(min(self.M/Pi,self.M/self.Pavg))
 
-        self.logger.debug(f"Ticker: {stock}, getting time duration since start of day.",extra={'function':FUNCTION})
-        time_diff_bod = self.get_time_diff_bod(df,bought)
-        if not time_diff_bod:
-            return False
-        self.indicators.time_diff_bod = time_diff_bod
-
-        self.logger.debug(f"Ticker: {stock}, getting time duration until end of day.",extra={'function':FUNCTION})
-        time_diff_eod = self.get_time_diff_eod(df,bought)
-        if not time_diff_eod:
+        gates = self.check_gates(stock,df,bought,params,sessions)
+        if not gates:
             return False
-        self.indicators.time_diff_eod = time_diff_eod
+        self.indicators.time_diff_bod,self.indicators.time_diff_eod = gates
 
         self.logger.debug(f"Ticker: {stock}, getting derivative of bigEMA.",extra={'function':FUNCTION})
-        der_bigEMA = float(df[df.timestamps==bought].der_bigEMA)
+        der_bigEMA = float(df[df.timestamps==bought].der_bigEMA.iloc[0])
         self.indicators.der_bigEMA = der_bigEMA
 
-        self.logger.debug(f"Ticker: {stock}, getting drop.",extra={'function':FUNCTION})
-        if not params.get_drop(bought,self.logger):
-            return False
-
         self.logger.debug(f"Ticker: {stock}, getting sell info.",extra={'function':FUNCTION})
-        sell_info = self.get_sell_info(df,bought,N)
+        sell_info = self.get_sell_info(df,bought,N,sessions)
 
         if not sell_info:
             return False
@@ -533,6 +572,109 @@ class BackTesting(Stocks):
 
         self.logger.debug(f"Ticker: {stock}, calculate result done.",extra={'function':FUNCTION})
 
+    def check_gates(self,stock,df,bought,params,sessions):
+        FUNCTION='check_gates'
+        '''
+        Gates of a stock bought at bought, which only depend on the time it was bought:
+        returns False if its result is dropped (no time since the start or until the end
+        of the day, or no drop), else a tuple (time_diff_bod,time_diff_eod).
+        '''
+        self.logger.debug(f"Ticker: {stock}, getting time duration since start of day.",extra={'function':FUNCTION})
+        time_diff_bod = self.get_time_diff_bod(df,bought,sessions)
+        if not time_diff_bod:
+            return False
+
+        self.logger.debug(f"Ticker: {stock}, getting time duration until end of day.",extra={'function':FUNCTION})
+        time_diff_eod = self.get_time_diff_eod(df,bought,sessions)
+        if not time_diff_eod:
+            return False
+
+        self.logger.debug(f"Ticker: {stock}, getting drop.",extra={'function':FUNCTION})
+        if not params.get_drop(bought,self.logger):
+            return False
+
+        return time_diff_bod,time_diff_eod
+
+    def sweep_EMA_pairs(self,stock,small_periods,big_periods):
+        FUNCTION='sweep_EMA_pairs'
+        '''
+        Calculates the result of the EMA sell criterium for every pair of a small and a big
+        EMA period (small period < big period). The EMAs of all periods are calculated once
+        (see YahooAPI.get_EMA_periods) and every pair is evaluated by indexing them.
+        Pairs go through the same gates as calculate_result (check_gates, evaluated once
+        per bought bar): pairs that calculate_result would drop are left out.
+        Returns a dataframe with one row per pair, or False.
+        '''
+        if self.sell_criterium!='EMA':
+            self.logger.info(f"EMA period sweeps are only supported for the EMA sell criterium, not for {self.sell_criterium}.",extra={'function':FUNCTION})
+            return False
+
+        small_periods = np.asarray(small_periods,dtype=int)
+        big_periods = np.asarray(big_periods,dtype=int)
+
+        start_data,end_data = self.get_data_window()
+        data = self.get_EMA_periods(stock,start_data,end_data,self.conf['trade_logic']['yahoo_interval'],np.concatenate((small_periods,big_periods)),self.logger)
+        if data is None:
+            return False
+
+        df,EMAs = data
+        small_EMAs = EMAs[:len(small_periods)]
+        big_EMAs = EMAs[len(small_periods):]
+        closes = df.close.to_numpy(dtype=float)
+        timestamps = df.timestamps.to_numpy()
+        after_start = timestamps>=np.datetime64(self.start)
+        positions = np.arange(len(closes))
+
+        sessions = SessionIndex(df.timestamps)
+        params = AcceptParameters(stock,self.current_status[stock]['exchange'],df,self.conf)
+        gates = {}
+
+        self.logger.info(f"Ticker: {stock}, sweeping {len(small_periods)}x{len(big_periods)} EMA periods.",extra={'function':FUNCTION})
+        results = []
+        for small_period,small_EMA in zip(small_periods,small_EMAs):
+            pairs = big_periods>small_period
+            if not pairs.any():
+                continue
+
+            # Same crossings as get_df_full: -1 means smallEMA goes under bigEMA, +1 over
+            signs = np.sign(small_EMA-big_EMAs[pairs])/2
+            cross = np.full(signs.shape,np.nan)
+            cross[:,1:] = np.diff(signs,axis=1)
+
+            # Buy and sell as get_buy_info and get_sell_info
+            buy_points = (cross==-1) & after_start
+            bought = buy_points.any(axis=1)
+            buy = np.argmax(buy_points,axis=1)
+            sell_points = (cross==1) & (positions>buy[:,None])
+            sold = bought & sell_points.any(axis=1)
+            sell = np.argmax(sell_points,axis=1)
+
+            # Gates of calculate_result, pairs that are never sold are dropped as well
+            for position in np.unique(buy[bought]):
+                if not position in gates:
+                    gates[position] = bool(self.check_gates(stock,df,df.timestamps.iloc[position],params,sessions))
+            kept = ~bought | (sold & np.array([gates.get(position,False) for position in buy]))
+
+            Pi = np.round(closes[buy],2)
+            Pe = np.round(closes[sell],3)
+            N = np.round(np.minimum(self.M/Pi,self.M/self.Pavg))
+
+            results.append(pd.DataFrame({
+                'small_period':small_period,
+                'big_period':big_periods[pairs],
+                'bought':pd.Series(timestamps[buy]).where(bought),
+                'price_bought':np.where(bought,Pi,np.nan),
+                'sold':pd.Series(timestamps[sell]).where(sold),
+                'price_sold':np.where(sold,Pe,np.nan),
+                'number':np.where(bought,N,np.nan),
+                'result':np.where(sold,np.round((Pe-Pi)*N,3),np.nan),
+                'comment':np.where(bought,"Bought and sold","Never bought")})[kept])
+
+        if not results:
+            return False
+
+        return pd.concat(results,ignore_index=True)
+
     def get_df(self):
         return pd.DataFrame.from_dict(self.results)   
 
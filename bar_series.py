@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import base64
+import numpy as np
+import pandas as pd
+
+# Format of the timestamps in the JSON state files
+TIMESTAMP_FORMAT="%Y-%m-%d %H:%M:%S"
+
+class BarSeries:
+    '''
+    Columnar bar data of one ticker (timestamps, open, close, low, high, volume and
+    the indicator columns), backed by one typed numpy array per column:
+    'timestamps' as datetime64, all other columns as float64.
+
+    Replaces the dict of lists (df.to_dict(orient='list')) in Stocks.monitored_stock_data.
+    to_frame returns a DataFrame viewing the arrays (no copy), to_dict the JSON format
+    of the plotdata files and to_bytes a compact binary (npz) representation, which
+    to_state encodes for the state files.
+    '''
+    def __init__(self,columns):
+        self.columns=columns
+
+    @classmethod
+    def from_frame(cls,df):
+        '''
+        Copies the columns of a DataFrame of bars (see YahooAPI.get_data).
+        '''
+        columns={}
+        for column in df.columns:
+            if column=='timestamps':
+                columns[column]=df[column].to_numpy(dtype='datetime64[s]',copy=True)
+            else:
+                columns[column]=df[column].to_numpy(dtype=float,copy=True)
+
+        return cls(columns)
+
+    @classmethod
+    def from_dict(cls,data):
+        '''
+        Loads the dict of lists of the state files, timestamps being strings (see to_dict)
+        or datetimes.
+        '''
+        columns={}
+        for column,values in data.items():
+            if column=='timestamps':
+                columns[column]=pd.to_datetime(pd.Series(values,dtype=object)).to_numpy(dtype='datetime64[s]')
+            else:
+                columns[column]=np.array(values,dtype=float)
+
+        return cls(columns)
+
+    @classmethod
+    def from_bytes(cls,data):
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls({column:arrays[column] for column in arrays.files})
+
+    @classmethod
+    def from_state(cls,data):
+        '''
+        Loads a series of the state files: the base64 string of to_state, or the dict of
+        lists of older state files (see from_dict).
+        '''
+        if isinstance(data,str):
+            return cls.from_bytes(base64.b64decode(data))
+
+        return cls.from_dict(data)
+
+    def to_frame(self):
+        '''
+        Returns a DataFrame viewing the arrays of the series (the arrays are not copied).
+        '''
+        return pd.DataFrame(self.columns,copy=False)
+
+    def to_dict(self):
+        '''
+        Returns the series as a dict of lists that can be written to JSON, with
+        timestamps formatted as TIMESTAMP_FORMAT.
+        '''
+        result={}
+        for column,values in self.columns.items():
+            if column=='timestamps':
+                result[column]=pd.DatetimeIndex(values).strftime(TIMESTAMP_FORMAT).tolist()
+            else:
+                result[column]=values.tolist()
+
+        return result
+
+    def to_bytes(self):
+        buffer=io.BytesIO()
+        np.savez(buffer,**self.columns)
+        return buffer.getvalue()
+
+    def to_state(self):
+        '''
+        Returns the series as the base64 string of to_bytes, as written to the state files.
+        '''
+        return base64.b64encode(self.to_bytes()).decode('ascii')
+
+    def __getitem__(self,column):
+        return self.columns[column]
+
+    def __contains__(self,column):
+        return column in self.columns
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    @property
+    def empty(self):
+        return len(self)==0
+
+    def latest(self,column):
+        '''
+        Returns the latest value of the column.
+        '''
+        return self.columns[column][-1]
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+import threading
+import time
+import json
+import os
+import numpy as np
+
+# Columns of the stored bars: 'timestamps' holds the unix timestamps (UTC) of the yahoo API
+COLUMNS=['timestamps','open','close','low','high','volume']
+
+# Yahoo keeps updating recent bars, only ranges ending this long ago are considered final
+FINAL_DELAY=24*3600
+
+SECONDS_PER_DAY=24*3600
+
+class BarStore:
+    '''
+    On-disk store of the bars downloaded from the yahoo API.
+
+    Bars are stored as NPZ files partitioned by ticker, interval and UTC day:
+        directory/ticker/interval/YYYYMMDD.npz
+    Next to the partitions, coverage.json holds the (merged) unix time ranges
+    [start,end) for which all bars are stored, and the latest gmtoffset of the ticker.
+    Only ranges that are final (see FINAL_DELAY) are stored.
+
+    Files are replaced atomically (see replace_file) and the coverage is only updated once
+    the partitions are written, so the coverage never points to a partial partition.
+    Writes are serialized, the prefetch threads share the store.
+    '''
+    def __init__(self,directory):
+        self.directory=Path(directory)
+        self.lock=threading.Lock()
+
+    def get_path(self,ticker,interval):
+        return self.directory/ticker/interval
+
+    def read_meta(self,ticker,interval):
+        meta_file=self.get_path(ticker,interval)/"coverage.json"
+        if not meta_file.exists():
+            return {'gmtoffset':None,'coverage':[]}
+
+        with open(meta_file,'r') as f:
+            return json.load(f)
+
+    def write_meta(self,ticker,interval,meta):
+        path=self.get_path(ticker,interval)
+        path.mkdir(parents=True,exist_ok=True)
+
+        replace_file(path/"coverage.json",lambda f: f.write(json.dumps(meta).encode()))
+
+    def missing(self,ticker,interval,start,end):
+        '''
+        Returns the list of unix time ranges (start,end) within [start,end) that are not stored.
+        '''
+        result=[]
+        for covered_start,covered_end in self.read_meta(ticker,interval)['coverage']:
+            if covered_end<=start:
+                continue
+            if covered_start>=end:
+                break
+            if covered_start>start:
+                result.append((start,covered_start))
+            start=max(start,covered_end)
+
+        if start<end:
+            result.append((start,end))
+
+        return result
+
+    def get_gmtoffset(self,ticker,interval):
+        return self.read_meta(ticker,interval)['gmtoffset']
+
+    def read(self,ticker,interval,start,end):
+        '''
+        Returns a dict {column:array} with the stored bars with a timestamp within [start,end).
+        '''
+        path=self.get_path(ticker,interval)
+        parts=[]
+        for day in range(start//SECONDS_PER_DAY,(end-1)//SECONDS_PER_DAY+1):
+            partition=path/self.partition_name(day)
+            if partition.exists():
+                with np.load(partition) as data:
+                    parts.append({column:data[column] for column in COLUMNS})
+
+        return self.select(concatenate(parts),start,end)
+
+    def write(self,ticker,interval,start,end,bars,gmtoffset):
+        '''
+        Stores bars (dict {column:array}) downloaded for the unix time range [start,end).
+        Only the final part of the range is stored and added to the coverage.
+        '''
+        end=min(end,int(time.time())-FINAL_DELAY)
+        if end<=start:
+            return
+
+        with self.lock:
+            self.write_bars(ticker,interval,start,end,self.select(bars,start,end),gmtoffset)
+
+    def write_bars(self,ticker,interval,start,end,bars,gmtoffset):
+        '''
+        Writes the partitions of the bars, then adds [start,end) to the coverage.
+        Called by write, with the lock held.
+        '''
+        path=self.get_path(ticker,interval)
+        path.mkdir(parents=True,exist_ok=True)
+
+        days=bars['timestamps']//SECONDS_PER_DAY
+        for day in np.unique(days):
+            partition=path/self.partition_name(day)
+            new={column:values[days==day] for column,values in bars.items()}
+            if partition.exists():
+                with np.load(partition) as data:
+                    new=concatenate([new,{column:data[column] for column in COLUMNS}])
+            _,first=np.unique(new['timestamps'],return_index=True)
+            replace_file(partition,lambda f: np.savez(f,**{column:values[first] for column,values in new.items()}))
+
+        meta=self.read_meta(ticker,interval)
+        meta['gmtoffset']=gmtoffset
+        meta['coverage']=merge_ranges(meta['coverage']+[[start,end]])
+        self.write_meta(ticker,interval,meta)
+
+    @staticmethod
+    def partition_name(day):
+        return time.strftime('%Y%m%d',time.gmtime(int(day)*SECONDS_PER_DAY))+".npz"
+
+    @staticmethod
+    def select(bars,start,end):
+        mask=(bars['timestamps']>=start)&(bars['timestamps']<end)
+        return {column:values[mask] for column,values in bars.items()}
+
+def replace_file(path,write):
+    '''
+    Calls write(binary file) on a temporary file which then replaces path, so a crash
+    mid-write never leaves a truncated file behind.
+    '''
+    temp_path=path.with_name(path.name+'.tmp')
+    with open(temp_path,'wb') as f:
+        write(f)
+    os.replace(temp_path,path)
+
+def concatenate(parts):
+    '''
+    Concatenates dicts {column:array} of bars, sorted by timestamp.
+    '''
+    if not parts:
+        return {column:np.empty(0,dtype=np.int64 if column=='timestamps' else float) for column in COLUMNS}
+
+    bars={column:np.concatenate([part[column] for part in parts]) for column in COLUMNS}
+    order=np.argsort(bars['timestamps'],kind='stable')
+
+    return {column:values[order] for column,values in bars.items()}
+
+def merge_ranges(ranges):
+    '''
+    Merges overlapping or adjacent [start,end) ranges.
+    '''
+    result=[]
+    for start,end in sorted(ranges):
+        if result and start<=result[-1][1]:
+            result[-1][1]=max(result[-1][1],end)
+        else:
+            result.append([start,end])
+
+    return result
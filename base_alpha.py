@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import requests as requests
+import http_client
 import datetime as _datetime
 import pandas as pd
 import time as _time
@@ -24,7 +24,7 @@ class AlphaAPI():
         params["apikey"]=self.apikey
         params["datatype"]=datatype
 
-        response=requests.get(self.base_url,params=params)
+        response=http_client.get(self.base_url,params=params)
 
         if (response.status_code!=200):
             print("ERROR: Response status code: ",response.status_code)
@@ -60,7 +60,7 @@ class AlphaAPI():
         params["symbol"]=self.symbol
         params["apikey"]=self.apikey
 
-        response=requests.get(self.base_url,params=params)
+        response=http_client.get(self.base_url,params=params)
 
         if (response.status_code!=200):
             print("ERROR: Response status code: ",response.status_code)
@@ -97,7 +97,7 @@ class AlphaAPI():
 
         success=False
         for retry_cnt in range(MAX_RETRY_PER_SYMBOL): 
-            response=requests.get(self.base_url,params=params)
+            response=http_client.get(self.base_url,params=params)
 
             if (response.status_code!=200):        
                 _time.sleep(0.2)
@@ -0,0 +1,593 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from yahoo_api import YahooAPI
+from indicators import IndicatorPipeline
+from indicator_state import IndicatorState
+from trade_logic import Stocks
+from backtesting import BackTesting,Indicators
+from datetime import datetime,timedelta
+from pathlib import Path
+
+import argparse
+import logging
+import platform
+import time
+import json
+import utils
+import numpy as np
+import pandas as pd
+
+BARS_PER_SESSION = {'1m':390,'5m':78}
+PERIOD_SMALL_EMA = 50
+PERIOD_BIG_EMA = 200
+
+def synthetic_bars(size,interval='5m',seed=0,mu=0.05,sigma=0.3):
+    '''
+    Deterministic synthetic OHLCV bars, as returned by YahooAPI.get_historic_data.
+
+    Prices follow a geometric brownian motion (yearly drift mu and volatility sigma)
+    during the regular session (9:30-16:00) of business days. Every session opens
+    with an overnight gap, both in time and in price.
+    '''
+    rng = np.random.default_rng(seed)
+    minutes = int(interval[:-1])
+    per_session = BARS_PER_SESSION[interval]
+
+    sessions = pd.bdate_range('2020-01-02',periods=-(-size//per_session))
+    session_offsets = pd.to_timedelta(np.arange(per_session)*minutes,unit='min')
+    timestamps = (sessions.values[:,None]+pd.Timedelta(hours=9,minutes=30).to_timedelta64()+session_offsets.values).ravel()[:size]
+
+    dt = minutes/(252*390)
+    intra = rng.normal((mu-sigma**2/2)*dt,sigma*np.sqrt(dt),size)
+    gaps = np.zeros(size)
+    session_opens = np.arange(per_session,size,per_session)
+    gaps[session_opens] = rng.normal(0,sigma*np.sqrt(1/252)/2,len(session_opens))
+
+    log_closes = np.log(100)+np.cumsum(gaps+intra)
+    closes = np.exp(log_closes)
+    opens = np.exp(log_closes-intra)
+    spread = np.abs(rng.normal(0,sigma*np.sqrt(dt)/2,(2,size)))
+
+    return pd.DataFrame({
+        'timestamps':timestamps,
+        'open':opens,
+        'close':closes,
+        'low':np.minimum(opens,closes)*np.exp(-spread[0]),
+        'high':np.maximum(opens,closes)*np.exp(spread[1]),
+        'volume':rng.integers(100,10000,size)})
+
+class OfflineYahooAPI(YahooAPI):
+    '''
+    YahooAPI serving synthetic bars instead of downloading them.
+    '''
+    def __init__(self,bars):
+        super().__init__()
+        self.bars = bars
+
+    def get_historic_data(self,ticker,start,end,interval,logger=None):
+        return self.bars.copy()
+
+class ReferenceYahooAPI(OfflineYahooAPI):
+    '''
+    The original (pandas and python loop) indicator implementations of YahooAPI, kept as
+    the reference for the parity checks.
+    '''
+    def calculate_EMAs(self,ticker,df,mytype,period,label,logger=None):
+        if df.dropna().empty:
+            return df.dropna()
+
+        timestamps=df.timestamps
+        points=df[mytype]
+
+        EMAs=[]
+
+        # 1) Calculate first SMA
+        if len(timestamps)<=period:
+            return pd.DataFrame
+
+        i=0
+        point = points[i]
+        while np.isnan(point):
+            EMAs.append(np.nan)
+            i+=1
+            point=points[i]
+
+        in_process=True
+        initial_points=[]
+        while in_process:
+            if not np.isnan(points[i]):
+                initial_points.append(points[i])
+            EMAs.append(np.nan)
+            i+=1
+
+            if len(initial_points)==period:
+                in_process=False
+
+        SMA = np.mean(initial_points)
+
+        # 2) Calculate first EMA
+        EMA_init=points[i]*(2/(1+period)) + SMA*(1-2/(1+period))
+        EMAs.append(EMA_init)
+        i+=1
+
+        # 3) Calculate other EMAs
+        length=len(timestamps)
+        for j in range(i,length):
+            EMA=points[j]*(2/(1+period)) + EMAs[j-1]*(1-2/(1+period))
+            EMAs.append(EMA)
+
+        # 4) Convert to to pandas df
+        result={'timestamps':timestamps,label:EMAs}
+        df=pd.DataFrame(result)
+
+        return df.set_index('timestamps')
+
+    def calculate_SAR(self,ticker,df):
+        if df.empty:
+            return df
+
+        df = df.sort_values('timestamps')
+
+        timestamps = df.timestamps
+        highs = df.high
+        opens = df.open
+        closes = df.close
+        lows = df.low
+
+        # Initialize values
+        alpha_prev = 0.02
+        if opens[0]>closes[0]:
+            trend_prev = "down"
+            EP_prev = lows[0]
+            SAR_prev = lows[0]
+        else:
+            trend_prev = "up"
+            EP_prev = highs[0]
+            SAR_prev = highs[0]
+
+        results = [SAR_prev]
+
+        # Caluclate SAR for each timestamp
+        for i in range(1,len(timestamps)):
+            if trend_prev=='up':
+                high = highs[i]
+                low = lows[i]
+
+                EP_new = max(EP_prev,high)
+                alpha_new = alpha_prev
+                if high>EP_prev and alpha_prev<=0.18:
+                        alpha_new+=0.02
+
+                SAR_new = SAR_prev + alpha_prev*(EP_prev-SAR_prev)
+
+                trend_new = trend_prev
+                if SAR_new>=low:
+                    trend_new = 'down'
+                    alpha_new = 0.02
+                    EP_new = low
+                    SAR_new = max(high,EP_prev)
+
+            elif trend_prev=='down':
+                high = highs[i]
+                low = lows[i]
+
+                EP_new = min(EP_prev,low)
+                alpha_new = alpha_prev
+
+                if low<EP_prev and alpha_prev<=0.18:
+                        alpha_new+=0.02
+
+                SAR_new = SAR_prev - alpha_prev*(SAR_prev-EP_prev)
+
+                trend_new = trend_prev
+                if SAR_new<=high:
+                    trend_new = 'up'
+                    alpha_new = 0.02
+                    EP_new = high
+                    SAR_new = min(low,EP_prev)
+
+            results.append(SAR_new)
+            trend_prev = trend_new
+            EP_prev = EP_new
+            alpha_prev = alpha_new
+            SAR_prev = SAR_new
+
+        df = pd.DataFrame({'timestamps':timestamps,'SAR':results})
+
+        return df.set_index('timestamps')
+
+    def calculate_oscillators(self,ticker,df,logger=None):
+        if df.empty:
+            return df
+
+        df = df.sort_values('timestamps')
+
+        timestamps = df.timestamps
+        highs = df.high
+        closes = df.close
+        lows = df.low
+
+        N = 140
+        # Initialize slow results
+        slow_results = [np.nan for i in range(1,N)]
+
+        # Calculate slow results for each timestamp
+        for i in range(N,len(timestamps)+1):
+            LN = min(lows[i-N:i])
+            HN = max(highs[i-N:i])
+            C = closes[i-1]
+
+            P_K = 100*(C-LN)/(HN-LN)
+            slow_results.append(P_K)
+
+        df = pd.DataFrame(list(zip(timestamps,slow_results)),columns=['timestamps','slow_oscillator'])
+
+        # Calculate fast results
+        df_fast_oscillator = self.calculate_EMAs(ticker,df,'slow_oscillator',30,'fast_oscillator',logger)
+
+        df_result = pd.concat([df.set_index('timestamps'),df_fast_oscillator],axis=1)
+
+        return df_result
+
+    def calculate_MACD(self,ticker,df,logger=None):
+        if df.empty:
+            return df
+
+        df = df.sort_values('timestamps')
+
+        df_EMA12=self.calculate_EMAs(ticker,df,'close',12,'EMA12',logger=logger)
+        df_EMA26=self.calculate_EMAs(ticker,df,'close',26,'EMA26',logger=logger)
+        if df_EMA12.empty or df_EMA26.empty:
+            return pd.DataFrame
+
+        df_MACD = pd.concat([df_EMA12,df_EMA26],axis=1).reset_index()
+        df_MACD['MACD_line'] = df_MACD.EMA12-df_MACD.EMA26
+
+        signal_line = self.calculate_EMAs(ticker,df_MACD,'MACD_line',9,'signal_line',logger)
+        df_MACD = pd.concat([df_MACD.set_index('timestamps'),signal_line],axis=1)
+        df_MACD['MACD_histo'] = df_MACD.MACD_line-df_MACD.signal_line
+
+        return df_MACD[['MACD_line','signal_line','MACD_histo']]
+
+    def calculate_RSI(self,ticker,df,logger=None):
+        if df.empty:
+            return df
+
+        # The original implementation adds its intermediate columns to the provided df
+        df = df.sort_values('timestamps')
+
+        period = 14
+
+        if len(df)<=period:
+            return pd.DataFrame
+
+        df_rsi = df
+        df_rsi['diff'] = df.close - df.open
+        df_rsi['gain'] = df_rsi['diff'].apply(lambda x: x if x>=0 else 0)
+        df_rsi['loss'] = df_rsi['diff'].apply(lambda x: x if x<0 else 0)
+
+        gains = list(df_rsi.gain)
+        losses = list(df_rsi.loss)
+        RSIs = [np.nan for i in range(period)]
+        for i in range(period,len(gains)):
+            avg_gain = np.mean(gains[i-14:i])
+            avg_loss = -np.mean(losses[i-14:i])
+            if avg_loss==0:
+                new_RSI=100
+            else:
+                new_RSI = 100 - (100/(1+(avg_gain/avg_loss)))
+            RSIs.append(new_RSI)
+
+        df_rsi['RSI'] = RSIs
+
+        df_rsi = df_rsi.set_index('timestamps')
+
+        return df_rsi[['RSI']]
+
+    def get_data(self,ticker,start,end,interval,period_small_EMA,period_big_EMA,logger=None):
+        df_data=self.get_historic_data(ticker,start,end,interval,logger=logger)
+        if df_data.empty:
+            return df_data
+
+        results=[
+            self.calculate_EMAs(ticker,df_data,'close',period_small_EMA,'smallEMA',logger=logger),
+            self.calculate_EMAs(ticker,df_data,'close',period_big_EMA,'bigEMA',logger=logger),
+            self.calculate_EMAs(ticker,df_data,'close',1,'simpleEMA',logger=logger),
+            self.calculate_EMAs(ticker,df_data,'close',20,'advancedEMA',logger=logger),
+            self.calculate_SAR(ticker,df_data),
+            self.calculate_oscillators(ticker,df_data,logger),
+            self.calculate_MACD(ticker,df_data,logger),
+            self.calculate_RSI(ticker,df_data,logger)]
+        if any(result.empty for result in results):
+            return pd.DataFrame
+
+        df=pd.concat([df_data.set_index('timestamps')]+results,axis=1,join='outer').reset_index()
+        df.drop('index',axis=1,inplace=True,errors='ignore')
+        df.sort_values("timestamps",inplace=True)
+
+        return df
+
+# Benchmarked functions: name -> function(api,bars) returning a dataframe
+BENCHMARKS = {
+    'calculate_EMAs':lambda api,bars: api.calculate_EMAs('BENCH',bars,'close',PERIOD_BIG_EMA,'bigEMA'),
+    'calculate_SAR':lambda api,bars: api.calculate_SAR('BENCH',bars),
+    'calculate_oscillators':lambda api,bars: api.calculate_oscillators('BENCH',bars),
+    'calculate_MACD':lambda api,bars: api.calculate_MACD('BENCH',bars),
+    'calculate_RSI':lambda api,bars: api.calculate_RSI('BENCH',bars),
+    'get_data':lambda api,bars: api.get_data('BENCH',None,None,'5m',PERIOD_SMALL_EMA,PERIOD_BIG_EMA),
+}
+
+def stream_bars(bars,chunk=12,overlap=12,revision=1e-3):
+    '''
+    Feeds the bars to an IndicatorState in chunks of chunk bars, the way the live loop
+    downloads them: every download repeats the overlap bars before the latest processed
+    bar, and the latest bar of a download is revised by the next one (as the bar Yahoo
+    is still forming). Returns the state, or None if it refused a download.
+    '''
+    state = IndicatorState(PERIOD_SMALL_EMA,PERIOD_BIG_EMA)
+    close = bars.columns.get_loc('close')
+    for end in range(chunk,len(bars)+chunk,chunk):
+        df_bars = bars.iloc[max(0,end-chunk-overlap):end].copy()
+        if end<len(bars):
+            df_bars.iloc[-1,close] *= 1+revision
+        if not state.update(df_bars):
+            return None
+
+    return state
+
+class OfflineStocks(Stocks):
+    '''
+    Stocks serving the synthetic bars of the requested range (gmtoffset 0), the latest
+    bar being revised by every download (as the bar Yahoo is still forming).
+    '''
+    def __init__(self,bars,revision=1e-3):
+        super().__init__(balance=[0,0],bought_stocks={},monitored_stocks=[],current_status={},monitored_stock_data={},
+                         archive=[],interesting_stocks=[],not_interesting_stocks=[],yahoo_calls={},results={})
+        self.bars = bars
+        self.revision = revision
+        self.downloads = 0
+
+    def get_historic_data(self,ticker,start,end,interval,logger=None):
+        self.gmtoffsets[ticker] = 0
+        self.downloads += 1
+        timestamps = self.bars.timestamps
+        df = self.bars[(timestamps>=self.get_exchange_time(ticker,start))&(timestamps<self.get_exchange_time(ticker,end))].reset_index(drop=True)
+        if not df.empty:
+            df.loc[len(df)-1,'close'] *= 1+self.revision*(-1)**self.downloads
+        return df
+
+class RebuildCounter(logging.Handler):
+    '''
+    Counts the log records about rebuilding an indicator state.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.rebuilds = 0
+
+    def emit(self,record):
+        if 'rebuilding' in record.getMessage():
+            self.rebuilds += 1
+
+def live_updates(bars,window=560,check_interval=3):
+    '''
+    Runs Stocks.get_incremental_data once per bar, with a data window of window bars, the
+    forming latest bar revised by every download and a consistency check every check_interval
+    updates. The state should never be rebuilt. The reference is the download of the whole
+    window followed by the batch indicators. Returns a result dict as run (median durations).
+    '''
+    stocks = OfflineStocks(bars)
+    config_params = {'trade_logic':{'yahoo_period_small_EMA':PERIOD_SMALL_EMA,'yahoo_period_big_EMA':PERIOD_BIG_EMA,
+                                    'yahoo_indicators':None,'yahoo_interval':'5m','indicator_check_interval':check_interval}}
+    counter = RebuildCounter()
+    logger = logging.getLogger('benchmark_indicators')
+    logger.addHandler(counter)
+
+    # Requests are in CEST, the bars (gmtoffset 0) in UTC
+    dates = (bars.timestamps+pd.Timedelta(hours=2)).dt.to_pydatetime()
+    reference_stocks = OfflineStocks(bars)
+    durations,reference_durations = [],[]
+    for index in range(window,len(bars)):
+        start,end = dates[index-window],dates[index]+timedelta(minutes=1)
+        _,seconds = best_time(lambda: stocks.get_incremental_data('BENCH',start,end,config_params,logger),1)
+        durations.append(seconds)
+        _,seconds = best_time(lambda: IndicatorPipeline(reference_stocks.get_historic_data('BENCH',start,end,'5m'),PERIOD_SMALL_EMA,PERIOD_BIG_EMA).frame(None),1)
+        reference_durations.append(seconds)
+
+    logger.removeHandler(counter)
+    state = stocks.indicator_states['BENCH']
+    seconds,reference_seconds = float(np.median(durations)),float(np.median(reference_durations))
+
+    return {'function':'IndicatorState live','size':len(bars),'seconds':seconds,'reference_seconds':reference_seconds,
+            'speedup':reference_seconds/seconds,'parity':counter.rebuilds==0 and state.checked_at>0,'max_rel_diff':None}
+
+class OfflineBackTesting(BackTesting):
+    '''
+    BackTesting of one stock on the synthetic bars, without the logs, plots and screening
+    of BackTesting. The results of calculate_result are collected as tuples
+    (bought,price_bought,sold_series,comment).
+    '''
+    def __init__(self,bars,start):
+        Stocks.__init__(self,balance=[10000,10000],bought_stocks={},monitored_stocks=['BENCH'],current_status={'BENCH':{'exchange':'NYSE','virtual_result':'-'}},
+                        monitored_stock_data={},archive=[],interesting_stocks=[],not_interesting_stocks=[],yahoo_calls={},results={})
+        self.bars = bars
+        self.start = start
+        self.sell_criterium = 'EMA'
+        self.M = 500
+        self.Pavg = 20
+        self.indicators = Indicators()
+        self.conf = utils.read_config("./config/config.json")
+        self.logger = logging.getLogger('benchmark_indicators')
+        self.collected = []
+
+    def get_historic_data(self,ticker,start,end,interval,logger=None):
+        return self.bars.copy()
+
+    def append_result(self,df,timestamp,stock,start_date,bought,price_bought,sold_series,params,comment):
+        self.collected.append((bought,price_bought,sold_series,comment))
+
+def sweep_parity(bars,hours=(9.5,12,15.5)):
+    '''
+    Compares sweep_EMA_pairs for the configured pair of EMA periods to calculate_result,
+    for backtests starting at the given hours of every session but the first: both should
+    drop the same backtests and give the same results. Returns a result dict as run.
+    '''
+    days = pd.to_datetime(bars.timestamps.dt.normalize().unique()[1:])
+    starts = [day+pd.Timedelta(hours=hour) for day in days for hour in hours]
+    parity = True
+    seconds = reference_seconds = 0.0
+    for start in starts:
+        backtest = OfflineBackTesting(bars,start.to_pydatetime())
+        periods = [backtest.conf['trade_logic']['yahoo_period_small_EMA']],[backtest.conf['trade_logic']['yahoo_period_big_EMA']]
+        df,duration = best_time(lambda: backtest.sweep_EMA_pairs('BENCH',*periods),1)
+        seconds += duration
+        _,duration = best_time(lambda: backtest.calculate_result('BENCH'),1)
+        reference_seconds += duration
+
+        rows = [] if df is False else list(df.itertuples())
+        if len(rows)!=len(backtest.collected):
+            parity = False
+            continue
+        for row,(bought,price_bought,sold_series,comment) in zip(rows,backtest.collected):
+            if row.comment!=comment:
+                parity = False
+            elif comment!="Never bought":
+                t_sold,Pe,N = sold_series[0]
+                parity = parity and (row.bought,row.price_bought,row.sold,row.price_sold,row.number)==(bought,price_bought,t_sold,round(Pe,3),N)
+
+    return {'function':'sweep_EMA_pairs','size':len(bars),'seconds':seconds,'reference_seconds':reference_seconds,
+            'speedup':reference_seconds/seconds,'parity':parity,'max_rel_diff':None}
+
+def stream_parity(bars):
+    '''
+    Compares the streaming indicators of stream_bars to the batch indicators of IndicatorPipeline.
+    Returns a result dict as run.
+    '''
+    state,seconds = best_time(lambda: stream_bars(bars),1)
+    df_reference,reference_seconds = best_time(lambda: IndicatorPipeline(bars,PERIOD_SMALL_EMA,PERIOD_BIG_EMA).frame(None),1)
+
+    parity,max_rel_diff = False,None
+    if state is not None:
+        parity,max_rel_diff = compare(state.frame(),df_reference)
+        parity = parity and state.consistent_with(bars)
+
+    return {'function':'IndicatorState','size':len(bars),'seconds':seconds,'reference_seconds':reference_seconds,
+            'speedup':reference_seconds/seconds,'parity':parity,'max_rel_diff':max_rel_diff}
+
+def best_time(function,repeat):
+    '''
+    Returns the result of function and the best duration (in seconds) of repeat calls.
+    '''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter()-start)
+
+    return result,min(durations)
+
+def compare(df,df_reference,rtol=1e-9):
+    '''
+    Returns (parity,max_rel_diff) of the numeric columns of df against df_reference.
+    Differences are relative to the largest absolute value of the column, since values
+    that cancel out (e.g. MACD_histo) have no meaningful relative error of their own.
+    Columns that the reference implementation adds on top (e.g. the intermediate RSI
+    columns) are ignored.
+    '''
+    if isinstance(df,type) or isinstance(df_reference,type):
+        return (df is df_reference),None
+    if len(df)!=len(df_reference):
+        return False,None
+
+    max_rel_diff = 0.0
+    parity = True
+    for column in df.columns:
+        if column=='timestamps':
+            parity = parity and df.timestamps.equals(df_reference.timestamps)
+            continue
+        if not column in df_reference.columns:
+            return False,None
+
+        values = df[column].to_numpy(dtype=float)
+        reference = df_reference[column].to_numpy(dtype=float)
+        if not np.array_equal(np.isnan(values),np.isnan(reference)):
+            parity = False
+        valid = ~(np.isnan(values)|np.isnan(reference))
+        if valid.any():
+            scale = max(np.abs(reference[valid]).max(),1e-12)
+            max_rel_diff = max(max_rel_diff,float(np.abs(values[valid]-reference[valid]).max()/scale))
+
+    return parity and max_rel_diff<=rtol,max_rel_diff
+
+def run(sizes,interval,repeat,max_reference_size,seed):
+    results = []
+    for size in sizes:
+        bars = synthetic_bars(size,interval,seed)
+        api = OfflineYahooAPI(bars)
+        reference_api = ReferenceYahooAPI(bars)
+
+        for name,benchmark in BENCHMARKS.items():
+            df,seconds = best_time(lambda: benchmark(api,bars),repeat)
+            result = {'function':name,'size':size,'seconds':seconds,
+                      'reference_seconds':None,'speedup':None,'parity':None,'max_rel_diff':None}
+
+            if size<=max_reference_size:
+                df_reference,reference_seconds = best_time(lambda: benchmark(reference_api,bars.copy()),1)
+                parity,max_rel_diff = compare(df,df_reference)
+                result.update({'reference_seconds':reference_seconds,'speedup':reference_seconds/seconds,
+                               'parity':parity,'max_rel_diff':max_rel_diff})
+
+            results.append(result)
+            print("{:<22} {:>8} bars  {:>10.5f} s  reference {:>10}  parity {}".format(
+                name,size,seconds,
+                "{:.5f} s".format(result['reference_seconds']) if result['reference_seconds'] is not None else "-",
+                result['parity'] if result['parity'] is not None else "-"))
+
+        # Streaming against batch indicators (the reference is the batch computation), live
+        # updates (one update against one batch computation of the data window) and the EMA
+        # pair sweep against calculate_result
+        if size<=max_reference_size:
+            for result in (stream_parity(bars),live_updates(bars.iloc[:1000]),sweep_parity(bars.iloc[:3000])):
+                results.append(result)
+                print("{:<22} {:>8} bars  {:>10.5f} s  reference {:>10}  parity {}".format(
+                    result['function'],result['size'],result['seconds'],"{:.5f} s".format(result['reference_seconds']),result['parity']))
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s','--sizes',default='1000,10000,100000,1000000',type=str)
+    parser.add_argument('-i','--interval',default='5m',choices=list(BARS_PER_SESSION),type=str)
+    parser.add_argument('-r','--repeat',default=3,type=int)
+    parser.add_argument('-m','--max_reference_size',default=20000,type=int)
+    parser.add_argument('--seed',default=0,type=int)
+    parser.add_argument('-o','--output_dir',default='./benchmark/',type=str)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes,args.interval,args.repeat,args.max_reference_size,args.seed)
+
+    output = {
+        'timestamp':datetime.now().strftime('%Y/%m/%d-%H:%M:%S'),
+        'python':platform.python_version(),
+        'numpy':np.__version__,
+        'pandas':pd.__version__,
+        'interval':args.interval,
+        'repeat':args.repeat,
+        'seed':args.seed,
+        'results':results}
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True,exist_ok=True)
+    output_file = output_dir / "indicators_{}.json".format(datetime.now().strftime('%Y%m%d_%H%M%S'))
+    with open(output_file,'w') as f:
+        json.dump(output,f,indent=2)
+
+    print("Results written to {}".format(output_file))
+
+    if any(result['parity'] is False for result in results):
+        raise SystemExit("Parity check against the reference implementations failed.")
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from yahoo_scraping import QuoteSnapshot
+from http_client import Cassette
+from bs4 import BeautifulSoup as Soup
+from datetime import datetime
+from pathlib import Path
+
+import argparse
+import logging
+import platform
+import random
+import time
+import json
+import bs4
+
+MARKET_STATE_LABELS = {
+    'OPEN':'Market open.',
+    'CLOSED':'At close: 4:00PM EDT',
+    'BEFORE_HOURS':'Before hours: 8:12AM EDT',
+    'AFTER_HOURS':'After hours: 6:45PM EDT',
+}
+
+def synthetic_page(ticker,fullname,market_state='OPEN',size=500000,seed=0):
+    '''
+    Returns a synthetic yahoo quote page (bytes) of about size bytes: the fields scraped
+    by QuoteSnapshot, surrounded by nested markup and a large inline script like the
+    real pages.
+    '''
+    rng = random.Random(seed)
+    labels = [MARKET_STATE_LABELS[market_state]]
+    if market_state in ('BEFORE_HOURS','AFTER_HOURS'):
+        labels.insert(0,MARKET_STATE_LABELS['CLOSED'])
+
+    filler = []
+    length = 0
+    while length<size//2:
+        item = '<div class="Mb({0}px) D(ib)"><a href="/quote/X{0}">X{0}</a><span>{1:.2f}</span><span>{2:+.2f}%</span></div>'.format(
+            rng.randint(0,99999),rng.uniform(1,500),rng.uniform(-10,10))
+        filler.append(item)
+        length += len(item)
+
+    script = 'root.App.main = {{"context":{{"data":"{}"}}}};'.format('x'*(size//2))
+    page = ''.join([
+        '<!DOCTYPE html><html><head><meta charset="utf-8">',
+        '<title>{} ({}) Stock Price, News, Quote &amp; History - Yahoo Finance</title>'.format(fullname,ticker),
+        '</head><body><div id="app"><div class="YDC-Header">',
+        ''.join(filler[:len(filler)//2]),
+        '</div><div id="quote-header-info"><div><h1 class="D(ib) Fz(18px)">{} ({})</h1></div>'.format(fullname,ticker),
+        '<div class="C($tertiaryColor) Fz(12px)"><span>NasdaqGS - NasdaqGS Real Time Price. Currency in USD</span></div>',
+        '<div>',
+        ''.join('<div><span class="Fw(b) Fz(36px)">{:.2f}</span><span>{}</span></div>'.format(rng.uniform(1,500),label) for label in labels),
+        '</div></div><div id="quote-summary">',
+        ''.join(filler[len(filler)//2:]),
+        '</div></div><script>{}</script></body></html>'.format(script),
+    ])
+
+    return page.encode('utf-8')
+
+def synthetic_pages(number,size,seed):
+    pages = []
+    for i in range(number):
+        ticker = 'T{}'.format(i)
+        market_state = list(MARKET_STATE_LABELS)[i%len(MARKET_STATE_LABELS)]
+        pages.append((ticker,synthetic_page(ticker,'Company {} &amp; Co'.format(i),market_state,size,seed+i)))
+
+    return pages
+
+def cassette_pages(directory):
+    '''
+    Returns the (ticker,page) tuples of the quote pages recorded in a cassette (see http_client.Cassette).
+    '''
+    cassette = Cassette(directory)
+    pages = []
+    for entry in cassette.index.values():
+        url = entry['url'].rstrip('/')
+        if not '/quote/' in url or url.endswith('/profile') or entry['status_code']!=200:
+            continue
+        pages.append((url.split('/')[-1],cassette.load(entry['url'],entry['params']).content))
+
+    return pages
+
+def best_time(function,repeat):
+    '''
+    Returns the result of function and the best duration (in seconds) of repeat calls.
+    '''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter()-start)
+
+    return result,min(durations)
+
+def fields(snapshot):
+    return {'fullname':snapshot.fullname,'exchange':snapshot.exchange,'market_state':snapshot.market_state}
+
+def run(pages,repeat,logger):
+    results = []
+    for ticker,page in pages:
+        fast,seconds = best_time(lambda: QuoteSnapshot.from_html(ticker,page,logger),repeat)
+        reference,reference_seconds = best_time(lambda: QuoteSnapshot.from_soup(ticker,Soup(page,'html.parser'),logger),1)
+
+        result = {'ticker':ticker,'bytes':len(page),'seconds':seconds,'reference_seconds':reference_seconds,
+                  'speedup':reference_seconds/seconds,'parity':fields(fast)==fields(reference),
+                  'fields':fields(fast)}
+        results.append(result)
+        print("{:<8} {:>9} bytes  {:>9.6f} s  reference {:>9.6f} s  parity {}".format(
+            ticker,len(page),seconds,reference_seconds,result['parity']))
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c','--cassette_dir',default=None,type=str)
+    parser.add_argument('-n','--number_of_pages',default=8,type=int)
+    parser.add_argument('-b','--page_size',default=500000,type=int)
+    parser.add_argument('-r','--repeat',default=5,type=int)
+    parser.add_argument('--seed',default=0,type=int)
+    parser.add_argument('-o','--output_dir',default='./benchmark/',type=str)
+    args = parser.parse_args()
+
+    if args.cassette_dir:
+        pages = cassette_pages(args.cassette_dir)
+    else:
+        pages = synthetic_pages(args.number_of_pages,args.page_size,args.seed)
+
+    logger = logging.getLogger("benchmark")
+    results = run(pages,args.repeat,logger)
+
+    output = {
+        'timestamp':datetime.now().strftime('%Y/%m/%d-%H:%M:%S'),
+        'python':platform.python_version(),
+        'bs4':bs4.__version__,
+        'source':args.cassette_dir if args.cassette_dir else 'synthetic',
+        'repeat':args.repeat,
+        'seed':args.seed,
+        'results':results}
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True,exist_ok=True)
+    output_file = output_dir / "scraping_{}.json".format(datetime.now().strftime('%Y%m%d_%H%M%S'))
+    with open(output_file,'w') as f:
+        json.dump(output,f,indent=2)
+
+    print("Results written to {}".format(output_file))
+
+    if any(not result['parity'] for result in results):
+        raise SystemExit("Parity check against the BeautifulSoup parser failed.")
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+import atexit
+import os
+import random
+import time
+import threading
+import hashlib
+import gzip
+import json
+import mmap
+import requests
+import rate_limiter
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Default settings, overruled by the "http" section of the config file
+DEFAULT_CONFIG={
+    'connect_timeout':3.05,
+    'read_timeout':10.0,
+    'retries':2,
+    'backoff':0.5,
+    'backoff_max':8.0,
+    'pool_size':10,
+    'cassette_mode':'off',
+    'cassette_dir':'./cassettes/',
+}
+
+# Modes of the cassette: 'off' (live requests), 'record' (live requests, responses are saved)
+# and 'replay' (saved responses only, no network access)
+CASSETTE_MODES=['off','record','replay']
+
+# Status codes for which the request is retried
+RETRY_STATUS_CODES={429,500,502,503,504}
+
+# A response with status code 429 (too many requests) from these domains throttles the
+# rate limiter of the yahoo calls (see rate_limiter.RateLimiter.throttle)
+THROTTLE_DOMAINS=('yahoo.com',)
+
+class HTTPClient:
+    '''
+    HTTP client shared by the yahoo and alpha vantage clients.
+
+    All requests go through pooled keep-alive sessions (so TCP/TLS connections are
+    reused), ask for gzip compressed responses and have connect/read timeouts.
+    Connection errors, timeouts and the status codes of RETRY_STATUS_CODES are retried
+    at most retries times, with a jittered exponential backoff.
+
+    requests.Session isn't thread safe, so a session is only used by one thread at a time:
+    every request takes an idle session (a new one if all are in use, e.g. by the threads
+    of Stocks.prefetch_monitored_stocks) and gives it back afterwards.
+    '''
+    def __init__(self,**config):
+        self.lock=threading.Lock()
+        self.sessions=[]
+        self.idle=[]
+        self.pool_size=None
+        self.cassette=None
+        self.configure(**config)
+
+    def configure(self,**config):
+        '''
+        Updates the settings (see DEFAULT_CONFIG). The session and its open connections
+        are kept, unless the pool size changes.
+        '''
+        settings=dict(DEFAULT_CONFIG,**config)
+        self.connect_timeout=float(settings['connect_timeout'])
+        self.read_timeout=float(settings['read_timeout'])
+        self.retries=int(settings['retries'])
+        self.backoff=float(settings['backoff'])
+        self.backoff_max=float(settings['backoff_max'])
+
+        pool_size=int(settings['pool_size'])
+        if pool_size!=self.pool_size:
+            with self.lock:
+                self.pool_size=pool_size
+                for session in self.sessions:
+                    self.mount(session)
+
+        mode=settings['cassette_mode']
+        if not mode in CASSETTE_MODES:
+            raise ValueError("Invalid cassette mode: {}. Choose from {}.".format(mode,CASSETTE_MODES))
+        if self.cassette and (mode=='off' or self.cassette.directory!=Path(settings['cassette_dir'])):
+            self.cassette.flush()
+            self.cassette=None
+        if mode!='off':
+            if self.cassette is None:
+                self.cassette=Cassette(settings['cassette_dir'],mode=mode)
+            else:
+                self.cassette.mode=mode
+
+    def mount(self,session):
+        adapter=HTTPAdapter(pool_connections=self.pool_size,pool_maxsize=self.pool_size)
+        session.mount('https://',adapter)
+        session.mount('http://',adapter)
+
+    def acquire_session(self):
+        '''
+        Returns an idle session, or a new one if all sessions are in use.
+        '''
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+
+            session=requests.Session()
+            session.headers.update({'Accept-Encoding':'gzip, deflate'})
+            self.mount(session)
+            self.sessions.append(session)
+            return session
+
+    def release_session(self,session):
+        with self.lock:
+            self.idle.append(session)
+
+    def get(self,url,params=None,**kwargs):
+        '''
+        Same as requests.get, with the timeouts and retries of the client. Returns the
+        last response (which can have an error status code), or raises the exception
+        of the last attempt. A timeout passed by the caller overrules the configured timeouts.
+        A final 429 response of a yahoo domain throttles the rate limiter.
+        In replay mode, the response is served from the cassette (see Cassette.load).
+        '''
+        if self.cassette and self.cassette.mode=='replay':
+            return self.cassette.load(url,params)
+
+        timeout=kwargs.pop('timeout',None)
+        if timeout is None:
+            timeout=(self.connect_timeout,self.read_timeout)
+
+        session=self.acquire_session()
+        try:
+            attempt=0
+            while True:
+                try:
+                    response=session.get(url,params=params,timeout=timeout,**kwargs)
+                    if attempt>=self.retries or not response.status_code in RETRY_STATUS_CODES:
+                        if self.cassette and self.cassette.mode=='record':
+                            self.cassette.save(url,params,response)
+                        if response.status_code==429 and self.throttles(url):
+                            rate_limiter.get_limiter().throttle()
+                        return response
+                except (requests.ConnectionError,requests.Timeout):
+                    if attempt>=self.retries:
+                        raise
+
+                time.sleep(self.backoff_delay(attempt))
+                attempt+=1
+        finally:
+            self.release_session(session)
+
+    @staticmethod
+    def throttles(url):
+        host=urlparse(url).hostname or ''
+        return any(host==domain or host.endswith('.'+domain) for domain in THROTTLE_DOMAINS)
+
+    def backoff_delay(self,attempt):
+        '''
+        Random delay between 0 and the exponential backoff of the attempt ("full jitter").
+        '''
+        return random.uniform(0,min(self.backoff_max,self.backoff*2**attempt))
+
+class Cassette:
+    '''
+    Record/replay store of HTTP responses, for offline and reproducible runs.
+
+    Every response is saved as a gzip compressed file directory/<key>.gz, the key being a hash
+    of the url and the (sorted) query parameters. index.json maps the keys to the url, status
+    code and headers of the responses. While recording, new entries are appended to
+    index.jsonl (one JSON line per response), which is merged into index.json by flush()
+    (called at exit), so recording doesn't rewrite the whole index for every response.
+    In replay mode the compressed files are memory-mapped and decompressed on request. Only
+    requests with the same url and query parameters as a recorded one are served.
+    '''
+    def __init__(self,directory,mode='replay'):
+        self.directory=Path(directory)
+        self.mode=mode
+        self.lock=threading.Lock()
+        self.index=self.read_index()
+        self.maps={}
+        atexit.register(self.flush)
+
+    def read_index(self):
+        index={}
+        index_file=self.directory/"index.json"
+        if index_file.exists():
+            with open(index_file,'r') as f:
+                index=json.load(f)
+
+        journal_file=self.directory/"index.jsonl"
+        if journal_file.exists():
+            with open(journal_file,'r') as f:
+                for line in f:
+                    try:
+                        key,entry=json.loads(line)
+                    except ValueError:
+                        # Line cut off by a crash while recording
+                        continue
+                    index[key]=entry
+
+        return index
+
+    def append_index(self,key,entry):
+        with open(self.directory/"index.jsonl",'a') as f:
+            f.write(json.dumps([key,entry])+"\n")
+
+    def flush(self):
+        '''
+        Writes the index to index.json (atomically) and removes the appended entries of index.jsonl.
+        '''
+        with self.lock:
+            journal_file=self.directory/"index.jsonl"
+            if not journal_file.exists():
+                return
+
+            temp_file=self.directory/"index.json.tmp"
+            with open(temp_file,'w') as f:
+                json.dump(self.index,f,indent=2)
+            os.replace(temp_file,self.directory/"index.json")
+            journal_file.unlink()
+
+    @staticmethod
+    def get_key(url,params=None):
+        params=sorted((str(key),str(value)) for key,value in (params or {}).items())
+        return hashlib.sha1(json.dumps([url,params]).encode('utf-8')).hexdigest()
+
+    def save(self,url,params,response):
+        key=self.get_key(url,params)
+        entry={
+            'url':url,
+            'params':{str(key):str(value) for key,value in (params or {}).items()},
+            'status_code':response.status_code,
+            'headers':{'Content-Type':response.headers.get('Content-Type','')},
+            'recorded':time.time(),
+        }
+
+        with self.lock:
+            self.directory.mkdir(parents=True,exist_ok=True)
+            with open(self.directory/(key+".gz"),'wb') as f:
+                f.write(gzip.compress(response.content))
+            self.maps.pop(key,None)
+            self.index[key]=entry
+            self.append_index(key,entry)
+
+    def find(self,url,params=None):
+        '''
+        Returns the key of the recorded response for the request, or None.
+        '''
+        key=self.get_key(url,params)
+        if key in self.index:
+            return key
+
+        return None
+
+    def load(self,url,params=None):
+        '''
+        Returns the recorded response for the request as a requests.Response. Raises
+        requests.ConnectionError if the request was not recorded.
+        '''
+        key=self.find(url,params)
+        if key is None:
+            raise requests.ConnectionError("No recorded response in cassette {} for {} {}".format(self.directory,url,params))
+
+        with self.lock:
+            if not key in self.maps:
+                with open(self.directory/(key+".gz"),'rb') as f:
+                    self.maps[key]=mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            content=gzip.decompress(self.maps[key])
+
+        entry=self.index[key]
+        response=requests.Response()
+        response.status_code=entry['status_code']
+        response.headers=CaseInsensitiveDict(entry['headers'])
+        response.url=entry['url']
+        response.encoding=requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+        response._content=content
+
+        return response
+
+_client=None
+_client_lock=threading.Lock()
+
+def get_client():
+    '''
+    Returns the shared HTTPClient, created with the default settings if not configured yet.
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client=HTTPClient()
+    return _client
+
+def configure(config):
+    '''
+    Applies the "http" section of the config params to the shared HTTPClient.
+    '''
+    get_client().configure(**config)
+
+def get(url,params=None,**kwargs):
+    return get_client().get(url,params=params,**kwargs)
@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+from indicators import INDICATORS,IndicatorPipeline,ema_filter,rolling_min,rolling_max,sar,resolve_indicators
+
+BASE_COLUMNS=['timestamps','open','close','low','high','volume']
+# Columns the indicators are calculated from
+PRICE_COLUMNS=['open','close','low','high']
+# Relative tolerance of the comparisons of downloaded and stored values
+RTOL=1e-7
+# Up to this number of points, streams run their recursion in python: the vectorized
+# filters have a fixed cost that dominates for the few bars of a live update
+SHORT_UPDATE=16
+
+### STREAMING INDICATORS ###
+# Every stream returns its indicator columns for new bars with update_bars(bars), save() returns
+# its (small) state and restore(saved) goes back to it (see IndicatorState.update)
+class EMAState:
+    '''
+    Streaming version of indicators.ema: SMA-seeded EMA with the same NaN handling.
+    '''
+    def __init__(self,period):
+        self.period=period
+        self.alpha=2/(1+period)
+        self.seed=[]
+        self.value=None
+        self.ready=False
+
+    def update(self,points):
+        '''
+        Returns the EMA values for the new points.
+        '''
+        points=np.asarray(points,dtype=float)
+        result=np.full(len(points),np.nan)
+        first=0
+
+        if self.value is None:
+            valid=np.flatnonzero(~np.isnan(points))
+            needed=self.period-len(self.seed)
+            if len(valid)<needed:
+                self.seed.extend(points[valid])
+                return result
+
+            self.seed.extend(points[valid[:needed]])
+            self.value=np.mean(self.seed)
+            self.seed=[]
+            first=valid[needed-1]+1
+
+        if first<len(points):
+            if len(points)-first<=SHORT_UPDATE:
+                value=self.value
+                for index in range(first,len(points)):
+                    value=self.alpha*points[index]+(1-self.alpha)*value
+                    result[index]=value
+            else:
+                result[first:]=ema_filter(points[first:],self.alpha,self.value)
+            self.value=result[-1]
+            self.ready=True
+
+        return result
+
+    def update_bars(self,bars):
+        return (self.update(bars['close']),)
+
+    def save(self):
+        return tuple(self.seed),self.value,self.ready
+
+    def restore(self,saved):
+        seed,self.value,self.ready=saved
+        self.seed=list(seed)
+
+class _RollingAverage:
+    '''
+    Average of the period values before every new value (indicators.rsi, 'simple').
+    '''
+    def __init__(self,period):
+        self.period=period
+        self.tail=np.empty(0)
+        self.count=0
+
+    def update(self,points):
+        history=np.concatenate((self.tail,points))
+        sums=np.concatenate(([0.0],np.cumsum(history)))
+        positions=len(self.tail)+np.arange(len(points))
+        valid=(self.count+np.arange(len(points)))>=self.period
+
+        result=np.full(len(points),np.nan)
+        result[valid]=(sums[positions[valid]]-sums[positions[valid]-self.period])/self.period
+
+        self.tail=history[-self.period:]
+        self.count+=len(points)
+        return result
+
+    def save(self):
+        # The tail is replaced by every update, never modified
+        return self.tail,self.count
+
+    def restore(self,saved):
+        self.tail,self.count=saved
+
+class _WilderAverage:
+    '''
+    Wilder average of the values before every new value (indicators.rsi, 'wilder').
+    '''
+    def __init__(self,period):
+        self.period=period
+        self.seed=[]
+        self.average=None
+        self.pending=None
+
+    def update(self,points):
+        result=np.full(len(points),np.nan)
+        first=0
+
+        if self.average is None:
+            needed=self.period-len(self.seed)
+            self.seed.extend(points[:needed])
+            if len(self.seed)<self.period or needed>=len(points):
+                return result
+            self.average=np.mean(self.seed)
+            self.seed=[]
+            first=needed
+
+        if self.pending is None:
+            result[first]=self.average
+            self.pending=points[first]
+            first+=1
+
+        if first<len(points):
+            inputs=np.concatenate(([self.pending],points[first:-1]))
+            result[first:]=ema_filter(inputs,1/self.period,self.average)
+            self.average=result[-1]
+            self.pending=points[-1]
+
+        return result
+
+    def save(self):
+        return tuple(self.seed),self.average,self.pending
+
+    def restore(self,saved):
+        seed,self.average,self.pending=saved
+        self.seed=list(seed)
+
+class RSIState:
+    '''
+    Streaming version of indicators.rsi.
+    '''
+    def __init__(self,period=14,smoothing='simple'):
+        if smoothing=='simple':
+            self.gains=_RollingAverage(period)
+            self.losses=_RollingAverage(period)
+        elif smoothing=='wilder':
+            self.gains=_WilderAverage(period)
+            self.losses=_WilderAverage(period)
+        else:
+            raise ValueError("No valid RSI smoothing ({}) has been provided. Valid options are simple or wilder.".format(smoothing))
+        self.ready=False
+
+    def update(self,opens,closes):
+        diff=np.asarray(closes,dtype=float)-np.asarray(opens,dtype=float)
+        avg_gain=self.gains.update(np.where(diff>=0,diff,0.0))
+        avg_loss=self.losses.update(np.where(diff<0,-diff,0.0))
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+            result=np.where(avg_loss==0,100.0,100-(100/(1+(avg_gain/avg_loss))))
+        result[np.isnan(avg_gain)]=np.nan
+
+        self.ready=self.ready or not np.isnan(result).all()
+        return result
+
+    def update_bars(self,bars):
+        return (self.update(bars['open'],bars['close']),)
+
+    def save(self):
+        return self.gains.save(),self.losses.save(),self.ready
+
+    def restore(self,saved):
+        gains,losses,self.ready=saved
+        self.gains.restore(gains)
+        self.losses.restore(losses)
+
+class OscillatorState:
+    '''
+    Streaming version of indicators.oscillators. Only the last period-1 highs and lows
+    are kept to extend the rolling windows.
+    '''
+    def __init__(self,period=140,fast_period=30):
+        self.period=period
+        self.highs=np.empty(0)
+        self.lows=np.empty(0)
+        self.fast=EMAState(fast_period)
+        self.ready=True
+
+    def update(self,highs,lows,closes):
+        highs=np.concatenate((self.highs,highs))
+        lows=np.concatenate((self.lows,lows))
+        new=len(closes)
+
+        HN=rolling_max(highs,self.period)[-new:]
+        LN=rolling_min(lows,self.period)[-new:]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            slow=100*(np.asarray(closes,dtype=float)-LN)/(HN-LN)
+
+        keep=self.period-1
+        self.highs=highs[max(0,len(highs)-keep):] if keep else np.empty(0)
+        self.lows=lows[max(0,len(lows)-keep):] if keep else np.empty(0)
+
+        return slow,self.fast.update(slow)
+
+    def update_bars(self,bars):
+        return self.update(bars['high'],bars['low'],bars['close'])
+
+    def save(self):
+        # The highs and lows are replaced by every update, never modified
+        return self.highs,self.lows,self.fast.save()
+
+    def restore(self,saved):
+        self.highs,self.lows,fast=saved
+        self.fast.restore(fast)
+
+class MACDState:
+    '''
+    Streaming version of indicators.macd.
+    '''
+    def __init__(self,fast_period=12,slow_period=26,signal_period=9):
+        self.EMA_fast=EMAState(fast_period)
+        self.EMA_slow=EMAState(slow_period)
+        self.signal=EMAState(signal_period)
+
+    @property
+    def ready(self):
+        return self.signal.ready
+
+    def update(self,closes):
+        MACD_line=self.EMA_fast.update(closes)-self.EMA_slow.update(closes)
+        signal_line=self.signal.update(MACD_line)
+        return MACD_line,signal_line,MACD_line-signal_line
+
+    def update_bars(self,bars):
+        return self.update(bars['close'])
+
+    def save(self):
+        return self.EMA_fast.save(),self.EMA_slow.save(),self.signal.save()
+
+    def restore(self,saved):
+        for EMA,EMA_saved in zip((self.EMA_fast,self.EMA_slow,self.signal),saved):
+            EMA.restore(EMA_saved)
+
+class SARStream:
+    '''
+    Streaming version of indicators.sar, keeping the SARState between updates.
+    '''
+    def __init__(self):
+        self.state=None
+        self.ready=True
+
+    def update(self,highs,lows,opens,closes):
+        SARs,self.state=sar(highs,lows,opens,closes,state=self.state)
+        return SARs
+
+    def update_bars(self,bars):
+        return (self.update(bars['high'],bars['low'],bars['open'],bars['close']),)
+
+    def save(self):
+        # indicators.sar doesn't modify the provided state
+        return self.state
+
+    def restore(self,saved):
+        self.state=saved
+
+class CrossingState:
+    '''
+    Streaming version of indicators.crossings between the small and big EMA.
+    '''
+    def __init__(self,period_small_EMA,period_big_EMA):
+        self.small=EMAState(period_small_EMA)
+        self.big=EMAState(period_big_EMA)
+        self.sign=np.nan
+
+    @property
+    def ready(self):
+        return self.small.ready and self.big.ready
+
+    def update(self,closes):
+        signs=np.sign(self.small.update(closes)-self.big.update(closes))
+        result=np.abs(np.diff(np.concatenate(([self.sign],signs))))/2
+        if len(signs):
+            self.sign=signs[-1]
+        return result
+
+    def update_bars(self,bars):
+        return (self.update(bars['close']),)
+
+    def save(self):
+        return self.small.save(),self.big.save(),self.sign
+
+    def restore(self,saved):
+        small,big,self.sign=saved
+        self.small.restore(small)
+        self.big.restore(big)
+
+# Streaming version of every indicator of the registry
+STREAMS={
+    'smallEMA':lambda state: EMAState(state.period_small_EMA),
+    'bigEMA':lambda state: EMAState(state.period_big_EMA),
+    'simpleEMA':lambda state: EMAState(1),
+    'advancedEMA':lambda state: EMAState(20),
+    'SAR':lambda state: SARStream(),
+    'oscillators':lambda state: OscillatorState(),
+    'MACD':lambda state: MACDState(),
+    'RSI':lambda state: RSIState(),
+    'crossings':lambda state: CrossingState(state.period_small_EMA,state.period_big_EMA),
+}
+
+
+### PER TICKER STATE ###
+# Initial number of bars the buffers of an IndicatorState can hold, they grow when needed
+INITIAL_CAPACITY=1024
+
+class IndicatorState:
+    '''
+    Incremental indicators for the bars of one ticker.
+
+    update() only processes the bars that are newer than the latest processed bar, so
+    its cost depends on the number of new bars and not on the length of the history.
+    The bars and indicator values are kept in preallocated buffers (grown by doubling,
+    trimmed by moving the start), so appending bars doesn't copy the stored history.
+
+    The latest bar may be revised by a later download (Yahoo keeps updating the bar
+    that is still forming): the states are saved before the latest bar and restored
+    when the same timestamp arrives again. Downloaded bars that overlap older stored
+    bars must have the same prices (within RTOL), their volumes replace the stored ones.
+    Any other revision or a gap makes update() return False, the state should then be
+    rebuilt from scratch.
+
+    Indicators keep running over the whole history seen since the state was created,
+    while the stored bars are trimmed to the requested window. consistent_with() checks
+    them against the batch computation of indicators.IndicatorPipeline.
+    '''
+    def __init__(self,period_small_EMA,period_big_EMA,indicators=None):
+        self.period_small_EMA=period_small_EMA
+        self.period_big_EMA=period_big_EMA
+        self.names=resolve_indicators(indicators)
+        self.streams={name:STREAMS[name](self) for name in self.names}
+        self.columns=[column for name in self.names for column in INDICATORS[name].columns]
+
+        self.buffers={column:np.empty(INITIAL_CAPACITY) for column in BASE_COLUMNS+self.columns}
+        self.buffers['timestamps']=np.empty(INITIAL_CAPACITY,dtype='datetime64[ns]')
+        self.begin=0
+        self.end=0
+        self.first_timestamp=None
+        self.timestamps_dtype=None
+        self.checkpoint=None
+        self.updates=0
+        self.checked_at=0
+
+    @property
+    def capacity(self):
+        return len(self.buffers['timestamps'])
+
+    @property
+    def data(self):
+        '''
+        Dict {column:array} of the stored bars (views on the buffers).
+        '''
+        return {column:buffer[self.begin:self.end] for column,buffer in self.buffers.items()}
+
+    @property
+    def latest_timestamp(self):
+        if self.end==self.begin:
+            return None
+        return self.buffers['timestamps'][self.end-1]
+
+    def matches(self,period_small_EMA,period_big_EMA,indicators=None):
+        '''
+        Returns True if this state calculates the given configuration.
+        '''
+        return (self.period_small_EMA==period_small_EMA and self.period_big_EMA==period_big_EMA
+            and self.names==resolve_indicators(indicators))
+
+    def contiguous(self,df_bars):
+        '''
+        Returns True if df_bars can extend this state without leaving out bars.
+        '''
+        if df_bars.empty or self.latest_timestamp is None:
+            return True
+        return df_bars.timestamps.iloc[0]<=self.latest_timestamp
+
+    def check_due(self,interval):
+        '''
+        Returns True if interval updates (or more) were done since the last consistency check.
+        An interval of 0 disables the checks.
+        '''
+        return interval>0 and self.updates-self.checked_at>=interval
+
+    @property
+    def ready(self):
+        '''
+        True if every indicator produced at least one value, i.e. if the batch
+        computation over the same bars would succeed.
+        '''
+        return self.end>self.begin and all(stream.ready for stream in self.streams.values())
+
+    def update(self,df_bars,start=None):
+        '''
+        Processes the bars of df_bars that were not processed yet. Bars before start
+        are dropped from the stored history afterwards.
+        Returns False (and processes nothing) if df_bars doesn't extend the stored bars:
+        a gap after the latest stored bar, or a revision of an older stored bar.
+        '''
+        timestamps=df_bars.timestamps.to_numpy(dtype='datetime64[ns]')
+        values={column:df_bars[column].to_numpy(dtype=float) for column in BASE_COLUMNS[1:]}
+        if (timestamps[1:]<timestamps[:-1]).any():
+            order=np.argsort(timestamps,kind='stable')
+            timestamps=timestamps[order]
+            values={column:value[order] for column,value in values.items()}
+
+        first=0
+        revise=False
+        latest=self.latest_timestamp
+        if latest is not None and len(timestamps):
+            if not self.contiguous(df_bars):
+                return False
+            first=np.searchsorted(timestamps,latest)
+            revise=first<len(timestamps) and timestamps[first]==latest
+            if not revise and first<len(timestamps):
+                # The latest stored bar is missing from the new bars
+                return False
+            if not self._merge_stored(timestamps[:first],{column:value[:first] for column,value in values.items()}):
+                return False
+
+        if revise:
+            self._revise_latest()
+
+        new={column:value[first:] for column,value in values.items()}
+        new['timestamps']=timestamps[first:]
+        length=len(new['timestamps'])
+
+        if length:
+            if self.first_timestamp is None:
+                self.first_timestamp=new['timestamps'][0]
+                self.timestamps_dtype=df_bars.timestamps.to_numpy().dtype
+            if length>1:
+                self._process({column:value[:-1] for column,value in new.items()})
+            self.checkpoint={name:stream.save() for name,stream in self.streams.items()}
+            self._process({column:value[-1:] for column,value in new.items()})
+
+        if start is not None:
+            self._trim(np.datetime64(start,'ns'))
+
+        self.updates+=1
+        return True
+
+    def _merge_stored(self,timestamps,values):
+        '''
+        Merges the bars (before the latest stored bar) into the stored bars over the same
+        period: returns False if their timestamps differ or their prices differ by more
+        than RTOL, else their volumes replace the stored ones. Bars before the stored
+        history are ignored.
+        '''
+        stored=self.data
+        first=np.searchsorted(timestamps,stored['timestamps'][0])
+        if first==len(timestamps):
+            return True
+
+        stored_first=np.searchsorted(stored['timestamps'],timestamps[first])
+        if not np.array_equal(timestamps[first:],stored['timestamps'][stored_first:-1]):
+            return False
+
+        for column in PRICE_COLUMNS:
+            new,old=values[column][first:],stored[column][stored_first:-1]
+            if not np.array_equal(new,old) and not np.allclose(new,old,rtol=RTOL,atol=0,equal_nan=True):
+                return False
+
+        stored['volume'][stored_first:-1]=values['volume'][first:]
+        return True
+
+    def _revise_latest(self):
+        for name,stream in self.streams.items():
+            stream.restore(self.checkpoint[name])
+        self.checkpoint=None
+        self.end-=1
+
+    def _reserve(self,length):
+        '''
+        Makes room for length bars after the stored bars: the stored bars are moved to the
+        start of the buffers, which are doubled until they are at most half full.
+        '''
+        if self.end+length<=self.capacity:
+            return
+
+        size=self.end-self.begin
+        capacity=current=self.capacity
+        while 2*(size+length)>capacity:
+            capacity*=2
+
+        for column,buffer in self.buffers.items():
+            if capacity!=current:
+                resized=np.empty(capacity,dtype=buffer.dtype)
+                resized[:size]=buffer[self.begin:self.end]
+                self.buffers[column]=resized
+            else:
+                buffer[:size]=buffer[self.begin:self.end].copy()
+
+        self.begin=0
+        self.end=size
+
+    def _process(self,bars):
+        length=len(bars['timestamps'])
+        self._reserve(length)
+        end=self.end+length
+
+        for column in BASE_COLUMNS:
+            self.buffers[column][self.end:end]=bars[column]
+
+        for name,stream in self.streams.items():
+            values=stream.update_bars(bars)
+            for column,value in zip(INDICATORS[name].columns,values):
+                self.buffers[column][self.end:end]=value
+
+        self.end=end
+
+    def _trim(self,start):
+        self.begin+=np.searchsorted(self.buffers['timestamps'][self.begin:self.end],start)
+
+    def frame(self,start=None):
+        '''
+        Returns the stored bars with their indicator columns, or None if not every
+        indicator could be calculated yet.
+        '''
+        if not self.ready:
+            return None
+
+        first=self.begin
+        if start is not None:
+            first+=np.searchsorted(self.buffers['timestamps'][self.begin:self.end],np.datetime64(start,'ns'))
+
+        # Same timestamps as the downloaded bars (the buffer holds them in ns)
+        columns={'timestamps':self.buffers['timestamps'][first:self.end].astype(self.timestamps_dtype)}
+        for column in BASE_COLUMNS[1:]+self.columns:
+            columns[column]=self.buffers[column][first:self.end].copy()
+
+        return pd.DataFrame(columns,copy=False)
+
+    def consistent_with(self,df_bars,rtol=RTOL,atol=1e-9):
+        '''
+        Consistency check against the full batch computation.
+
+        df_bars holds all bars processed since the state was created (starting at
+        self.first_timestamp, older bars are ignored). The indicators are recomputed in
+        one batch with IndicatorPipeline and compared to the stored values for the stored bars.
+        '''
+        self.checked_at=self.updates
+
+        df_bars=df_bars.sort_values('timestamps').reset_index(drop=True)
+        if not df_bars.empty and self.first_timestamp is not None:
+            df_bars=df_bars[df_bars.timestamps>=self.first_timestamp].reset_index(drop=True)
+        if df_bars.empty or df_bars.timestamps.iloc[0]!=self.first_timestamp:
+            return False
+
+        df_batch=IndicatorPipeline(df_bars,self.period_small_EMA,self.period_big_EMA).frame(self.names)
+        if df_batch is None:
+            return not self.ready
+
+        data=self.data
+        positions=np.searchsorted(df_batch.timestamps.to_numpy(dtype='datetime64[ns]'),data['timestamps'])
+        if len(positions) and positions[-1]>=len(df_batch):
+            return False
+
+        for column in BASE_COLUMNS[1:]+self.columns:
+            if not np.allclose(data[column],df_batch[column].to_numpy(dtype=float)[positions],rtol=rtol,atol=atol,equal_nan=True):
+                return False
+
+        return True
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+# Every block of the EMA filter is evaluated in closed form with powers of the decay
+# factor. The block length is chosen such that decay**-length stays below this bound.
+EMA_BLOCK_EXPONENT=30
+
+def ema_filter(inputs,alpha,initial=0.0):
+    '''
+    Runs the recursive filter y[k] = alpha*x[k] + (1-alpha)*y[k-1] along the last axis
+    of inputs, starting from y[-1]=initial. Returns an array with the shape of inputs.
+    alpha and initial are scalars or have one value per series (the shape of inputs
+    without the last axis).
+
+    The recursion is evaluated block by block: within a block of length L
+        y[j] = d^(j+1) * (y[-1] + alpha * sum_{i<=j} x[i]/d^(i+1))   with d=1-alpha
+    which only needs a cumulative sum. NaN inputs propagate to all later outputs,
+    exactly like the plain recursion.
+    '''
+    x=np.asarray(inputs,dtype=float)
+    result=np.empty(x.shape)
+    length=x.shape[-1]
+    if length==0:
+        return result
+
+    alpha=np.broadcast_to(np.asarray(alpha,dtype=float),x.shape[:-1])
+    previous=np.broadcast_to(np.asarray(initial,dtype=float),x.shape[:-1]).copy()
+
+    # Without decay the filter returns its inputs
+    passthrough=alpha>=1
+    if passthrough.all():
+        result[...]=x
+        return result
+    decay=np.where(passthrough,0.5,1-alpha)
+
+    # The fastest decay limits the block length of all series
+    block=max(1,int(EMA_BLOCK_EXPONENT/-np.log10(decay.min())))
+    powers=decay[...,None]**np.arange(1,min(block,length)+1)
+
+    for start in range(0,length,block):
+        chunk=x[...,start:start+block]
+        chunk_powers=powers[...,:chunk.shape[-1]]
+        filtered=chunk_powers*(previous[...,None]+alpha[...,None]*np.cumsum(chunk/chunk_powers,axis=-1))
+        result[...,start:start+block]=filtered
+        previous=filtered[...,-1]
+
+    if passthrough.any():
+        result[passthrough]=x[passthrough]
+
+    return result
+
+def ema(points,period):
+    '''
+    Returns the SMA-seeded exponential moving average of points as a float array.
+
+    Leading NaNs are skipped. The first period valid points (NaNs in between are ignored)
+    are averaged to the seed SMA and get NaN as EMA. The first EMA follows on the next
+    point. Returns None if the series is too short to seed the EMA.
+    '''
+    points=np.asarray(points,dtype=float)
+    valid=np.flatnonzero(~np.isnan(points))
+    if period<1 or len(valid)<period:
+        return None
+
+    first=valid[period-1]+1
+    if first>=len(points):
+        return None
+
+    SMA=np.mean(points[valid[:period]])
+
+    result=np.full(len(points),np.nan)
+    result[first:]=ema_filter(points[first:],2/(1+period),SMA)
+
+    return result
+
+def _rolling_extreme(points,window,extreme,fill):
+    '''
+    Returns the running extreme (np.minimum or np.maximum) of points over a trailing
+    window, i.e. result[i] = extreme(points[i-window+1:i+1]). The first window-1
+    values are NaN.
+
+    Uses the van Herk/Gil-Werman scheme: the series is cut into blocks of length
+    window and every window is covered by the suffix of one block and the prefix
+    of the next one, so the cost is O(len) independent of the window length.
+    '''
+    points=np.asarray(points,dtype=float)
+    length=len(points)
+    result=np.full(length,np.nan)
+    if window<1 or length<window:
+        return result
+
+    padded=np.full(-(-length//window)*window,fill)
+    padded[:length]=points
+    blocks=padded.reshape(-1,window)
+
+    prefix=extreme.accumulate(blocks,axis=1).ravel()
+    suffix=extreme.accumulate(blocks[:,::-1],axis=1)[:,::-1].ravel()
+
+    starts=np.arange(length-window+1)
+    result[window-1:]=extreme(suffix[starts],prefix[starts+window-1])
+
+    return result
+
+def rolling_min(points,window):
+    '''
+    Minimum of points over a trailing window of length window.
+    '''
+    return _rolling_extreme(points,window,np.minimum,np.inf)
+
+def rolling_max(points,window):
+    '''
+    Maximum of points over a trailing window of length window.
+    '''
+    return _rolling_extreme(points,window,np.maximum,-np.inf)
+
+def oscillators(highs,lows,closes,period=140,fast_period=30):
+    '''
+    Returns the slow and fast stochastic oscillators as a tuple of float arrays.
+
+    slow: 100*(C-LN)/(HN-LN) with LN and HN the lowest low and highest high of the
+    last period bars (current bar included) and C the current close.
+    fast: EMA of the slow oscillator with period fast_period.
+    '''
+    closes=np.asarray(closes,dtype=float)
+    LN=rolling_min(lows,period)
+    HN=rolling_max(highs,period)
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        slow=100*(closes-LN)/(HN-LN)
+
+    fast=ema(slow,fast_period)
+    if fast is None:
+        fast=np.full(len(slow),np.nan)
+
+    return slow,fast
+
+def rsi(opens,closes,period=14,smoothing='simple'):
+    '''
+    Returns the RSI as a float array, or None if there are not more than period bars.
+
+    Gains and losses are taken from the bar bodies (close-open). The RSI at bar i uses
+    the average gain and loss of the period bars before i; the first period values
+    are NaN. smoothing selects how these averages are formed:
+        'simple': rolling mean over the last period bars (cumulative-sum windows)
+        'wilder': Wilder smoothing avg[i] = (avg[i-1]*(period-1)+x[i-1])/period,
+                  seeded with the simple mean of the first period bars
+    The inputs are never modified.
+    '''
+    diff=np.asarray(closes,dtype=float)-np.asarray(opens,dtype=float)
+    length=len(diff)
+    if length<=period:
+        return None
+
+    gains=np.where(diff>=0,diff,0.0)
+    losses=np.where(diff<0,-diff,0.0)
+
+    if smoothing=='simple':
+        avg_gain=_rolling_mean(gains,period)[period-1:length-1]
+        avg_loss=_rolling_mean(losses,period)[period-1:length-1]
+    elif smoothing=='wilder':
+        avg_gain=_wilder_mean(gains,period)
+        avg_loss=_wilder_mean(losses,period)
+    else:
+        raise ValueError("No valid RSI smoothing ({}) has been provided. Valid options are simple or wilder.".format(smoothing))
+
+    result=np.full(length,np.nan)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        result[period:]=np.where(avg_loss==0,100.0,100-(100/(1+(avg_gain/avg_loss))))
+
+    return result
+
+def _rolling_mean(points,window):
+    '''
+    Mean of points over a trailing window, computed from one cumulative sum.
+    The first window-1 values are NaN.
+    '''
+    sums=np.concatenate(([0.0],np.cumsum(points)))
+    result=np.full(len(points),np.nan)
+    result[window-1:]=(sums[window:]-sums[:-window])/window
+    return result
+
+def _wilder_mean(points,period):
+    '''
+    Wilder averages of points for bars period..len-1, each one using the bars before it.
+    '''
+    seed=np.mean(points[:period])
+    return np.concatenate(([seed],ema_filter(points[period:-1],1/period,seed)))
+
+class SARState:
+    '''
+    State of the parabolic SAR after the latest processed bar.
+    trend : 'up' or 'down'
+    EP : extreme point of the current trend
+    alpha : acceleration factor
+    SAR : latest SAR value
+    '''
+    def __init__(self,trend,EP,alpha,SAR):
+        self.trend=trend
+        self.EP=EP
+        self.alpha=alpha
+        self.SAR=SAR
+
+    def copy(self):
+        return SARState(self.trend,self.EP,self.alpha,self.SAR)
+
+def sar(highs,lows,opens=None,closes=None,state=None):
+    '''
+    Returns the parabolic SAR as a tuple (float array, SARState).
+
+    Without state, the first bar initializes the trend from its open and close,
+    so opens and closes are required. With state, every bar is treated as a new
+    bar following that state, which extends an existing SAR series in O(new bars).
+    The provided state is not modified.
+    '''
+    highs=np.asarray(highs,dtype=float).tolist()
+    lows=np.asarray(lows,dtype=float).tolist()
+    result=np.empty(len(highs))
+    if not highs:
+        return result,state
+
+    first=0
+    if state is None:
+        alpha_prev = 0.02
+        if opens[0]>closes[0]:
+            trend_prev = 'down'
+            EP_prev = lows[0]
+            SAR_prev = lows[0]
+        else:
+            trend_prev = 'up'
+            EP_prev = highs[0]
+            SAR_prev = highs[0]
+        result[0] = SAR_prev
+        first = 1
+    else:
+        trend_prev = state.trend
+        EP_prev = state.EP
+        alpha_prev = state.alpha
+        SAR_prev = state.SAR
+
+    for i in range(first,len(highs)):
+        high = highs[i]
+        low = lows[i]
+        if trend_prev=='up':
+            EP_new = max(EP_prev,high)
+            alpha_new = alpha_prev
+            if high>EP_prev and alpha_prev<=0.18:
+                alpha_new+=0.02
+
+            SAR_new = SAR_prev + alpha_prev*(EP_prev-SAR_prev)
+
+            trend_new = trend_prev
+            if SAR_new>=low:
+                trend_new = 'down'
+                alpha_new = 0.02
+                EP_new = low
+                SAR_new = max(high,EP_prev)
+        else:
+            EP_new = min(EP_prev,low)
+            alpha_new = alpha_prev
+            if low<EP_prev and alpha_prev<=0.18:
+                alpha_new+=0.02
+
+            SAR_new = SAR_prev - alpha_prev*(SAR_prev-EP_prev)
+
+            trend_new = trend_prev
+            if SAR_new<=high:
+                trend_new = 'up'
+                alpha_new = 0.02
+                EP_new = high
+                SAR_new = min(low,EP_prev)
+
+        result[i] = SAR_new
+        trend_prev = trend_new
+        EP_prev = EP_new
+        alpha_prev = alpha_new
+        SAR_prev = SAR_new
+
+    return result,SARState(trend_prev,EP_prev,alpha_prev,SAR_prev)
+
+def macd(closes,fast_period=12,slow_period=26,signal_period=9):
+    '''
+    Returns the MACD as a tuple of float arrays (MACD_line, signal_line, MACD_histo),
+    or None if the series is too short for one of the underlying EMAs.
+    '''
+    EMA_fast=ema(closes,fast_period)
+    EMA_slow=ema(closes,slow_period)
+    if EMA_fast is None or EMA_slow is None:
+        return None
+
+    return _macd_lines(EMA_fast,EMA_slow,signal_period)
+
+def _macd_lines(EMA_fast,EMA_slow,signal_period=9):
+    '''
+    MACD line, signal line and histogram from the fast and slow EMAs, or None if the
+    signal line can not be seeded.
+    '''
+    MACD_line=EMA_fast-EMA_slow
+    signal_line=ema(MACD_line,signal_period)
+    if signal_line is None:
+        return None
+
+    return MACD_line,signal_line,MACD_line-signal_line
+
+def crossings(fast,slow):
+    '''
+    Returns 1 for every point where the fast line crossed the slow line since the previous
+    point, 0 otherwise (a touch counts as half a crossing). Works along the last axis; NaN
+    where one of both points is not available.
+    '''
+    signs=np.sign(np.asarray(fast,dtype=float)-np.asarray(slow,dtype=float))
+    result=np.full(signs.shape,np.nan)
+    result[...,1:]=np.abs(np.diff(signs,axis=-1))/2
+
+    return result
+
+
+### INDICATOR REGISTRY ###
+class Indicator:
+    '''
+    Entry of the indicator registry.
+    name : name used to request the indicator
+    columns : columns computed by the indicator
+    dependencies : base or indicator columns needed by function
+    function : function(pipeline) returning a tuple of float arrays (one per column),
+               or None if the indicator can not be calculated
+    '''
+    def __init__(self,name,columns,dependencies,function):
+        self.name=name
+        self.columns=columns
+        self.dependencies=dependencies
+        self.function=function
+
+def _as_columns(result):
+    if result is None:
+        return None
+    return (result,)
+
+INDICATORS={indicator.name:indicator for indicator in [
+    Indicator('smallEMA',('smallEMA',),('close',),
+        lambda pipeline: _as_columns(ema(pipeline['close'],pipeline.period_small_EMA))),
+    Indicator('bigEMA',('bigEMA',),('close',),
+        lambda pipeline: _as_columns(ema(pipeline['close'],pipeline.period_big_EMA))),
+    Indicator('simpleEMA',('simpleEMA',),('close',),
+        lambda pipeline: _as_columns(ema(pipeline['close'],1))),
+    Indicator('advancedEMA',('advancedEMA',),('close',),
+        lambda pipeline: _as_columns(ema(pipeline['close'],20))),
+    Indicator('SAR',('SAR',),('high','low','open','close'),
+        lambda pipeline: sar(pipeline['high'],pipeline['low'],pipeline['open'],pipeline['close'])[:1]),
+    Indicator('oscillators',('slow_oscillator','fast_oscillator'),('high','low','close'),
+        lambda pipeline: oscillators(pipeline['high'],pipeline['low'],pipeline['close'])),
+    Indicator('EMA12',('EMA12',),('close',),
+        lambda pipeline: _as_columns(ema(pipeline['close'],12))),
+    Indicator('EMA26',('EMA26',),('close',),
+        lambda pipeline: _as_columns(ema(pipeline['close'],26))),
+    Indicator('MACD',('MACD_line','signal_line','MACD_histo'),('EMA12','EMA26'),
+        lambda pipeline: _macd_lines(pipeline['EMA12'],pipeline['EMA26'])),
+    Indicator('RSI',('RSI',),('open','close'),
+        lambda pipeline: _as_columns(rsi(pipeline['open'],pipeline['close']))),
+    Indicator('crossings',('EMA_crossings',),('smallEMA','bigEMA'),
+        lambda pipeline: _as_columns(crossings(pipeline['smallEMA'],pipeline['bigEMA']))),
+    ]}
+
+# Indicator computing every column
+COLUMNS={column:indicator.name for indicator in INDICATORS.values() for column in indicator.columns}
+
+# Indicators returned by YahooAPI.get_data when no selection is made
+ALL_INDICATORS=['smallEMA','bigEMA','simpleEMA','advancedEMA','SAR','oscillators','MACD','RSI']
+
+def resolve_indicators(names=None):
+    '''
+    Returns the list of indicator names for a selection of indicator and/or column
+    names. None or 'all' selects ALL_INDICATORS.
+    '''
+    if names is None or names=='all':
+        return list(ALL_INDICATORS)
+    if isinstance(names,str):
+        names=[name.strip() for name in names.split(',') if name.strip()]
+
+    result=[]
+    for name in names:
+        if name in COLUMNS:
+            name=COLUMNS[name]
+        elif not name in INDICATORS:
+            raise ValueError("Indicator {} is not known. Valid options are {}.".format(name,", ".join(INDICATORS)))
+        if not name in result:
+            result.append(name)
+
+    return result
+
+class IndicatorPipeline:
+    '''
+    Computes indicator columns on demand for the bars of one ticker.
+
+    df_data holds the bars ('timestamps' | 'open' | 'close' | 'low' | 'high' | 'volume'),
+    sorted by timestamp. A column is computed at most once, and only when it is
+    requested directly or as the dependency of a requested indicator. Columns that
+    are already available can be passed with precomputed.
+    '''
+    def __init__(self,df_data,period_small_EMA,period_big_EMA,precomputed=None):
+        self.df_data=df_data
+        self.period_small_EMA=period_small_EMA
+        self.period_big_EMA=period_big_EMA
+        self.columns={} if precomputed is None else dict(precomputed)
+        self.failed=None
+
+    def __getitem__(self,column):
+        '''
+        Returns the float array of a base or indicator column, or None if it can not
+        be calculated.
+        '''
+        if not column in self.columns:
+            if column in self.df_data:
+                self.columns[column]=self.df_data[column].to_numpy(dtype=float)
+            elif not self.compute(COLUMNS[column]):
+                return None
+
+        return self.columns[column]
+
+    def compute(self,name):
+        '''
+        Computes the indicator name and its dependencies. Returns False and remembers the
+        failing indicator in self.failed if one of them can not be calculated.
+        '''
+        indicator=INDICATORS[name]
+        if all(column in self.columns for column in indicator.columns):
+            return True
+
+        for dependency in indicator.dependencies:
+            if self[dependency] is None:
+                return False
+
+        result=indicator.function(self)
+        if result is None:
+            self.failed=name
+            return False
+
+        self.columns.update(zip(indicator.columns,result))
+        return True
+
+    def frame(self,names=None):
+        '''
+        Returns a dataframe with the base columns and the columns of the selected
+        indicators, or None if one of them can not be calculated.
+        '''
+        names=resolve_indicators(names)
+        for name in names:
+            if not self.compute(name):
+                return None
+
+        result={column:self.df_data[column].to_numpy() for column in self.df_data.columns}
+        for name in names:
+            for column in INDICATORS[name].columns:
+                result[column]=self.columns[column]
+
+        return pd.DataFrame(result)
+
+
+### BATCH INDICATORS ###
+def pad_rows(series):
+    '''
+    Stacks series of different lengths to a (series x points) matrix. Shorter series are
+    padded with NaN on the left, so the latest points of all series share the last column.
+    Returns the matrix and the lengths of the series.
+    '''
+    lengths=np.array([len(points) for points in series],dtype=int)
+    matrix=np.full((len(series),lengths.max(initial=0)),np.nan)
+    for row,points in enumerate(series):
+        if lengths[row]:
+            matrix[row,-lengths[row]:]=points
+
+    return matrix,lengths
+
+def ema_rows(points,period):
+    '''
+    ema() for every row of a (series x points) matrix in one pass. period is a scalar
+    or has one period per row.
+
+    Returns the EMA matrix and a bool array with the rows for which ema() would not have
+    returned None. The rows for which it would have are NaN.
+    '''
+    points=np.asarray(points,dtype=float)
+    rows,length=points.shape
+    period=np.broadcast_to(np.asarray(period,dtype=int),(rows,))
+    if not length:
+        return np.full(points.shape,np.nan),np.zeros(rows,dtype=bool)
+
+    valid=~np.isnan(points)
+    counts=np.cumsum(valid,axis=1)
+    sums=np.cumsum(np.where(valid,points,0.0),axis=1)
+
+    # The seed SMA is known at the period-th valid point, the first EMA follows on the next one
+    seed=np.argmax(counts>=period[:,None],axis=1)
+    seeded=(period>=1)&(counts[:,-1]>=period)&(seed+1<length)
+    SMA=np.where(seeded,sums[np.arange(rows),seed]/np.maximum(period,1),0.0)
+
+    return _seeded_ema(points,period,seed+1,SMA,seeded),seeded
+
+def ema_periods(points,periods):
+    '''
+    EMAs of one series for many periods at once, e.g. for a sweep over EMA periods.
+    Returns a (periods x points) matrix; the rows of the periods for which ema() would
+    return None are NaN.
+    '''
+    points=np.asarray(points,dtype=float)
+    periods=np.asarray(periods,dtype=int)
+    length=len(points)
+
+    valid=np.flatnonzero(~np.isnan(points))
+    if not len(valid):
+        return np.full((len(periods),length),np.nan)
+
+    # Same seeds as ema(), from the cumulative sum of the valid points
+    seeded=(periods>=1)&(periods<=len(valid))
+    index=np.where(seeded,periods-1,0)
+    seed=valid[index]
+    seeded&=seed+1<length
+    SMA=np.where(seeded,np.cumsum(points[valid])[index]/np.maximum(periods,1),0.0)
+
+    return _seeded_ema(np.broadcast_to(points,(len(periods),length)),periods,seed+1,SMA,seeded)
+
+def _seeded_ema(points,period,first,SMA,seeded):
+    '''
+    EMA of every row of points, starting from the SMA seed of the row before index first.
+    '''
+    result=np.full(points.shape,np.nan)
+    if not points.shape[-1]:
+        return result
+
+    # Before the first EMA the filter is fed the SMA itself, which keeps it at the SMA
+    before=np.arange(points.shape[-1])<first[:,None]
+    result=ema_filter(np.where(before,SMA[:,None],points),2/(1+np.maximum(period,1)),SMA)
+    result[before|~seeded[:,None]]=np.nan
+
+    return result
+
+# EMA indicators of the registry with their period, as function of the pipeline periods
+BATCH_EMAS={
+    'smallEMA':lambda period_small_EMA,period_big_EMA: period_small_EMA,
+    'bigEMA':lambda period_small_EMA,period_big_EMA: period_big_EMA,
+    'simpleEMA':lambda period_small_EMA,period_big_EMA: 1,
+    'advancedEMA':lambda period_small_EMA,period_big_EMA: 20,
+    'EMA12':lambda period_small_EMA,period_big_EMA: 12,
+    'EMA26':lambda period_small_EMA,period_big_EMA: 26,
+}
+
+def batch_indicators(closes,period_small_EMA,period_big_EMA,names=None):
+    '''
+    Computes the EMA, MACD and EMA crossing indicators of several tickers in one
+    vectorized pass over a NaN padded (tickers x bars) matrix of the closes.
+
+    closes : list with the close prices of every ticker, the lengths may differ
+    names : indicator selection, as for IndicatorPipeline.frame. Only the EMA, MACD and
+            crossings indicators (and their dependencies) are computed here.
+
+    Returns a list with a dict {column:float array} per ticker, holding the columns that
+    could be calculated for that ticker. It can be passed as precomputed columns to the
+    IndicatorPipeline of the ticker, which calculates the remaining indicators.
+    '''
+    needed=[]
+    for name in resolve_indicators(names):
+        for dependency in [COLUMNS[column] for column in INDICATORS[name].dependencies if column in COLUMNS]+[name]:
+            if not dependency in needed:
+                needed.append(dependency)
+
+    matrix,lengths=pad_rows(closes)
+    results={}
+    for name in needed:
+        if name in BATCH_EMAS:
+            EMAs,seeded=ema_rows(matrix,BATCH_EMAS[name](period_small_EMA,period_big_EMA))
+            results[name]=((EMAs,),seeded)
+
+    if 'MACD' in needed:
+        MACD_line=results['EMA12'][0][0]-results['EMA26'][0][0]
+        signal_line,seeded=ema_rows(MACD_line,9)
+        results['MACD']=((MACD_line,signal_line,MACD_line-signal_line),seeded)
+
+    if 'crossings' in needed:
+        seeded=results['smallEMA'][1]&results['bigEMA'][1]
+        results['crossings']=((crossings(results['smallEMA'][0][0],results['bigEMA'][0][0]),),seeded)
+
+    precomputed=[{} for _ in closes]
+    for name,(values,seeded) in results.items():
+        for row in np.flatnonzero(seeded):
+            first=matrix.shape[1]-lengths[row]
+            for column,value in zip(INDICATORS[name].columns,values):
+                precomputed[row][column]=value[row,first:]
+
+    return precomputed
@@ -45,8 +45,7 @@ def main(days=None,number=None,sell_criterium=None,stocks=None,start_date=None,u
     
     
     b = BackTesting(start,number,sell_criterium,stocks)
-    for stock in b.monitored_stocks:
-        b.calculate_result(stock)
+    b.calculate_results()
     
     b.append_csv()
     b.get_all_stats()
@@ -6,8 +6,13 @@ import time
 from datetime import datetime
 import pandas as pd
 from trade_logic import Stocks
-from yahoo_scraping import YahooScraper
+from bar_store import BarStore
+from ticker_metadata import TickerMetadata
+import yahoo_scraping
 import utils
+import http_client
+import rate_limiter
+import market_sessions
 import threading
 import argparse
 import shutil as sh
@@ -68,6 +73,10 @@ def update_state(
     utils.write_state(stocks,ending_state_path,logger=logger)
     sh.copy(ending_state_path,"./config/latest_state.json")
 
+    # Write the ticker metadata scraped since the last update
+    logger.debug("Writing ticker metadata...",extra={'function':FUNCTION})
+    stocks.ticker_metadata.flush()
+
 
 
 
@@ -94,6 +103,9 @@ def start_algorithm(initial_state_file=None,config_file=None,fixed_rounds=None,s
     if not config_file:
         config_file=args.config_file
     config_params=utils.read_config(config_file)
+    http_client.configure(config_params['http'])
+    rate_limiter.configure(config_params['rate_limit'])
+    market_sessions.configure(config_params['main'])
 
     # Configure logging
     logger=utils.configure_logger("default",output_dir_log,config_params["logging"])
@@ -107,6 +119,12 @@ def start_algorithm(initial_state_file=None,config_file=None,fixed_rounds=None,s
     logger.debug("Reading initial values from config file: {}...".format(initial_state_file),extra={'function':FUNCTION})
     init_val=utils.read_json_data(initial_state_file,logger=logger)
 
+    bar_store=None
+    if config_params['trade_logic']['yahoo_bar_store']:
+        bar_store=BarStore(config_params['trade_logic']['yahoo_bar_store'])
+
+    ticker_metadata=TickerMetadata(config_params['trade_logic']['ticker_metadata_file'])
+
     stocks=Stocks(balance=init_val["balance"],
                     bought_stocks=init_val["bought_stocks"],
                     monitored_stocks=init_val["monitored_stocks"],
@@ -116,7 +134,9 @@ def start_algorithm(initial_state_file=None,config_file=None,fixed_rounds=None,s
                     interesting_stocks=init_val["interesting_stocks"],
                     not_interesting_stocks=init_val["not_interesting_stocks"],
                     yahoo_calls=init_val["yahoo_calls"],
-                    results=init_val["results"])
+                    results=init_val["results"],
+                    bar_store=bar_store,
+                    ticker_metadata=ticker_metadata)
 
     # Initialize status files
     update_state(stocks,logger,output_dir_log,output_dir_overview,output_dir_status,output_dir_archive,output_dir_plotdata,output_dir_log_json,ending_state_path,overview_plotdata_path)
@@ -139,6 +159,12 @@ def start_algorithm(initial_state_file=None,config_file=None,fixed_rounds=None,s
         if not config_file:
             config_file=args.config_file
         config_params=utils.read_config(config_file)
+        http_client.configure(config_params['http'])
+        rate_limiter.configure(config_params['rate_limit'])
+        market_sessions.configure(config_params['main'])
+
+        # Quote pages are downloaded once per loop
+        yahoo_scraping.clear_snapshots()
 
         # Read and save whether the user has ordered manually to sell a certain stock, and if true, sell it
         logger.info("Checking whether user has ordered to buy or sell stocks...",extra={'function':FUNCTION})
@@ -151,8 +177,12 @@ def start_algorithm(initial_state_file=None,config_file=None,fixed_rounds=None,s
 
         # Loop through monitored stocks
         logger.info("Checking monitored stocks...",extra={'function':FUNCTION})
+        prefetched=stocks.prefetch_monitored_stocks(list(stocks.monitored_stocks),datetime.now(),config_params,logger)
         for stock in stocks.monitored_stocks:
-            stocks.check_monitored_stock(stock,config_params=config_params,logger=logger)
+            if not stock in prefetched:
+                continue
+            market_state,df_data=prefetched[stock]
+            stocks.check_monitored_stock(stock,config_params=config_params,logger=logger,df_data=df_data,market_state=market_state)
 
         # Check if we should monitor more stocks
         if config_params['main']['check_for_new_stocks']:
@@ -185,8 +215,7 @@ def start_algorithm(initial_state_file=None,config_file=None,fixed_rounds=None,s
                 stocks.hard_sell_check({"tickers_to_sell":["ALLSTOCKS"]},commands_log,config_params,logger)
             break
         else:
-            scraper = YahooScraper()
-            if scraper.all_markets_closed(stocks.monitored_stocks,config_params,logger) and not config_params['main']['ignore_market_hours']:
+            if stocks.all_markets_closed(config_params,logger) and not config_params['main']['ignore_market_hours']:
                 logger.info("Terminating algorithm because all relevant markets are closed",extra={'function':FUNCTION})                
                 break
 
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime,timedelta,timezone
+import threading
+import time
+import pandas_market_calendars as mcal
+import numpy as np
+
+# Default length (minutes) of the pre and post market sessions, around the regular session
+# (US exchanges: pre market from 4:00, post market until 20:00 New York time)
+DEFAULT_PRE_MARKET_MINUTES=330
+DEFAULT_POST_MARKET_MINUTES=240
+
+# Exchanges with pre and post market sessions, the others only have their regular session
+EXTENDED_HOURS_EXCHANGES=('NYSE','NASDAQ')
+
+class MarketSessions:
+    '''
+    Market state (OPEN, BEFORE_HOURS, AFTER_HOURS or CLOSED, as returned by
+    YahooScraper.check_market_state) of an exchange, from the pandas_market_calendars schedule.
+
+    The sessions of the days around today (UTC) are computed once per exchange and day
+    as unix timestamps (pre market start, open, close, post market end), after which the
+    state is a binary search. Only the EXTENDED_HOURS_EXCHANGES have pre and post market
+    sessions, the other exchanges are CLOSED outside of their regular session. Exchanges unknown to pandas_market_calendars give None,
+    the caller should then scrape the market state.
+    '''
+    def __init__(self,pre_market_minutes=DEFAULT_PRE_MARKET_MINUTES,post_market_minutes=DEFAULT_POST_MARKET_MINUTES):
+        self.pre_market=int(pre_market_minutes)*60
+        self.post_market=int(post_market_minutes)*60
+        self.lock=threading.Lock()
+        self.sessions={}
+        self.unknown=set()
+
+    def configure(self,pre_market_minutes=DEFAULT_PRE_MARKET_MINUTES,post_market_minutes=DEFAULT_POST_MARKET_MINUTES):
+        pre_market=int(pre_market_minutes)*60
+        post_market=int(post_market_minutes)*60
+        if (pre_market,post_market)!=(self.pre_market,self.post_market):
+            with self.lock:
+                self.pre_market=pre_market
+                self.post_market=post_market
+                self.sessions={}
+
+    def get_sessions(self,exchange,now):
+        '''
+        Returns a dict {'pre','open','close','post'} of arrays with the unix timestamps of the
+        sessions of the exchange around now (unix timestamp), or None for an unknown exchange.
+        '''
+        day=datetime.fromtimestamp(now,timezone.utc).date()
+        with self.lock:
+            if exchange in self.unknown:
+                return None
+            cached=self.sessions.get(exchange)
+        if cached and cached[0]==day:
+            return cached[1]
+
+        try:
+            cal=mcal.get_calendar(exchange)
+        except RuntimeError:
+            with self.lock:
+                self.unknown.add(exchange)
+            return None
+
+        schedule=cal.schedule(start_date=day-timedelta(days=1),end_date=day+timedelta(days=1))
+        market_open=schedule['market_open'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        market_close=schedule['market_close'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        extended_hours=exchange in EXTENDED_HOURS_EXCHANGES
+        sessions={
+            'pre':market_open-(self.pre_market if extended_hours else 0),
+            'open':market_open,
+            'close':market_close,
+            'post':market_close+(self.post_market if extended_hours else 0),
+        }
+
+        with self.lock:
+            self.sessions[exchange]=(day,sessions)
+
+        return sessions
+
+    def get_market_state(self,exchange,now=None):
+        '''
+        Returns the market state of the exchange at now (unix timestamp, default the current
+        time), or None if the exchange is unknown.
+        '''
+        if now is None:
+            now=time.time()
+
+        sessions=self.get_sessions(exchange,now)
+        if sessions is None:
+            return None
+
+        # Latest session starting (pre market included) before now
+        index=np.searchsorted(sessions['pre'],now,side='right')-1
+        if index<0 or now>=sessions['post'][index]:
+            return "CLOSED"
+        if now<sessions['open'][index]:
+            return "BEFORE_HOURS"
+        if now<sessions['close'][index]:
+            return "OPEN"
+        return "AFTER_HOURS"
+
+_sessions=None
+_sessions_lock=threading.Lock()
+
+def get_market_sessions():
+    '''
+    Returns the shared MarketSessions, created with the default settings if not configured yet.
+    '''
+    global _sessions
+    with _sessions_lock:
+        if _sessions is None:
+            _sessions=MarketSessions()
+    return _sessions
+
+def configure(config):
+    '''
+    Applies the pre and post market settings (of the EXTENDED_HOURS_EXCHANGES) of the main config
+    params to the shared MarketSessions.
+    '''
+    get_market_sessions().configure(config['pre_market_minutes'],config['post_market_minutes'])
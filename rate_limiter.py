@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+# Priority classes of the yahoo calls, lowest value first
+POSITION=0
+MONITORED=1
+SCREENING=2
+BACKTESTING=3
+
+PRIORITY_NAMES={
+    POSITION:'positions',
+    MONITORED:'monitored',
+    SCREENING:'screening',
+    BACKTESTING:'backtesting',
+}
+
+# Default settings, overruled by the "rate_limit" section of the config file.
+# The reserves are the fractions of the hourly/daily budget that calls of the class can't
+# use: e.g. screening stops when less than 30% of the budget is left, so the remaining
+# calls go to the monitored stocks and held positions.
+DEFAULT_CONFIG={
+    'hourly_limit':2000,
+    'daily_limit':48000,
+    'monitored_reserve':0.1,
+    'screening_reserve':0.3,
+    'backtesting_reserve':0.3,
+    'throttle_cooldown':900,
+}
+
+class TokenBucket:
+    '''
+    Token bucket holding at most capacity tokens, refilled continuously at capacity tokens per period (s).
+    '''
+    def __init__(self,capacity,period):
+        self.capacity=float(capacity)
+        self.period=float(period)
+        self.tokens=float(capacity)
+        self.timestamp=time.monotonic()
+
+    def refill(self):
+        now=time.monotonic()
+        self.tokens=min(self.capacity,self.tokens+(now-self.timestamp)*self.capacity/self.period)
+        self.timestamp=now
+
+    def available(self):
+        self.refill()
+        return self.tokens
+
+    def consume(self,tokens=1):
+        self.refill()
+        self.tokens-=tokens
+
+    def time_until(self,tokens):
+        '''
+        Returns the number of seconds until the bucket holds tokens tokens.
+        '''
+        self.refill()
+        return max(0.0,(tokens-self.tokens)*self.period/self.capacity)
+
+class RateLimiter:
+    '''
+    Rate limiter of the yahoo calls, with an hourly and a daily token bucket.
+
+    Every call belongs to a priority class (POSITION, MONITORED, SCREENING, BACKTESTING).
+    A call is only granted when the buckets hold more tokens than the reserve of its class,
+    so low priority work is deferred first when the budget gets tight. Held positions have
+    no reserve and are also served while yahoo throttles us (see throttle), all other
+    classes are deferred until the cooldown has passed.
+    Deferred keys (tickers) are remembered, queue_depth and order use them so deferred work
+    isn't starved once the budget allows it again.
+    '''
+    def __init__(self,**config):
+        self.lock=threading.Lock()
+        self.hourly=None
+        self.daily=None
+        self.throttled_until=0.0
+        self.deferred={priority:{} for priority in PRIORITY_NAMES}
+        self.configure(**config)
+
+    def configure(self,**config):
+        '''
+        Updates the settings (see DEFAULT_CONFIG). The used tokens are kept when the limits change.
+        '''
+        settings=dict(DEFAULT_CONFIG,**config)
+        with self.lock:
+            self.hourly=self.resize(self.hourly,int(settings['hourly_limit']),3600)
+            self.daily=self.resize(self.daily,int(settings['daily_limit']),24*3600)
+            self.reserves={
+                POSITION:0.0,
+                MONITORED:float(settings['monitored_reserve']),
+                SCREENING:float(settings['screening_reserve']),
+                BACKTESTING:float(settings['backtesting_reserve']),
+            }
+            self.throttle_cooldown=float(settings['throttle_cooldown'])
+
+    @staticmethod
+    def resize(bucket,capacity,period):
+        if bucket and bucket.capacity==capacity:
+            return bucket
+
+        new_bucket=TokenBucket(capacity,period)
+        if bucket:
+            new_bucket.tokens=min(capacity,capacity-(bucket.capacity-bucket.available()))
+        return new_bucket
+
+    def set_used(self,hourly_calls,daily_calls):
+        '''
+        Removes the calls already made this hour/day (e.g. read from the state file) from the buckets.
+        '''
+        with self.lock:
+            self.hourly.tokens=min(self.hourly.tokens,self.hourly.capacity-hourly_calls)
+            self.daily.tokens=min(self.daily.tokens,self.daily.capacity-daily_calls)
+
+    def throttled(self):
+        return time.monotonic()<self.throttled_until
+
+    def throttle(self):
+        '''
+        Called when yahoo refuses calls (HTTP 429): only held positions are served during the cooldown.
+        '''
+        with self.lock:
+            self.throttled_until=time.monotonic()+self.throttle_cooldown
+
+    def required(self,priority,bucket,cost):
+        return cost+self.reserves[priority]*bucket.capacity
+
+    def allowed(self,priority,cost):
+        if priority!=POSITION and self.throttled():
+            return False
+        return all(bucket.available()>=self.required(priority,bucket,cost) for bucket in (self.hourly,self.daily))
+
+    def acquire(self,priority,key=None,cost=1,wait=False):
+        '''
+        Takes cost tokens for a call of the priority class. Returns True if the call can be
+        made, else the key is added to the deferred calls and False is returned.
+        Calls of held positions are always granted, the buckets can go below zero for them.
+        wait : wait until the budget allows the call, instead of deferring it
+        '''
+        while True:
+            with self.lock:
+                if priority==POSITION or self.allowed(priority,cost):
+                    self.hourly.consume(cost)
+                    self.daily.consume(cost)
+                    self.deferred[priority].pop(key,None)
+                    return True
+
+                if not wait:
+                    self.deferred[priority].setdefault(key,time.time())
+                    return False
+
+                delay=max(bucket.time_until(self.required(priority,bucket,cost)) for bucket in (self.hourly,self.daily))
+                delay=max(delay,self.throttled_until-time.monotonic(),0.1)
+
+            time.sleep(delay)
+
+    def forget(self,key):
+        '''
+        Removes the deferred calls of the key (e.g. a ticker that isn't monitored anymore).
+        '''
+        with self.lock:
+            for keys in self.deferred.values():
+                keys.pop(key,None)
+
+    def order(self,items):
+        '''
+        Sorts (priority,key) tuples in the order their calls should be made: by priority and,
+        within a priority class, the longest deferred keys first.
+        '''
+        def sort_key(item):
+            priority,key=item
+            return (priority,self.deferred[priority].get(key,float('inf')))
+
+        return sorted(items,key=sort_key)
+
+    def queue_depth(self):
+        return {PRIORITY_NAMES[priority]:len(keys) for priority,keys in self.deferred.items()}
+
+    def get_status(self):
+        '''
+        Returns the remaining budget and the number of deferred calls per priority class.
+        '''
+        with self.lock:
+            return {
+                'hourly_budget':int(self.hourly.available()),
+                'daily_budget':int(self.daily.available()),
+                'throttled':self.throttled(),
+                'deferred':self.queue_depth(),
+            }
+
+_limiter=None
+_limiter_lock=threading.Lock()
+
+def get_limiter():
+    '''
+    Returns the shared RateLimiter, created with the default settings if not configured yet.
+    '''
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter=RateLimiter()
+    return _limiter
+
+def configure(config):
+    '''
+    Applies the "rate_limit" section of the config params to the shared RateLimiter.
+    '''
+    get_limiter().configure(**config)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+# Minimum time (s) between two bars of different trading sessions
+SESSION_GAP=8*3600
+
+class SessionIndex:
+    '''
+    Trading sessions of a sorted series of bar timestamps, computed once so the session
+    boundaries don't have to be searched again with diffs of the timestamps.
+
+    A new session starts at every bar that comes more than SESSION_GAP after the previous one.
+    Per bar position:
+        session : id of the session of the bar (0,1,...)
+        active : cumulative time (s) within sessions up to the bar, gaps between sessions excluded
+    Per session:
+        starts, ends : positions of the first and last bar of the session
+    '''
+    def __init__(self,timestamps,gap=SESSION_GAP):
+        self.index=pd.DatetimeIndex(timestamps)
+        seconds=self.index.as_unit('s').asi8
+
+        diffs=np.diff(seconds)
+        new_session=diffs>gap
+        if not len(seconds):
+            self.session=self.starts=self.ends=self.active=np.empty(0,dtype=np.int64)
+            return
+
+        self.session=np.concatenate(([0],np.cumsum(new_session)))
+        self.starts=np.flatnonzero(np.concatenate(([True],new_session)))
+        self.ends=np.concatenate((self.starts[1:]-1,[len(seconds)-1]))
+        self.active=np.concatenate(([0],np.cumsum(np.where(new_session,0,diffs))))
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def number_of_sessions(self):
+        return len(self.starts)
+
+    def locate(self,timestamp,side='left'):
+        '''
+        Returns the position of timestamp in the bars (as numpy.searchsorted).
+        '''
+        return int(self.index.searchsorted(timestamp,side=side))
+
+    def session_start(self,position):
+        '''
+        Returns the position of the first bar of the session of the bar at position.
+        '''
+        return int(self.starts[self.session[position]])
+
+    def session_end(self,position):
+        '''
+        Returns the position of the last bar of the session of the bar at position.
+        '''
+        return int(self.ends[self.session[position]])
+
+    def next_session_start(self,position):
+        '''
+        Returns the position of the first bar of the session after the one of the bar at
+        position, or None if it is the last session.
+        '''
+        session=self.session[position]+1
+        if session>=self.number_of_sessions:
+            return None
+        return int(self.starts[session])
+
+    def active_seconds(self,first,last):
+        '''
+        Returns the time (s) within sessions from the bar at position first to the bar at position last.
+        '''
+        return int(self.active[last]-self.active[first])
+
+    def gaps(self):
+        '''
+        Returns a list of tuples (last timestamp of a session,first timestamp of the next session).
+        '''
+        return [(self.index[end],self.index[start]) for end,start in zip(self.ends[:-1],self.starts[1:])]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from pathlib import Path
+import threading
+import os
+import time
+import json
+
+# Time to live (s) of the cached fields, a field older than this is scraped again
+DEFAULT_TTLS={
+    'fullname':30*24*3600,
+    'description':30*24*3600,
+    'exchange':7*24*3600,
+}
+
+class TickerMetadata:
+    '''
+    Persistent cache of the static data of tickers (fullname, description, exchange)
+    scraped from the yahoo website.
+
+    The cache is a JSON file {ticker:{field:[value,unix timestamp]}}, loaded on creation.
+    Changed fields only mark the cache dirty, flush() writes it (once per loop). Every field
+    has its own time to live (see DEFAULT_TTLS). Without a path the cache is only kept in memory.
+    '''
+    def __init__(self,path=None,ttls=None):
+        self.path=Path(path) if path else None
+        self.ttls=dict(DEFAULT_TTLS,**(ttls or {}))
+        self.lock=threading.Lock()
+        self.dirty=False
+        self.data=self.load()
+
+    def load(self):
+        if not self.path or not self.path.exists():
+            return {}
+
+        try:
+            with open(self.path,'r') as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def save(self):
+        '''
+        Writes the cache to a temporary file which then replaces the cache file, so a crash
+        mid-write never leaves a corrupt cache behind.
+        '''
+        if not self.path:
+            return
+
+        self.path.parent.mkdir(parents=True,exist_ok=True)
+        tmp_path=self.path.with_name(self.path.name+'.tmp')
+        with open(tmp_path,'w') as f:
+            json.dump(self.data,f)
+        os.replace(tmp_path,self.path)
+
+    def flush(self):
+        '''
+        Saves the cache if any field changed since the last flush.
+        '''
+        with self.lock:
+            if not self.dirty:
+                return
+            self.save()
+            self.dirty=False
+
+    def get(self,ticker,field):
+        '''
+        Returns the cached value of the field, or None if it isn't cached or has expired.
+        '''
+        with self.lock:
+            entry=self.data.get(ticker,{}).get(field)
+        if not entry:
+            return None
+
+        value,timestamp=entry
+        if time.time()-timestamp>self.ttls.get(field,0):
+            return None
+
+        return value
+
+    def set(self,ticker,field,value):
+        '''
+        Caches the value of the field. Empty values (failed scrapes) are not cached.
+        '''
+        if not value:
+            return
+
+        with self.lock:
+            fields=self.data.setdefault(ticker,{})
+            if fields.get(field,[None])[0]==value and time.time()-fields[field][1]<self.ttls.get(field,0)/2:
+                return
+            fields[field]=[value,time.time()]
+            self.dirty=True
+
+    def update(self,ticker,**fields):
+        for field,value in fields.items():
+            self.set(ticker,field,value)
+
+    def get_or_fetch(self,ticker,field,fetch):
+        '''
+        Returns the cached value of the field, else the result of fetch() (which is cached).
+        '''
+        value=self.get(ticker,field)
+        if value is None:
+            value=fetch()
+            self.set(ticker,field,value)
+
+        return value
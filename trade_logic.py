@@ -10,6 +10,13 @@ from yahoo_scraping import YahooScraper
 from ticker_alpha import Alpha
 import utils
 from yahoo_api import YahooAPI
+from indicator_state import IndicatorState
+from bar_series import BarSeries
+from ticker_metadata import TickerMetadata
+from session_index import SessionIndex
+import indicators
+import rate_limiter
+import market_sessions
 from datetime import date, time, datetime, timedelta
 import pandas as pd
 import numpy as np
@@ -19,17 +26,22 @@ from matplotlib import cm
 import shutil
 import urllib.request as request
 from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import PurePath
 
+# Bars downloaded again before the latest bar of an IndicatorState, to detect revisions of them
+INDICATOR_OVERLAP = timedelta(hours=1)
+
 def get_latest_prices(stock, data):
     # FUNCTION='get_latest_values'
     '''
+    data : BarSeries of the stock
     returns tuple: (timestamp_data,price_to_sell,price_to_buy,price_current_value)
     '''
-    timestamp = datetime.strftime(data['timestamps'][-1], "%Y-%m-%d %H:%M:%S")
-    price_to_buy = round(data['high'][-1], 2)
-    price_to_sell = round(data['low'][-1], 2)
-    price_current_value = round((data['open'][-1]+data['close'][-1])/2, 2)
+    timestamp = pd.Timestamp(data.latest('timestamps')).strftime("%Y-%m-%d %H:%M:%S")
+    price_to_buy = round(float(data.latest('high')), 2)
+    price_to_sell = round(float(data.latest('low')), 2)
+    price_current_value = round(float(data.latest('open')+data.latest('close'))/2, 2)
 
     return (timestamp, price_to_sell, price_to_buy, price_current_value)
 
@@ -54,18 +66,50 @@ class AcceptParameters:
         self.max_jump = "N/A"
         self.drop_period = config_params['trade_logic']['drop_period']
 
-        timestamps_aware = self.df_data['timestamps'].map(lambda timestamp: timestamp.replace(tzinfo=pytz.timezone("Etc/GMT+4")))
-        self.df_data = self.df_data.assign(timestamps=timestamps_aware)
+        # Label the timestamps (wall clock of the exchange) as Etc/GMT+4 once, vectorized.
+        # Aware timestamps keep their wall clock, like datetime.replace(tzinfo=...) did.
+        timestamps = pd.to_datetime(self.df_data['timestamps'])
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_localize(None)
+        self.df_data = self.df_data.assign(timestamps=timestamps.dt.tz_localize("Etc/GMT+4"))
+        # Sorted timestamps of the data, to slice it at a date with a binary search
+        self.time_index = pd.DatetimeIndex(self.df_data['timestamps'])
+        self.data_sampling = None
+        self.sessions = None
+
+    def get_sessions(self):
+        '''
+        Returns the SessionIndex of the data, computed on first use.
+        '''
+        if self.sessions is None:
+            self.sessions = SessionIndex(self.time_index)
+        return self.sessions
+
+    def get_data_sampling(self):
+        '''
+        Returns the most common time between two bars of the data, computed on first use.
+        '''
+        if self.data_sampling is None:
+            deltas = self.df_data.timestamps - self.df_data.timestamps.shift(periods=1)
+            self.data_sampling = deltas.mode().iloc[0]
+        return self.data_sampling
+
+    def get_data_until(self, date, timezone="Etc/GMT-2"):
+        '''
+        Returns the data up to date (included), with date in the given timezone.
+        The data is sliced at the position of date (no copy of the rows).
+        '''
+        date_aware = date.replace(tzinfo=pytz.timezone(timezone))
+        end = self.time_index.searchsorted(date_aware, side='right')
+        return self.df_data.iloc[:end]
 
     def get_support_level(self,date):
         '''
         Calculates the support level for the stock in question.
         '''
         timedelta_period = timedelta(seconds=86400*self.config_params['trade_logic']['support_days'])
-        date_aware = date.replace(tzinfo=pytz.timezone("Etc/GMT-2"))
-        df = self.df_data[self.df_data.timestamps<=date_aware]
-        deltas = df.timestamps - df.timestamps.shift(periods=1)
-        data_sampling = deltas.mode().iloc[0]
+        df = self.get_data_until(date)
+        data_sampling = self.get_data_sampling()
         data_points = round(timedelta_period/data_sampling)
 
         df_rel = df.tail(data_points)
@@ -83,8 +127,7 @@ class AcceptParameters:
         This function checks whether we should sell a stock because it drops below
         it's support level.
         '''
-        date_aware = date.replace(tzinfo=pytz.timezone("Etc/GMT-2"))
-        df = self.df_data[self.df_data.timestamps<=date_aware]
+        df = self.get_data_until(date)
         support_level = self.get_support_level(date)
         latest_price = df.close.iloc[-1]
 
@@ -94,8 +137,7 @@ class AcceptParameters:
         '''
         This function checks if, at the latest timestamp available, the stock is overvalued.
         '''
-        date_aware = date.replace(tzinfo=pytz.timezone("Etc/GMT-2"))
-        df = self.df_data[self.df_data.timestamps<=date_aware]
+        df = self.get_data_until(date)
         latest_small_EMA = df.iloc[-1].smallEMA
         latest_big_EMA = df.iloc[-1].bigEMA
 
@@ -113,7 +155,7 @@ class AcceptParameters:
             logger.debug("Getting EMA areas starting from {}".format(
                 start.strftime("%Y/%m/%d-%H:%M:%S")), extra={'function': FUNCTION})
 
-        df_f = self.df_data[self.df_data['timestamps'] >= start]
+        df_f = self.df_data.iloc[self.time_index.searchsorted(start):]
         if df_f.empty:
             logger.debug("Unable to get EMA areas, empty dataframe.",extra={'function':FUNCTION})
             return None
@@ -133,13 +175,10 @@ class AcceptParameters:
         '''
         #print("Getting latest drop at date: ",date)
         period = self.config_params['trade_logic']['drop_period']
-        date_aware = date.replace(tzinfo=pytz.timezone("Etc/GMT+4"))
-        #print(date_aware)
-        df = self.df_data[self.df_data.timestamps<=date_aware]
+        df = self.get_data_until(date, timezone="Etc/GMT+4")
         #print(self.df_data)
         #print(df)
-        deltas = df.timestamps - df.timestamps.shift(periods=1)
-        data_sampling = deltas.mode().iloc[0]
+        data_sampling = self.get_data_sampling()
         data_points = round(timedelta(seconds=period)/data_sampling)
 
         df_rel = df.tail(data_points)
@@ -169,9 +208,9 @@ class AcceptParameters:
         first_stamp = min(stamp_min,stamp_max)
         second_stamp = max(stamp_min,stamp_max)
 
-        timediffs = df_rel[(df_rel.timestamps>=first_stamp) & (df_rel.timestamps<=second_stamp)].timestamps.diff()
-        timediffs_filtered = timediffs[timediffs < timedelta(minutes=500)]
-        time_diff_seconds = abs(timediffs_filtered.sum().total_seconds())
+        # Time between both stamps, without the gaps between sessions
+        sessions = self.get_sessions()
+        time_diff_seconds = abs(sessions.active_seconds(sessions.locate(first_stamp), sessions.locate(second_stamp)))
         #print("Time diff seconds: ",time_diff_seconds)
         factor = time_diff_seconds/period
         #print("Rel diff perc: ",rel_diff_perc)
@@ -203,15 +242,10 @@ class AcceptParameters:
         if logger:
             logger.debug("Getting number of EMA crossings starting from {}".format(start.strftime("%Y/%m/%d-%H:%M:%S")), extra={'function': FUNCTION})
 
-        date_aware = date.replace(tzinfo=pytz.timezone("Etc/GMT-2"))
-        df = self.df_data[self.df_data.timestamps<=date_aware]
-        diff = df.smallEMA-df.bigEMA
-        df_sign = diff.apply(lambda x : np.sign(x))
-        diff_series = df_sign-df_sign.shift(periods=1)
-        diff_series = diff_series.apply(lambda x : abs(x))
-        #diff_df = pd.concat([df.timestamps,diff_series],axis=1)
+        df = self.get_data_until(date)
+        crossings = indicators.crossings(df.smallEMA.to_numpy(dtype=float), df.bigEMA.to_numpy(dtype=float))
 
-        return diff_series.sum()/2
+        return np.nansum(crossings)
 
     def accept_stock(self, date, logger):
         FUNCTION = 'accept_stock'
@@ -298,12 +332,15 @@ class Stocks(YahooAPI):
                  interesting_stocks=[],
                  not_interesting_stocks=[],
                  yahoo_calls={},
-                 results={}):
+                 results={},
+                 bar_store=None,
+                 ticker_metadata=None):
         '''
         balance : current balance. I.e. money in account ready to spend.
         bought stocks : { ticker : (number of stocks in possesion , money spent when buying the stocks)}    
         monitored stocks : [stock1,stock2,...]    
-        monitored stock data: 
+        monitored stock data: {'ticker' : BarSeries}, the series of the state file (see
+                              BarSeries.from_state) are converted to BarSeries
             {'ticker' : 
                 {
                     'timestamps':[],
@@ -358,16 +395,22 @@ class Stocks(YahooAPI):
                 'daily_calls' : ...,
                 'hourly_calls' : ...
             }
+        bar_store : BarStore for the historic data of the yahoo API, or None
+        ticker_metadata : TickerMetadata with the fullname, description and exchange of the tickers,
+                          kept in memory only if None
         '''
-        super().__init__()
+        super().__init__(bar_store=bar_store)
         self.balance = balance
         self.bought_stocks = bought_stocks
         self.monitored_stocks = monitored_stocks
-        self.monitored_stock_data = monitored_stock_data
+        self.monitored_stock_data = {ticker: data if isinstance(data, BarSeries) else BarSeries.from_state(data)
+                                     for ticker, data in monitored_stock_data.items()}
         self.archive = archive
         self.current_status = current_status
         self.interesting_stocks = interesting_stocks
         self.not_interesting_stocks = not_interesting_stocks
+        self.indicator_states = {}
+        self.ticker_metadata = ticker_metadata if ticker_metadata else TickerMetadata()
 
         if yahoo_calls:
             self.yahoo_calls = yahoo_calls
@@ -380,6 +423,12 @@ class Stocks(YahooAPI):
                 'total_calls':0
             }
 
+        # Calls already made today (before a restart) count for the rate limiter
+        last_date = datetime.strptime(self.yahoo_calls['last_timestamp_day'], "%Y/%m/%d-%H:%M:%S").date()
+        if last_date == datetime.now().date():
+            hourly_calls = self.yahoo_calls['hourly_calls'] if self.yahoo_calls['last_hour'] == datetime.now().hour else 0
+            rate_limiter.get_limiter().set_used(hourly_calls, self.yahoo_calls['daily_calls'])
+
         self.initial_virtual_result = 0
         self.initial_final_result = 0
 
@@ -403,10 +452,11 @@ class Stocks(YahooAPI):
                 "final_result":self.initial_final_result
             }
 
-    def update_yahoo_calls(self, add_call, logger=None):
+    def update_yahoo_calls(self, add_call, logger=None, calls=1):
         FUNCTION = 'add_yahoo_call'
         '''
         Add yahoo call to the records. This is done in order to check compliance with the limits.
+        calls : number of calls to add
         '''
         if not self.yahoo_calls:
             self.yahoo_calls = {
@@ -423,14 +473,14 @@ class Stocks(YahooAPI):
         now = datetime.now()
 
         if add_call:
-            data['total_calls'] += 1
+            data['total_calls'] += calls
 
         if now.date() > last_date:
             data['last_timestamp_day'] = utils.date_now()
-            data['daily_calls'] = 1
+            data['daily_calls'] = calls
         elif now.date() == last_date:
             if add_call:
-                data['daily_calls'] += 1
+                data['daily_calls'] += calls
         else:
             if logger:
                 logger.error("Day present in object is after current day. Bad bad programmer, this should never occur.", extra={
@@ -438,20 +488,167 @@ class Stocks(YahooAPI):
 
         if now.hour > data['last_hour'] or now.hour < data['last_hour']:
             data['last_hour'] = now.hour
-            data['hourly_calls'] = 1
+            data['hourly_calls'] = calls
         elif now.hour == data['last_hour']:
             if add_call:
-                data['hourly_calls'] += 1
+                data['hourly_calls'] += calls
 
     def get_latest_data(self, 
                         ticker,
                         date, 
                         exchange, 
                         config_params, 
-                        logger):
+                        logger,
+                        incremental=False):
         # FUNCTION='get_latest_data'
         '''
-        Description
+        Get the latest data of the ticker, with the configured indicators.
+        incremental : keep the indicators of the ticker in an IndicatorState and only
+                      process the bars that arrived since the previous call
+        '''
+        window = self.get_data_window(date, exchange, config_params, logger)
+        if not window:
+            return pd.DataFrame
+        start, end = window
+
+        if incremental:
+            df_data = self.get_incremental_data(ticker, start, end, config_params, logger)
+        else:
+            df_data = self.get_data(ticker, start, end, config_params['trade_logic']['yahoo_interval'], config_params['trade_logic']
+                                    ['yahoo_period_small_EMA'], config_params['trade_logic']['yahoo_period_big_EMA'], logger=logger,
+                                    indicator_names=config_params['trade_logic']['yahoo_indicators'])
+
+        self.update_yahoo_calls(add_call=True, logger=logger)
+
+        return df_data
+
+    def prefetch_monitored_stocks(self, stocks, date, config_params, logger):
+        FUNCTION = 'prefetch_monitored_stocks'
+        '''
+        Downloads the market state and the bars of the stocks concurrently, with at most
+        main.fetch_concurrency requests at the same time, and calculates their indicators
+        (in one batch if main.batch_indicators, else with the IndicatorState per stock).
+        The yahoo calls go through the rate limiter, held positions first. Stocks for which
+        the budget is too tight are deferred to a next call.
+        Returns a dict {stock:(market state,dataframe as returned by get_latest_data)}, without
+        the deferred stocks.
+        '''
+        limiter = rate_limiter.get_limiter()
+        costs = {stock: self.get_fetch_calls(stock) for stock in stocks}
+        granted = [stock for priority, stock in limiter.order([(self.get_priority(stock), stock) for stock in stocks])
+                   if limiter.acquire(priority, stock, cost=costs[stock])]
+        deferred = [stock for stock in stocks if not stock in granted]
+        if deferred:
+            logger.info("Yahoo budget is too tight, {} stocks are deferred: {}.".format(len(deferred), deferred), extra={'function': FUNCTION})
+        stocks = [stock for stock in stocks if stock in granted]
+
+        logger.debug("Fetching data of {} stocks with concurrency {}.".format(len(stocks), config_params['main']['fetch_concurrency']), extra={'function': FUNCTION})
+
+        incremental = not config_params['main']['batch_indicators']
+        with ThreadPoolExecutor(max_workers=max(1, config_params['main']['fetch_concurrency'])) as executor:
+            futures = {stock: executor.submit(self.fetch_stock, stock, date, config_params, logger, incremental) for stock in stocks}
+            fetched = {stock: future.result() for stock, future in futures.items()}
+
+        for stock in stocks:
+            self.update_yahoo_calls(add_call=True, logger=logger, calls=costs[stock])
+
+        bars = {stock: fetched[stock][1] for stock in stocks}
+        if not incremental:
+            data = self.get_indicators_batch(bars, config_params['trade_logic']['yahoo_period_small_EMA'], config_params['trade_logic']['yahoo_period_big_EMA'],
+                                             logger=logger, indicator_names=config_params['trade_logic']['yahoo_indicators'])
+        else:
+            data = {}
+            for stock in stocks:
+                _, df_bars, window, fetch_start = fetched[stock]
+                if not window:
+                    data[stock] = df_bars
+                    continue
+                data[stock] = self.update_indicator_state(stock, df_bars, window[0], window[1], config_params, logger, fetch_start=fetch_start)
+
+        return {stock: (fetched[stock][0], data[stock]) for stock in stocks}
+
+    def get_priority(self, stock):
+        '''
+        Returns the rate limiter priority of the yahoo calls for a monitored stock.
+        '''
+        if stock in self.bought_stocks:
+            return rate_limiter.POSITION
+        return rate_limiter.MONITORED
+
+    def get_fetch_calls(self, stock):
+        '''
+        Returns the number of yahoo calls of fetch_stock for a monitored stock: the chart, plus
+        the quote page if the market state has to be scraped (exchange without calendar).
+        '''
+        if market_sessions.get_market_sessions().get_market_state(self.current_status[stock]["exchange"]) is None:
+            return 2
+        return 1
+
+    def get_check_calls(self, ticker):
+        '''
+        Returns the (maximum) number of yahoo calls of check_stock for a ticker: the chart, plus
+        the quote page if the exchange or fullname isn't cached or the market state has to be
+        scraped, plus the profile page if the description isn't cached.
+        '''
+        calls = 1
+        exchange = self.ticker_metadata.get(ticker, 'exchange')
+        if (exchange is None or self.ticker_metadata.get(ticker, 'fullname') is None
+                or market_sessions.get_market_sessions().get_market_state(exchange) is None):
+            calls += 1
+        if self.ticker_metadata.get(ticker, 'description') is None:
+            calls += 1
+        return calls
+
+    def get_market_state(self, stock, logger):
+        # FUNCTION='get_market_state'
+        '''
+        Returns the market state of a monitored stock, from the calendar of its exchange
+        (see MarketSessions), or scraped from the yahoo website if the exchange is unknown.
+        '''
+        market_state = market_sessions.get_market_sessions().get_market_state(self.current_status[stock]["exchange"])
+        if market_state is None:
+            scraper = YahooScraper()
+            market_state = scraper.check_market_state(stock, logger=logger)
+
+        return market_state
+
+    def all_markets_closed(self, config_params, logger):
+        # FUNCTION='all_markets_closed'
+        '''
+        Returns True if the markets of all monitored stocks are closed at this moment.
+        '''
+        for stock in self.monitored_stocks:
+            state = self.get_market_state(stock, logger)
+            if state == "OPEN":
+                return False
+            elif state == "BEFORE_HOURS" and config_params['main']['include_pre_trading']:
+                return False
+            elif state == "AFTER_HOURS" and config_params['main']['include_post_trading']:
+                return False
+
+        return True
+
+    def fetch_stock(self, stock, date, config_params, logger, incremental=False):
+        # FUNCTION='fetch_stock'
+        '''
+        Returns a tuple (market state, bars, data window, start of the downloaded bars) of the
+        stock at date. The data window is None if it couldn't be determined.
+        incremental : only download the bars the IndicatorState of the stock needs (see get_fetch_start)
+        '''
+        market_state = self.get_market_state(stock, logger)
+
+        window = self.get_data_window(date, self.current_status[stock]["exchange"], config_params, logger)
+        if not window:
+            return market_state, pd.DataFrame, None, None
+
+        fetch_start = self.get_fetch_start(stock, window[0], window[1], config_params, logger) if incremental else window[0]
+
+        return market_state, self.get_historic_data(stock, fetch_start, window[1], config_params['trade_logic']['yahoo_interval'], logger=logger), window, fetch_start
+
+    def get_data_window(self, date, exchange, config_params, logger):
+        # FUNCTION='get_data_window'
+        '''
+        Returns the start and end of the historic data needed at date, or None.
         '''
         if isinstance(date,str):
             date_datetime = datetime.strptime(date,'%Y/%m/%d-%H:%M:%S')
@@ -460,18 +657,109 @@ class Stocks(YahooAPI):
 
         start_day = utils.get_start_business_date(exchange, date_datetime, config_params['trade_logic']['yahoo_period_historic_data'], logger)
         if not start_day:
-            return pd.DataFrame
+            return None
 
         days_in_past = (date_datetime.replace(tzinfo=pytz.timezone("Etc/GMT-2"))-start_day.replace(tzinfo=pytz.timezone("Etc/GMT-2"))).days+1
 
-        start = date_datetime-timedelta(days=days_in_past)
-        end = date_datetime
+        return date_datetime-timedelta(days=days_in_past), date_datetime
 
-        yah = YahooAPI()
-        df_data = yah.get_data(ticker, start, end, config_params['trade_logic']['yahoo_interval'], config_params['trade_logic']
-                               ['yahoo_period_small_EMA'], config_params['trade_logic']['yahoo_period_big_EMA'], logger=logger)
+    def get_incremental_data(self, ticker, start, end, config_params, logger):
+        # FUNCTION='get_incremental_data'
+        '''
+        Same result as get_data, but the indicators are kept in the IndicatorState of the
+        ticker, so only the bars that arrived since the previous call are downloaded and processed.
+        '''
+        fetch_start = self.get_fetch_start(ticker, start, end, config_params, logger)
+        df_bars = self.get_historic_data(ticker, fetch_start, end, config_params['trade_logic']['yahoo_interval'], logger=logger)
 
-        self.update_yahoo_calls(add_call=True, logger=logger)
+        return self.update_indicator_state(ticker, df_bars, start, end, config_params, logger, fetch_start=fetch_start)
+
+    def get_indicator_state(self, ticker, config_params):
+        '''
+        Returns the IndicatorState of the ticker, or None if there is none for the configured indicators.
+        '''
+        state = self.indicator_states.get(ticker)
+        if state is None or not state.matches(config_params['trade_logic']['yahoo_period_small_EMA'], config_params['trade_logic']['yahoo_period_big_EMA'],
+                                              config_params['trade_logic']['yahoo_indicators']):
+            return None
+
+        return state
+
+    def get_fetch_start(self, ticker, start, end, config_params, logger):
+        FUNCTION = 'get_fetch_start'
+        '''
+        Returns the start of the bars to download for the IndicatorState of the ticker, with
+        start and end the data window:
+            - the whole window if there is no state yet
+            - all bars since the first bar of the state when its consistency check is due
+              (the whole window if the state is older than two windows, the state is dropped
+              then so it is rebuilt from the window)
+            - else only the bars since shortly before the latest bar of the state
+        '''
+        state = self.get_indicator_state(ticker, config_params)
+        if state is None or state.latest_timestamp is None:
+            return start
+
+        first = self.get_request_time(ticker, state.first_timestamp)
+        if first is not None and state.check_due(config_params['trade_logic']['indicator_check_interval']):
+            if first-INDICATOR_OVERLAP < start-(end-start):
+                logger.debug("Ticker: {}. Indicator state is older than two data windows, rebuilding it.".format(ticker), extra={'function': FUNCTION})
+                self.indicator_states.pop(ticker, None)
+                return start
+            return min(start, first-INDICATOR_OVERLAP)
+
+        latest = self.get_request_time(ticker, state.latest_timestamp)
+        if latest is None:
+            return start
+
+        return max(start, latest-INDICATOR_OVERLAP)
+
+    def update_indicator_state(self, ticker, df_bars, start, end, config_params, logger, fetch_start=None):
+        FUNCTION = 'update_indicator_state'
+        '''
+        Updates the IndicatorState of the ticker with the downloaded bars and returns the
+        bars of the data window (start,end) with their indicators.
+        fetch_start : start of the downloaded bars (see get_fetch_start), start if None
+
+        The state is rebuilt from the bars of the whole window if the bars revise stored
+        bars or leave a gap, or if its consistency check fails. The check runs every
+        trade_logic.indicator_check_interval updates, once the bars (downloaded from the
+        first bar of the state, see get_fetch_start) are processed.
+        '''
+        period_small_EMA = config_params['trade_logic']['yahoo_period_small_EMA']
+        period_big_EMA = config_params['trade_logic']['yahoo_period_big_EMA']
+        indicator_names = config_params['trade_logic']['yahoo_indicators']
+
+        if df_bars.empty:
+            return df_bars
+
+        trim_start = self.get_exchange_time(ticker, start)
+        state = self.get_indicator_state(ticker, config_params)
+        check = (state is not None and state.check_due(config_params['trade_logic']['indicator_check_interval'])
+                 and state.first_timestamp is not None and df_bars.timestamps.min() <= state.first_timestamp)
+
+        if state and not state.update(df_bars, start=trim_start):
+            logger.info("Ticker: {}. Bars were revised or are missing, rebuilding the indicator state.".format(ticker), extra={'function': FUNCTION})
+            state = None
+            if fetch_start is not None and fetch_start > start:
+                df_bars = self.get_historic_data(ticker, start, end, config_params['trade_logic']['yahoo_interval'], logger=logger)
+                if df_bars.empty:
+                    self.indicator_states.pop(ticker, None)
+                    return df_bars
+        elif check and not state.consistent_with(df_bars):
+            logger.info("Ticker: {}. Indicator state doesn't match the batch indicators, rebuilding it.".format(ticker), extra={'function': FUNCTION})
+            state = None
+
+        if state is None:
+            logger.debug("Ticker: {}. Initializing indicator state.".format(ticker), extra={'function': FUNCTION})
+            state = IndicatorState(period_small_EMA, period_big_EMA, indicator_names)
+            self.indicator_states[ticker] = state
+            state.update(df_bars, start=trim_start)
+
+        df_data = state.frame()
+        if df_data is None:
+            logger.debug("Ticker: {}. Not enough data to calculate all indicators.".format(ticker), extra={'function': FUNCTION})
+            return pd.DataFrame
 
         return df_data
 
@@ -534,10 +822,12 @@ class Stocks(YahooAPI):
         if not stock in self.monitored_stocks:
             self.monitored_stocks.append(stock)
 
-        self.monitored_stock_data[stock] = df_data.to_dict(orient='list')
+        self.ticker_metadata.update(stock, fullname=fullname, description=description, exchange=exchange)
+
+        data = BarSeries.from_frame(df_data)
+        self.monitored_stock_data[stock] = data
 
         if stock in self.current_status:
-            data = df_data.to_dict(orient='list')
             latest_prices = get_latest_prices(stock, data)
             timestamp_data = latest_prices[0]
             # price_to_sell=latest_prices[1]
@@ -594,8 +884,9 @@ class Stocks(YahooAPI):
         Check if the provided ticker should be monitored.
         '''
         logger.debug("Checking {}".format(ticker),extra={'function': FUNCTION})
+        # The quote page is only downloaded for the fields the ticker metadata doesn't have
         scraper = YahooScraper()
-        exchange = scraper.get_exchange(ticker, logger)
+        exchange = self.ticker_metadata.get_or_fetch(ticker, 'exchange', lambda: scraper.get_exchange(ticker, logger))
         if not exchange:
             self.not_interesting_stocks.append(ticker)
             logger.debug("Ticker {} was skipped because no valid response was received from the get_exchange function.".format(
@@ -620,21 +911,23 @@ class Stocks(YahooAPI):
                 ticker), extra={'function': FUNCTION})
             return False
 
-        fullname = scraper.get_fullname(ticker, logger)
+        fullname = self.ticker_metadata.get_or_fetch(ticker, 'fullname', lambda: scraper.get_fullname(ticker, logger))
         if not fullname:
             self.not_interesting_stocks.append(ticker)
             logger.debug("Ticker {} was skipped because no valid response was received from the get_fullname function.".format(
                 ticker), extra={'function': FUNCTION})
             return False
 
-        description = scraper.get_description(ticker, logger)
+        description = self.ticker_metadata.get_or_fetch(ticker, 'description', lambda: scraper.get_description(ticker, logger))
         if not description:
             self.not_interesting_stocks.append(ticker)
             logger.debug("Ticker {} was skipped because no valid response was received from the get_description function.".format(
                 ticker), extra={'function': FUNCTION})
             return False
 
-        market_state = scraper.check_market_state(ticker, logger=logger)
+        market_state = market_sessions.get_market_sessions().get_market_state(exchange)
+        if market_state is None:
+            market_state = scraper.check_market_state(ticker, logger)
         if market_state == "UNKNOWN":
             self.not_interesting_stocks.append(ticker)
             logger.debug("Ticker {} was skipped because no valid response was received from the check_market_state function.".format(
@@ -657,14 +950,21 @@ class Stocks(YahooAPI):
         if number_of_stocks==None:
             number_of_stocks = config_params['main']['initial_number_of_stocks']
 
+        limiter = rate_limiter.get_limiter()
         if stocks and isinstance(stocks,list):
             logger.info("Checking {} provided stocks.".format(len(stocks)),extra={'function':FUNCTION})
             for stock in stocks:
+                if not limiter.acquire(rate_limiter.SCREENING,stock,cost=self.get_check_calls(stock)):
+                    logger.info("Yahoo budget is too tight, checking {} is deferred.".format(stock),extra={'function':FUNCTION})
+                    continue
                 self.check_stock(stock,date,config_params,logger)
         else:
             logger.info("Checking to obtain {} random stocks.".format(number_of_stocks),extra={'function':FUNCTION})
             while len(self.monitored_stocks) < number_of_stocks:
                 ticker = self.get_new_interesting_stock(logger)
+                if not limiter.acquire(rate_limiter.SCREENING,cost=self.get_check_calls(ticker)):
+                    logger.info("Yahoo budget is too tight, checking for new stocks is deferred.",extra={'function':FUNCTION})
+                    break
                 self.check_stock(ticker,date,config_params,logger)
 
 
@@ -766,11 +1066,14 @@ class Stocks(YahooAPI):
 
         value_bought = self.current_status[stock]["value_bought"]
         current_value = round(self.bought_stocks[stock][0]*price_to_sell, 2)
-        scraper = YahooScraper()
+
+        # The fullname is known from monitoring the stock, only scrape it if it isn't
+        fullname = self.current_status[stock].get("fullname") or self.ticker_metadata.get_or_fetch(
+            stock, 'fullname', lambda: YahooScraper().get_fullname(stock, logger))
 
         new_archive = {
             'ticker': stock,
-            'fullname': scraper.get_fullname(stock, logger),
+            'fullname': fullname,
             'timestamp_bought': self.current_status[stock]["timestamp_bought"],
             'timestamp_sold': utils.date_now_flutter(),
             'net_profit_loss': current_value-value_bought,
@@ -786,6 +1089,8 @@ class Stocks(YahooAPI):
         self.current_status.pop(stock)
         self.monitored_stock_data.pop(stock)
         self.monitored_stocks.remove(stock)
+        self.indicator_states.pop(stock, None)
+        rate_limiter.get_limiter().forget(stock)
 
         self.archive.append(new_archive)
 
@@ -798,32 +1103,32 @@ class Stocks(YahooAPI):
 
         return True
 
-    def check_monitored_stock(self, stock, config_params, logger):
+    def check_monitored_stock(self, stock, config_params, logger, df_data=None, market_state=None):
         FUNCTION = 'check_monitored_stock'
         '''
         This function checks in on a stock that is being monitored.
+        df_data, market_state : latest data and market state of the stock (see prefetch_monitored_stocks),
+                                downloaded here if not provided
         '''
-        scraper = YahooScraper()
         stock_bought = (stock in self.bought_stocks)
-        market_state = scraper.check_market_state(stock, logger=logger)
+        if market_state is None:
+            market_state = self.get_market_state(stock, logger)
         self.current_status[stock]["market_state"] = market_state
         exchange = self.current_status[stock]["exchange"]
 
-        df_data = self.get_latest_data(stock, datetime.now(), exchange, config_params, logger)
+        if df_data is None:
+            df_data = self.get_latest_data(stock, datetime.now(), exchange, config_params, logger, incremental=True)
         if df_data.empty:
             return False
 
-        data = df_data.to_dict(orient='list')
+        data = BarSeries.from_frame(df_data)
         latest_prices = get_latest_prices(stock, data)
         timestamp_data = latest_prices[0]
         price_to_sell = latest_prices[1]
         price_to_buy = latest_prices[2]
         price_current_value = latest_prices[3]
 
-        smallEMAs = data['smallEMA']
-        bigEMAs = data['bigEMA']
-
-        undervalued = (smallEMAs[-1] < bigEMAs[-1])
+        undervalued = (data.latest('smallEMA') < data.latest('bigEMA'))
 
         # TODO update current status better (virtual result)
         if market_state == "CLOSED" and not config_params['main']['ignore_market_hours']:
@@ -846,7 +1151,7 @@ class Stocks(YahooAPI):
             self.current_status[stock]["timestamp_updated"] = utils.date_now_flutter(
             )
 
-            self.monitored_stock_data[stock] = df_data.to_dict(orient='list')
+            self.monitored_stock_data[stock] = data
 
             accept = AcceptParameters(stock, exchange, df_data, config_params)
             self.current_status[stock]["support_level"]=accept.support_level
@@ -864,7 +1169,7 @@ class Stocks(YahooAPI):
             # BUY
             logger.info("Stock {} is not bought and undervalued => buy.".format(
                 stock), extra={'function': FUNCTION})
-            mytime = data['timestamps'][-1]
+            mytime = pd.Timestamp(data.latest('timestamps'))
 
             latency_check = self.check_yahoo_latency(
                 stock, mytime, config_params['trade_logic']['yahoo_latency_threshold'], logger)
@@ -887,7 +1192,7 @@ class Stocks(YahooAPI):
             # SELL
             logger.info("Stock {} is bought and overvalued => sell.".format(
                 stock), extra={'function': FUNCTION})
-            mytime = data['timestamps'][-1]
+            mytime = pd.Timestamp(data.latest('timestamps'))
 
             latency_check = self.check_yahoo_latency(
                 stock, mytime, config_params['trade_logic']['yahoo_latency_threshold'], logger)
@@ -934,13 +1239,16 @@ class Stocks(YahooAPI):
 
             exchange = self.current_status[ticker]["exchange"]
 
+            if not rate_limiter.get_limiter().acquire(rate_limiter.POSITION, ticker):
+                logger.info("Yahoo budget is too tight, selling {} is deferred.".format(ticker), extra={'function': FUNCTION})
+                continue
             df_data = self.get_latest_data(ticker, datetime.now(), exchange, config_params, logger)
             if df_data.empty:
                 logger.debug("Ticker {}. Unable to obtain latest data, ticker is not sold.".format(
                     ticker), extra={'function': FUNCTION})
                 continue
 
-            data = df_data.to_dict(orient='list')
+            data = BarSeries.from_frame(df_data)
             latest_prices = get_latest_prices(ticker, data)
             timestamp_data = latest_prices[0]
             price_to_sell = latest_prices[1]
@@ -948,7 +1256,7 @@ class Stocks(YahooAPI):
             # price_current_value=latest_prices[3]
 
             data = self.monitored_stock_data[ticker]
-            price_to_sell = round(data['low'][-1], 2)
+            price_to_sell = round(float(data.latest('low')), 2)
             reason = "Forced by user."
 
             success = self.sell_stock(
@@ -974,6 +1282,9 @@ class Stocks(YahooAPI):
         if stock in self.monitored_stock_data.keys():
             self.monitored_stock_data.pop(stock)
 
+        self.indicator_states.pop(stock, None)
+        rate_limiter.get_limiter().forget(stock)
+
         self.not_interesting_stocks.append(stock)
 
     def check_to_stop_monitor_stocks(self, commands, command_log, config_params, logger):
@@ -1004,12 +1315,7 @@ class Stocks(YahooAPI):
         utils.write_json(commands, command_log, logger=logger)
 
     def get_gaps(self,df):
-        diff = df.timestamps.diff()
-        result=[]
-        for index in list(diff[diff>timedelta(minutes=500)].index):
-            result.append((df.timestamps.loc[index-1],df.timestamps.loc[index]))
-
-        return result
+        return SessionIndex(df.timestamps).gaps()
 
     def plot_monitored_stock_data(self, output_dir_plots, logger):
         #FUNCTION = 'plot_monitored_stock_data'
@@ -1017,7 +1323,7 @@ class Stocks(YahooAPI):
         This function plots the evolution of the prices per stock.
         '''
         for ticker in self.monitored_stocks:
-            df = pd.DataFrame.from_dict(self.monitored_stock_data[ticker])
+            df = self.monitored_stock_data[ticker].to_frame()
             self.plot_stock(ticker,df,output_dir_plots,logger)
 
     def plot_stock(self,stock,df,output_dir_plots,logger,start=None,bought=None,sold_series=None):
@@ -1165,6 +1471,8 @@ class Stocks(YahooAPI):
         for archive in self.archive:
             total_final_result += archive["net_profit_loss"]
 
+        rate_limit_status = rate_limiter.get_limiter().get_status()
+
         result = {
             'starting_balance': self.balance[0],
             'initial_virtual_result': self.initial_virtual_result,
@@ -1178,7 +1486,11 @@ class Stocks(YahooAPI):
             'number_of_stocks_owned': number_of_stocks_owned,
             'number_of_stocks_monitored': number_of_stocks_monitored,
             'yahoo_daily_calls': self.yahoo_calls['daily_calls'],
-            'yahoo_hourly_calls': self.yahoo_calls['hourly_calls']
+            'yahoo_hourly_calls': self.yahoo_calls['hourly_calls'],
+            'yahoo_hourly_budget': rate_limit_status['hourly_budget'],
+            'yahoo_daily_budget': rate_limit_status['daily_budget'],
+            'yahoo_throttled': rate_limit_status['throttled'],
+            'yahoo_deferred_calls': rate_limit_status['deferred']
         }
 
         self.results[utils.date_now_flutter()]={
@@ -15,8 +15,13 @@ import shutil
 import errno
 import json
 import pytz
+import threading
 
 from yahoo_api import YahooAPI
+import indicators
+import http_client
+import rate_limiter
+import market_sessions
 
 ### LOG WRITING OPERATIONS ###
 def date_now():
@@ -149,16 +154,16 @@ def write_plotdata(monitored_stock_data,path,logger):
     }
     '''
     result={}
-    for ticker in monitored_stock_data:
+    for ticker,series in monitored_stock_data.items():
         result[ticker]={}
-        timestamps=monitored_stock_data[ticker]['timestamps']
-        for i in range(len(timestamps)):
+        data=series.to_dict()
+        for i,timestamp in enumerate(data['timestamps']):
             new_dict={
-                'close':str(monitored_stock_data[ticker]['close'][i]),
-                'smallEMA':str(monitored_stock_data[ticker]['smallEMA'][i]),
-                'bigEMA':str(monitored_stock_data[ticker]['bigEMA'][i]),
+                'close':str(data['close'][i]),
+                'smallEMA':str(data['smallEMA'][i]),
+                'bigEMA':str(data['bigEMA'][i]),
             }
-            result[ticker][str(timestamps[i])]=new_dict
+            result[ticker][timestamp]=new_dict
 
     try:
         with safe_open(path,"w") as f:
@@ -172,9 +177,7 @@ def write_state(stocks,path,logger):
     This function writes the ending config of the daily execution.
     '''
     result={}
-    d=stocks.monitored_stock_data
-    for ticker in d:
-        d[ticker]['timestamps']=[str(t) for t in stocks.monitored_stock_data[ticker]['timestamps']]
+    d={ticker:series.to_state() for ticker,series in stocks.monitored_stock_data.items()}
 
     result["balance"]=stocks.balance
     result["bought_stocks"]=stocks.bought_stocks
@@ -283,6 +286,10 @@ def read_config(config_file,logger=None):
     result['main']['sell_all_before_finish']=(json_data['main']['sell_all_before_finish']=="true")
     result['main']['initial_number_of_stocks']=int(json_data['main']['initial_number_of_stocks'])
     result['main']['check_for_new_stocks']=(json_data['main']['check_for_new_stocks']=="true")
+    result['main']['batch_indicators']=(json_data['main'].get('batch_indicators','false')=="true")
+    result['main']['fetch_concurrency']=int(json_data['main'].get('fetch_concurrency','1'))
+    result['main']['pre_market_minutes']=int(json_data['main'].get('pre_market_minutes',market_sessions.DEFAULT_PRE_MARKET_MINUTES))
+    result['main']['post_market_minutes']=int(json_data['main'].get('post_market_minutes',market_sessions.DEFAULT_POST_MARKET_MINUTES))
 
     result['trade_logic']['money_to_spend']=float(json_data['trade_logic']['money_to_spend'])
     result['trade_logic']['yahoo_latency_threshold']=float(json_data['trade_logic']['yahoo_latency_threshold'])
@@ -300,12 +307,36 @@ def read_config(config_file,logger=None):
     result['trade_logic']['drop_buying']=int(json_data['trade_logic']['drop_buying'])
     result['trade_logic']['support_days']=int(json_data['trade_logic']['support_days'])
     result['trade_logic']['support_percentage']=int(json_data['trade_logic']['support_percentage'])
+    result['trade_logic']['yahoo_indicators']=indicators.resolve_indicators(json_data['trade_logic'].get('yahoo_indicators','all'))
+    result['trade_logic']['yahoo_bar_store']=json_data['trade_logic'].get('yahoo_bar_store','')
+    result['trade_logic']['ticker_metadata_file']=json_data['trade_logic'].get('ticker_metadata_file','')
+    result['trade_logic']['indicator_check_interval']=int(json_data['trade_logic'].get('indicator_check_interval','12'))
     
 
 
     result['logging']['level_console']=json_data['logging']['level_console']
     result['logging']['level_file']=json_data['logging']['level_file']
 
+    http_config=dict(http_client.DEFAULT_CONFIG,**json_data.get('http',{}))
+    result['http']={}
+    result['http']['connect_timeout']=float(http_config['connect_timeout'])
+    result['http']['read_timeout']=float(http_config['read_timeout'])
+    result['http']['retries']=int(http_config['retries'])
+    result['http']['backoff']=float(http_config['backoff'])
+    result['http']['backoff_max']=float(http_config['backoff_max'])
+    result['http']['pool_size']=int(http_config['pool_size'])
+    result['http']['cassette_mode']=http_config['cassette_mode']
+    result['http']['cassette_dir']=http_config['cassette_dir']
+
+    rate_limit_config=dict(rate_limiter.DEFAULT_CONFIG,**json_data.get('rate_limit',{}))
+    result['rate_limit']={}
+    result['rate_limit']['hourly_limit']=int(rate_limit_config['hourly_limit'])
+    result['rate_limit']['daily_limit']=int(rate_limit_config['daily_limit'])
+    result['rate_limit']['monitored_reserve']=float(rate_limit_config['monitored_reserve'])
+    result['rate_limit']['screening_reserve']=float(rate_limit_config['screening_reserve'])
+    result['rate_limit']['backtesting_reserve']=float(rate_limit_config['backtesting_reserve'])
+    result['rate_limit']['throttle_cooldown']=float(rate_limit_config['throttle_cooldown'])
+
     return result
 
 def read_json_data(file_path,logger=None):
@@ -489,24 +520,62 @@ def get_deriv_surf(input,logger):
 
     return D,A_result
 
+# Years of valid business days computed per exchange before and after the requested date
+VALID_DAYS_YEARS_PAST=5
+VALID_DAYS_YEARS_FUTURE=1
+
+# Valid business days per exchange {exchange:(start,end,DatetimeIndex (UTC))}, None for unknown exchanges
+_valid_days={}
+_valid_days_lock=threading.Lock()
+
+def get_valid_days(exchange,day,logger=None):
+    FUNCTION='get_valid_days'
+    '''
+    Returns the DatetimeIndex of the valid business days of the exchange, covering day
+    (pd.Timestamp). The calendar is only built, and the valid days computed, once per exchange
+    for several years around day. Returns None if the exchange is not recognized.
+    '''
+    with _valid_days_lock:
+        if exchange in _valid_days:
+            if _valid_days[exchange] is None:
+                return None
+            start,end,days=_valid_days[exchange]
+            if start<=day<=end:
+                return days
+
+        try:
+            cal=mcal.get_calendar(exchange)
+        except RuntimeError:
+            if logger:
+                logger.error("Exchange {} is not recognized by pandas market calendar.".format(exchange),extra={'function':FUNCTION})
+            _valid_days[exchange]=None
+            return None
+
+        start=day-pd.DateOffset(years=VALID_DAYS_YEARS_PAST)
+        end=day+pd.DateOffset(years=VALID_DAYS_YEARS_FUTURE)
+        days=cal.valid_days(start_date=start.strftime("%Y-%m-%d"),end_date=end.strftime("%Y-%m-%d"))
+        _valid_days[exchange]=(start,end,days)
+
+        return days
+
 def get_start_business_date(exchange,date,input_days_in_past,logger=None):
     FUNCTION='get_start_business_date'
     '''
-    Get start business date
+    Get start business date: the input_days_in_past-th valid business day of the exchange,
+    counting back from date (included). Returns None if the exchange is not recognized.
     '''
-    try:
-        cal=mcal.get_calendar(exchange)
-    except RuntimeError:
-        if logger:
-            logger.error("Exchange {} is not recognized by pandas market calendar.".format(exchange),extra={'function':FUNCTION})
+    day=pd.Timestamp(datetime.strftime(date,"%Y-%m-%d"),tz='UTC')
+    days=get_valid_days(exchange,day,logger=logger)
+    if days is None:
         return None
 
-    start=datetime.strftime(date-timedelta(days=100),"%Y-%m-%d")
-    end=datetime.strftime(date,"%Y-%m-%d")
-
-    series=cal.valid_days(start_date=start, end_date=end)
+    index=days.searchsorted(day,side='right')-input_days_in_past
+    if index<0:
+        if logger:
+            logger.error("Less than {} business days found for exchange {} before {}.".format(input_days_in_past,exchange,date),extra={'function':FUNCTION})
+        return None
 
-    return series[-input_days_in_past]
+    return days[index]
 
 def configure_logger(name,output_log,config_params):
     logging.config.dictConfig({
@@ -4,12 +4,18 @@
 from datetime import datetime,timedelta
 import pandas as pd
 import numpy as np
-import requests
+import http_client
 import json
+import indicators
+from indicators import IndicatorPipeline,batch_indicators
+from bar_store import BarStore,COLUMNS,concatenate
 
 class YahooAPI:
-    def __init__(self):
+    def __init__(self,bar_store=None):
         self.base_url = "https://query1.finance.yahoo.com"
+        self.bar_store = bar_store
+        self.EMA_cache = {}
+        self.gmtoffsets = {}
 
     def get_historic_data(self,ticker,start,end,interval,logger=None):
         FUNCTION='get_historic_data'
@@ -19,9 +25,9 @@ class YahooAPI:
 
         start and end inputs given in CEST timezone
         timestamps in df are given in UTC timezone
-        '''
-        url=self.base_url+"/v8/finance/chart/{}".format(ticker)
 
+        With a bar store, stored bars are read from disk and only missing ranges are downloaded.
+        '''
         if logger:
             logger.debug("Ticker: {}. Getting data from {} until {}".format(ticker,start,end),extra={'function':FUNCTION})
 
@@ -34,52 +40,138 @@ class YahooAPI:
         else:
             end_datetime=end
 
-        first_unix=datetime(1970,1,1)
-        
-        start_unix=int((start_datetime-first_unix).total_seconds())-2*3600
-        end_unix=int((end_datetime-first_unix).total_seconds())-2*3600
+        start_unix,end_unix=self.get_unix_range(start_datetime,end_datetime)
 
         if logger:
             logger.debug("Ticker: {}. Start unix: {}, end unix: {}".format(ticker,start_unix,end_unix),extra={'function':FUNCTION})
 
-        #print(url+"?"+"symbol="+ticker+"&"+"period1="+str(start_unix)+"&"+"period2="+str(end_unix)+"&"+"interval="+interval+"&"+"includePrePost="+"false")
+        if self.bar_store:
+            response=self.get_stored_bars(ticker,start_unix,end_unix,interval,logger=logger)
+        else:
+            response=self.request_bars(ticker,start_unix,end_unix,interval,logger=logger)
+        if response is None:
+            return pd.DataFrame
+        bars,gmtoffset=response
+        self.gmtoffsets[ticker]=gmtoffset
+
+        if not len(bars['timestamps']):
+            if logger:
+                logger.debug("Ticker: {}. No valid data (KeyError when getting timestamps) was obtained from the yahooAPI".format(ticker),extra={'function':FUNCTION})
+            return pd.DataFrame
+
+        # Bars with a missing value are dropped, timestamps are shifted to the exchange timezone
+        valid=np.ones(len(bars['timestamps']),dtype=bool)
+        for column in COLUMNS[1:]:
+            valid&=~np.isnan(bars[column])
+
+        df_dict={'timestamps':(bars['timestamps'][valid]+gmtoffset).astype('datetime64[s]')}
+        for column in COLUMNS[1:]:
+            df_dict[column]=bars[column][valid]
+
+        return pd.DataFrame(df_dict)
+
+    @staticmethod
+    def get_unix_range(start,end):
+        '''
+        Converts the start and end (datetimes in CEST timezone) of get_historic_data to unix timestamps.
+        '''
+        first_unix=datetime(1970,1,1)
+
+        start_unix=int((start-first_unix).total_seconds())-2*3600
+        end_unix=int((end-first_unix).total_seconds())-2*3600
+
+        return start_unix,end_unix
+
+    def get_request_count(self,ticker,start,end,interval):
+        '''
+        Returns the number of yahoo requests get_historic_data makes for the bars: one, or with
+        a bar store one per range that isn't stored yet.
+        '''
+        if not self.bar_store:
+            return 1
+
+        start_unix,end_unix=self.get_unix_range(start,end)
+        return len(self.bar_store.missing(ticker,interval,start_unix,end_unix))
+
+    def get_exchange_time(self,ticker,date):
+        '''
+        Converts a date in CEST timezone (as the start and end of get_historic_data) to the
+        timezone of the timestamps of the bars of the ticker, or returns None if the
+        timezone of the ticker isn't known yet.
+        '''
+        gmtoffset=self.gmtoffsets.get(ticker)
+        if gmtoffset is None:
+            return None
+        return date-timedelta(hours=2)+timedelta(seconds=gmtoffset)
+
+    def get_request_time(self,ticker,timestamp):
+        '''
+        Converts a timestamp of the bars of the ticker to a date in CEST timezone (as the
+        start and end of get_historic_data), or returns None if the timezone of the ticker
+        isn't known yet.
+        '''
+        gmtoffset=self.gmtoffsets.get(ticker)
+        if gmtoffset is None:
+            return None
+        return pd.Timestamp(timestamp).to_pydatetime()-timedelta(seconds=gmtoffset)+timedelta(hours=2)
+
+    def request_bars(self,ticker,start_unix,end_unix,interval,logger=None):
+        FUNCTION='request_bars'
+        '''
+        Downloads the bars of the unix time range [start_unix,end_unix).
+        Returns a tuple (bars,gmtoffset) with bars a dict {column:array}, or None.
+        '''
+        url=self.base_url+"/v8/finance/chart/{}".format(ticker)
+
         try:
-            req=requests.get(url,params={'symbol':ticker,'period1':start_unix,'period2':end_unix,'interval':interval,'includePrePost':'false'})
+            req=http_client.get(url,params={'symbol':ticker,'period1':start_unix,'period2':end_unix,'interval':interval,'includePrePost':'false'})
         except:
             if logger:
                 logger.error("Ticker: {}. Error occured while performing request to yahoo API.".format(ticker),extra={'function':FUNCTION})
-            return pd.DataFrame
+            return None
 
         if req.status_code!=200:
             if logger:
                 logger.debug("Ticker: {}. No valid response was received from the yahoo query ({}). Status code: {}".format(ticker,url,req.status_code),extra={'function':FUNCTION})
             print(req.text)
-            return pd.DataFrame
+            return None
 
-        json_data=json.loads(req.text)
+        # Parse the raw bytes, decoding them to text first only costs time
+        result=json.loads(req.content)['chart']['result'][0]
 
-        gmtoffset=int(json_data['chart']['result'][0]['meta']['gmtoffset'])
+        gmtoffset=int(result['meta']['gmtoffset'])
 
-        try:
-            timestamps = [first_unix+timedelta(seconds=int(t)+gmtoffset) for t in json_data['chart']['result'][0]['timestamp']]
-        except KeyError:
-            if logger:
-                logger.debug("Ticker: {}. No valid data (KeyError when getting timestamps) was obtained from the yahooAPI".format(ticker),extra={'function':FUNCTION})
-            return pd.DataFrame
+        if not 'timestamp' in result:
+            return concatenate([]),gmtoffset
 
-        df_dict={'timestamps':timestamps,
-                 'open':json_data['chart']['result'][0]['indicators']['quote'][0]['open'],
-                 'close':json_data['chart']['result'][0]['indicators']['quote'][0]['close'],
-                 'low':json_data['chart']['result'][0]['indicators']['quote'][0]['low'],
-                 'high':json_data['chart']['result'][0]['indicators']['quote'][0]['high'],
-                 'volume':json_data['chart']['result'][0]['indicators']['quote'][0]['volume']}
+        quote=result['indicators']['quote'][0]
+        bars={'timestamps':np.array(result['timestamp'],dtype=np.int64)}
+        for column in COLUMNS[1:]:
+            bars[column]=np.array(quote[column],dtype=float)
 
-        df=pd.DataFrame(data=df_dict)
-        df.dropna(inplace=True)
-        df.reset_index(inplace=True)
-        df.drop('index',axis=1,inplace=True,errors='ignore')
+        return bars,gmtoffset
 
-        return df
+    def get_stored_bars(self,ticker,start_unix,end_unix,interval,logger=None):
+        FUNCTION='get_stored_bars'
+        '''
+        Same as request_bars, but the bars that are available in the bar store are read from
+        disk and only the missing ranges are downloaded (and added to the store).
+        '''
+        parts=[self.bar_store.read(ticker,interval,start_unix,end_unix)]
+        gmtoffset=self.bar_store.get_gmtoffset(ticker,interval)
+
+        for missing_start,missing_end in self.bar_store.missing(ticker,interval,start_unix,end_unix):
+            if logger:
+                logger.debug("Ticker: {}. Downloading missing bars from unix {} until {}".format(ticker,missing_start,missing_end),extra={'function':FUNCTION})
+            response=self.request_bars(ticker,missing_start,missing_end,interval,logger=logger)
+            if response is None:
+                return None
+
+            bars,gmtoffset=response
+            self.bar_store.write(ticker,interval,missing_start,missing_end,bars,gmtoffset)
+            parts.append(BarStore.select(bars,missing_start,missing_end))
+
+        return concatenate(parts),gmtoffset
 
     def calculate_EMAs( 
         self,
@@ -100,128 +192,75 @@ class YahooAPI:
             return df.dropna()
         
         timestamps=df.timestamps
-        points=df[mytype]
 
-        EMAs=[]
-
-        # 1) Calculate first SMA
         if len(timestamps)<=period:
-            logger.debug("Ticker: {}. Length of data from yahooAPI ({}) was smaller than requested EMA period ({}).".format(ticker,len(timestamps),period),extra={'function':FUNCTION})
+            if logger:
+                logger.debug("Ticker: {}. Length of data from yahooAPI ({}) was smaller than requested EMA period ({}).".format(ticker,len(timestamps),period),extra={'function':FUNCTION})
+            return pd.DataFrame
+
+        EMAs=indicators.ema(df[mytype].to_numpy(dtype=float),period)
+        if EMAs is None:
+            if logger:
+                logger.debug("Ticker: {}. Not enough valid {} points to seed an EMA with period {}.".format(ticker,mytype,period),extra={'function':FUNCTION})
             return pd.DataFrame
 
-        i=0
-        point = points[i]
-        while np.isnan(point):
-            EMAs.append(np.nan)
-            i+=1
-            point=points[i]
-
-        in_process=True
-        initial_points=[]
-        while in_process:
-            if not np.isnan(points[i]):
-                initial_points.append(points[i])
-            EMAs.append(np.nan)
-            i+=1
-
-            if len(initial_points)==period:
-                in_process=False
-        
-        SMA = np.mean(initial_points)
-        
-        # 2) Calculate first EMA
-        EMA_init=points[i]*(2/(1+period)) + SMA*(1-2/(1+period))
-        EMAs.append(EMA_init)
-        i+=1
-
-        # 3) Calculate other EMAs
-        length=len(timestamps)
-        for j in range(i,length):
-            EMA=points[j]*(2/(1+period)) + EMAs[j-1]*(1-2/(1+period))
-            EMAs.append(EMA)
-
-        # 4) Convert to to pandas df
         result={'timestamps':timestamps,label:EMAs}
         df=pd.DataFrame(result)
 
         return df.set_index('timestamps')
 
-    def calculate_SAR(self,ticker,df):
+    def get_EMA_periods(self,ticker,start,end,interval,periods,logger=None):
+        FUNCTION='get_EMA_periods'
+        '''
+        Returns a tuple (bars,EMAs) with the dataframe of get_historic_data and the
+        (periods x bars) matrix with the EMAs of the closes for every period in periods
+        (see indicators.ema_periods), or None if no data was obtained.
+
+        The bars and EMAs are cached per ticker and interval. As long as start and end
+        don't change, only the EMAs of periods that weren't requested before are calculated.
+        '''
+        cached=self.EMA_cache.get((ticker,interval))
+        if cached is None or cached['start']!=start or cached['end']!=end:
+            df_data=self.get_historic_data(ticker,start,end,interval,logger=logger)
+            if df_data.empty:
+                return None
+            if not df_data.timestamps.is_monotonic_increasing:
+                df_data=df_data.sort_values('timestamps').reset_index(drop=True)
+
+            cached={'start':start,'end':end,'bars':df_data,'rows':{},'EMAs':np.empty((0,len(df_data)))}
+            self.EMA_cache[(ticker,interval)]=cached
+
+        periods=[int(period) for period in periods]
+        missing=[period for period in dict.fromkeys(periods) if not period in cached['rows']]
+        if missing:
+            if logger:
+                logger.debug("Ticker: {}. Calculating the EMAs of {} periods.".format(ticker,len(missing)),extra={'function':FUNCTION})
+            first=len(cached['EMAs'])
+            EMAs=indicators.ema_periods(cached['bars'].close.to_numpy(dtype=float),missing)
+            cached['EMAs']=np.concatenate((cached['EMAs'],EMAs))
+            cached['rows'].update({period:first+i for i,period in enumerate(missing)})
+
+        return cached['bars'],cached['EMAs'][[cached['rows'][period] for period in periods]]
+
+    def calculate_SAR(self,ticker,df,state=None):
         '''
         calculate parabolic SAR
+        When a SARState of a previous call is provided, df should only contain the new
+        bars and the existing SAR series is extended.
         '''
         if df.empty:
             return df
 
         df = df.sort_values('timestamps')
 
-        timestamps = df.timestamps
-        highs = df.high
-        opens = df.open
-        closes = df.close
-        lows = df.low
-
-        # Initialize values
-        alpha_prev = 0.02
-        if opens[0]>closes[0]:
-            trend_prev = "down"
-            EP_prev = lows[0]
-            SAR_prev = lows[0]
-        else:
-            trend_prev = "up"
-            EP_prev = highs[0]
-            SAR_prev = highs[0]
-
-        results = [SAR_prev]
-
-        # Caluclate SAR for each timestamp
-        for i in range(1,len(timestamps)):
-            if trend_prev=='up':
-                high = highs[i]
-                low = lows[i]
-
-                EP_new = max(EP_prev,high)
-                alpha_new = alpha_prev
-                if high>EP_prev and alpha_prev<=0.18:
-                        alpha_new+=0.02
-
-                SAR_new = SAR_prev + alpha_prev*(EP_prev-SAR_prev)
-
-                trend_new = trend_prev
-                if SAR_new>=low:
-                    trend_new = 'down'
-                    alpha_new = 0.02
-                    EP_new = low
-                    SAR_new = max(high,EP_prev)
-
-            elif trend_prev=='down':
-                high = highs[i]
-                low = lows[i]
-
-                EP_new = min(EP_prev,low)
-                alpha_new = alpha_prev
-                
-                if low<EP_prev and alpha_prev<=0.18:
-                        alpha_new+=0.02
-                
-                SAR_new = SAR_prev - alpha_prev*(SAR_prev-EP_prev)
-
-                trend_new = trend_prev
-                if SAR_new<=high:
-                    trend_new = 'up'
-                    alpha_new = 0.02
-                    EP_new = high
-                    SAR_new = min(low,EP_prev)
-
-            results.append(SAR_new)
-            trend_prev = trend_new
-            EP_prev = EP_new
-            alpha_prev = alpha_new
-            SAR_prev = SAR_new
-
-        df = pd.DataFrame({'timestamps':timestamps,'SAR':results})
+        SARs,_ = indicators.sar(
+            df.high.to_numpy(dtype=float),
+            df.low.to_numpy(dtype=float),
+            df.open.to_numpy(dtype=float),
+            df.close.to_numpy(dtype=float),
+            state=state)
 
-        return df.set_index('timestamps')
+        return pd.DataFrame({'SAR':SARs},index=df.timestamps)
 
     def calculate_oscillators(self,ticker,df,logger=None):
         '''
@@ -232,34 +271,19 @@ class YahooAPI:
             
         df = df.sort_values('timestamps')
 
-        timestamps = df.timestamps
-        highs = df.high
-        closes = df.close
-        lows = df.low
-
-        N = 140
-        # Initialize slow results
-        slow_results = [np.nan for i in range(1,N)]
-
-        # Calculate slow results for each timestamp
-        for i in range(N,len(timestamps)+1):
-            LN = min(lows[i-N:i])
-            HN = max(highs[i-N:i])
-            C = closes[i-1]
-
-            P_K = 100*(C-LN)/(HN-LN)
-            slow_results.append(P_K)
-
-        df = pd.DataFrame(list(zip(timestamps,slow_results)),columns=['timestamps','slow_oscillator'])
-
-        # Calculate fast results
-        df_fast_oscillator = self.calculate_EMAs(ticker,df,'slow_oscillator',30,'fast_oscillator',logger)
+        slow,fast = indicators.oscillators(
+            df.high.to_numpy(dtype=float),
+            df.low.to_numpy(dtype=float),
+            df.close.to_numpy(dtype=float),
+            period=140,
+            fast_period=30)
 
-        df_result = pd.concat([df.set_index('timestamps'),df_fast_oscillator],axis=1)
+        df_result = pd.DataFrame({'slow_oscillator':slow,'fast_oscillator':fast},index=df.timestamps)
 
         return df_result
 
     def calculate_MACD(self,ticker,df,logger=None):
+        FUNCTION='calculate_MACD'
         '''
         Calculate the MACD
         '''
@@ -268,25 +292,20 @@ class YahooAPI:
             
         df = df.sort_values('timestamps')
 
-        df_EMA12=self.calculate_EMAs(ticker,df,'close',12,'EMA12',logger=logger)
-        df_EMA26=self.calculate_EMAs(ticker,df,'close',26,'EMA26',logger=logger)
-        if df_EMA12.empty or df_EMA26.empty:
+        MACD = indicators.macd(df.close.to_numpy(dtype=float))
+        if MACD is None:
             if logger:
-                logger.debug("Ticker {} and EMA period {}: no valid data from calculating the EMAs was received.".format(ticker,1),extra={'function':FUNCTION})
+                logger.debug("Ticker {}: not enough data to calculate the EMAs of the MACD.".format(ticker),extra={'function':FUNCTION})
             return pd.DataFrame
 
-        df_MACD = pd.concat([df_EMA12,df_EMA26],axis=1).reset_index()
-        df_MACD['MACD_line'] = df_MACD.EMA12-df_MACD.EMA26
+        MACD_line,signal_line,MACD_histo = MACD
 
-        signal_line = self.calculate_EMAs(ticker,df_MACD,'MACD_line',9,'signal_line',logger)
-        df_MACD = pd.concat([df_MACD.set_index('timestamps'),signal_line],axis=1)
-        df_MACD['MACD_histo'] = df_MACD.MACD_line-df_MACD.signal_line
+        return pd.DataFrame({'MACD_line':MACD_line,'signal_line':signal_line,'MACD_histo':MACD_histo},index=df.timestamps)
 
-        return df_MACD[['MACD_line','signal_line','MACD_histo']]
-
-    def calculate_RSI(self,ticker,df,logger=None):
+    def calculate_RSI(self,ticker,df,logger=None,smoothing='simple'):
         '''
-        Calculate the RSI
+        Calculate the RSI. The provided df is not modified.
+        smoothing: 'simple' (rolling mean of the last 14 gains/losses) or 'wilder'
         '''
         if df.empty:
             return df
@@ -295,116 +314,80 @@ class YahooAPI:
 
         period = 14
 
-        if len(df)<=period:
+        RSIs = indicators.rsi(df.open.to_numpy(dtype=float),df.close.to_numpy(dtype=float),period=period,smoothing=smoothing)
+        if RSIs is None:
             return pd.DataFrame
 
-        df_rsi = df
-        df_rsi['diff'] = df.close - df.open
-        df_rsi['gain'] = df_rsi['diff'].apply(lambda x: x if x>=0 else 0)
-        df_rsi['loss'] = df_rsi['diff'].apply(lambda x: x if x<0 else 0)
-
-        gains = list(df_rsi.gain)
-        losses = list(df_rsi.loss)
-        RSIs = [np.nan for i in range(period)]
-        for i in range(period,len(gains)):
-            avg_gain = np.mean(gains[i-14:i])
-            avg_loss = -np.mean(losses[i-14:i])
-            if avg_loss==0:
-                new_RSI=100
-            else:
-                new_RSI = 100 - (100/(1+(avg_gain/avg_loss)))
-            RSIs.append(new_RSI)
-
-        df_rsi['RSI'] = RSIs
-
-        df_rsi = df_rsi.set_index('timestamps')
+        return pd.DataFrame({'RSI':RSIs},index=df.timestamps)
 
-        return df_rsi[['RSI']]
 
 
-
-    def get_data(self,ticker,start,end,interval,period_small_EMA,period_big_EMA,logger=None):
+    def get_data(self,ticker,start,end,interval,period_small_EMA,period_big_EMA,logger=None,indicator_names=None):
         FUNCTION='get_data'
         '''
         returns dataframe:
-        'index' | 'timestamps' | 'open' | 'close' | 'low' | 'high' | 'volume' | 'smallEMA' | 'bigEMA'
+        'index' | 'timestamps' | 'open' | 'close' | 'low' | 'high' | 'volume' | 'smallEMA' | 'bigEMA' | ...
+
+        indicator_names: list of indicator (or column) names to calculate, see indicators.INDICATORS.
+        Dependencies are resolved automatically. None calculates all indicators.
+
+        All indicators are computed on the arrays of the downloaded bars, which share
+        one timestamp vector, and the resulting dataframe is built only once.
         '''
         df_data=self.get_historic_data(ticker,start,end,interval,logger=logger)
         if df_data.empty:
             return df_data
-        #df_base=df_data.set_index('timestamps')
 
-        df_smallEMA=self.calculate_EMAs(ticker,df_data,'close',period_small_EMA,'smallEMA',logger=logger)
-        if df_smallEMA.empty:
-            if logger:
-                logger.debug("Ticker {} and EMA period {}: no valid data from calculating the EMAs was received.".format(ticker,period_small_EMA),extra={'function':FUNCTION})
-            return pd.DataFrame
-
-        df_bigEMA=self.calculate_EMAs(ticker,df_data,'close',period_big_EMA,'bigEMA',logger=logger)
-        if df_bigEMA.empty:
-            if logger:
-                logger.debug("Ticker {} and EMA period {}: no valid data from calculating the EMAs was received.".format(ticker,period_big_EMA),extra={'function':FUNCTION})
-            return pd.DataFrame
+        if not df_data.timestamps.is_monotonic_increasing:
+            df_data=df_data.sort_values('timestamps').reset_index(drop=True)
 
-        df_simpleEMA=self.calculate_EMAs(ticker,df_data,'close',1,'simpleEMA',logger=logger)
-        if df_simpleEMA.empty:
+        pipeline=IndicatorPipeline(df_data,period_small_EMA,period_big_EMA)
+        df=pipeline.frame(indicator_names)
+        if df is None:
             if logger:
-                logger.debug("Ticker {} and EMA period {}: no valid data from calculating the EMAs was received.".format(ticker,1),extra={'function':FUNCTION})
+                logger.debug("Ticker {}: Unable to calculate the {} indicator (small EMA period {}, big EMA period {}).".format(ticker,pipeline.failed,period_small_EMA,period_big_EMA),extra={'function':FUNCTION})
             return pd.DataFrame
 
-        df_advancedEMA=self.calculate_EMAs(ticker,df_data,'close',20,'advancedEMA',logger=logger)
-        if df_simpleEMA.empty:
-            if logger:
-                logger.debug("Ticker {} and EMA period {}: no valid data from calculating the EMAs was received.".format(ticker,1),extra={'function':FUNCTION})
-            return pd.DataFrame
-
-        df_SAR=self.calculate_SAR(ticker,df_data)
-        if df_SAR.empty:
-            if logger:
-                logger.debug("Ticker {}: Unable to calculate parabolic SAR.".format(ticker),extra={'function':FUNCTION})
-            return pd.DataFrame
-
-        df_oscillators=self.calculate_oscillators(ticker,df_data,logger)
-        if df_oscillators.empty:
-            if logger:
-                logger.debug("Ticker {}: Unable to calculate fast and slow oscillators.".format(ticker),extra={'function':FUNCTION})
-            return pd.DataFrame
-
-        df_MACD=self.calculate_MACD(ticker,df_data,logger)
-        if df_MACD.empty:
-            if logger:
-                logger.debug("Ticker {}: Unable to calculate the MACD indicator.".format(ticker),extra={'function':FUNCTION})
-            return pd.DataFrame
-
-        df_RSI=self.calculate_RSI(ticker,df_data,logger)
-        if df_RSI.empty:
-            if logger:
-                logger.debug("Ticker {}: Unable to calculate the RSI.".format(ticker),extra={'function':FUNCTION})
-            return pd.DataFrame
-
-        df=pd.concat([
-            df_data.set_index('timestamps'),
-            df_smallEMA,
-            df_bigEMA,
-            df_simpleEMA,
-            df_advancedEMA,
-            df_SAR,
-            df_oscillators,
-            df_MACD,
-            df_RSI
-            ],axis=1,join='outer').reset_index()
-        df.drop('index',axis=1,inplace=True,errors='ignore')
-        df.sort_values("timestamps",inplace=True)
-
         return df
 
+    def get_data_batch(self,tickers,start,end,interval,period_small_EMA,period_big_EMA,logger=None,indicator_names=None):
+        '''
+        get_data for several tickers over the same period.
+        Returns a dict {ticker:dataframe}, see get_indicators_batch.
+        '''
+        bars={ticker:self.get_historic_data(ticker,start,end,interval,logger=logger) for ticker in tickers}
 
+        return self.get_indicators_batch(bars,period_small_EMA,period_big_EMA,logger=logger,indicator_names=indicator_names)
 
+    def get_indicators_batch(self,bars,period_small_EMA,period_big_EMA,logger=None,indicator_names=None):
+        FUNCTION='get_indicators_batch'
+        '''
+        Calculates the indicators for the bars of several tickers.
+        bars: dict {ticker:dataframe returned by get_historic_data}
 
-
-
-
-
-
-
-
+        Returns a dict {ticker:dataframe} with the same dataframes as get_data. The EMA, MACD and
+        crossings indicators of all tickers are calculated together on one (tickers x bars) matrix
+        (see indicators.batch_indicators), the other indicators per ticker.
+        '''
+        result={}
+        valid={}
+        for ticker,df_data in bars.items():
+            if df_data.empty:
+                result[ticker]=df_data
+                continue
+            if not df_data.timestamps.is_monotonic_increasing:
+                df_data=df_data.sort_values('timestamps').reset_index(drop=True)
+            valid[ticker]=df_data
+
+        precomputed=batch_indicators([df_data.close.to_numpy(dtype=float) for df_data in valid.values()],period_small_EMA,period_big_EMA,indicator_names)
+
+        for (ticker,df_data),columns in zip(valid.items(),precomputed):
+            pipeline=IndicatorPipeline(df_data,period_small_EMA,period_big_EMA,precomputed=columns)
+            df=pipeline.frame(indicator_names)
+            if df is None:
+                if logger:
+                    logger.debug("Ticker {}: Unable to calculate the {} indicator (small EMA period {}, big EMA period {}).".format(ticker,pipeline.failed,period_small_EMA,period_big_EMA),extra={'function':FUNCTION})
+                df=pd.DataFrame
+            result[ticker]=df
+
+        return {ticker:result[ticker] for ticker in bars}
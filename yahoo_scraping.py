@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import requests
+import http_client
 import pandas_market_calendars as mcal
 from datetime import datetime,timedelta,timezone
 import pandas as pd
 from bs4 import BeautifulSoup as Soup
 import re
+from html import unescape
+import time
+import threading
 import utils
 
 MARKET_IDS={'NasdaqGS':'NASDAQ',
@@ -17,48 +20,137 @@ MARKET_IDS={'NasdaqGS':'NASDAQ',
             'NYSEArca':'NYSE',
             'NYSEAmerican':'NYSE'}
 
-class YahooScraper:
-    def __init__(self):
-        self.base_url="https://finance.yahoo.com"
-
-    def get_fullname(self,ticker,logger):
-        FUNCTION='get_fullname'
-        ticker_upper=ticker.upper()
-        url=self.base_url+"/quote/{}".format(ticker_upper)
-        try:
-            req=requests.get(url)
-        except:
-            logger.debug("Ticker: {}. Error while calling http get request from the yahoo website ({}).".format(ticker,url),extra={'function':FUNCTION})
-            return None
-
-        if not req.status_code==200:
-            logger.debug("Ticker: {}. No valid resonse was obtained from the yahoo website. Status code: {}".format(ticker,req.status_code),extra={'function':FUNCTION})
-            return None
+# Snapshots older than this (s) are fetched again, also when the cache isn't cleared
+SNAPSHOT_MAX_AGE=300
+
+# Labels of the market state on the quote page
+MARKET_STATE_LABELS=['Market open','At close','Before hours','After hours']
+# The market state labels are first looked for in this many bytes after the currency text (quote header)
+QUOTE_HEADER_SIZE=20000
+
+class QuoteSnapshot:
+    '''
+    Fields of the yahoo quote page (/quote/TICKER) of a ticker: fullname, exchange and
+    market state. The page is downloaded and parsed once for all fields, see
+    YahooScraper.get_quote_snapshot. Fields that couldn't be parsed are None
+    (market_state "UNKNOWN").
+    '''
+    def __init__(self,ticker,fullname=None,exchange=None,market_state="UNKNOWN"):
+        self.ticker=ticker
+        self.fullname=fullname
+        self.exchange=exchange
+        self.market_state=market_state
+        self.timestamp=time.monotonic()
+
+    @classmethod
+    def from_html(cls,ticker,html,logger):
+        '''
+        Parses the quote page (bytes or str). The fields are extracted with byte patterns,
+        the page is only parsed with BeautifulSoup for the fields that weren't found.
+        '''
+        if isinstance(html,str):
+            html=html.encode('utf-8')
 
-        soep=Soup(req.text,'html.parser')
-        text=soep.find(text=re.compile('.*({})'.format(ticker_upper)))
-        fullname=text.split("({})".format(ticker_upper))[0]
+        fullname,exchange_text,labels=cls.extract(ticker,html)
+        if fullname is None or exchange_text is None or not labels:
+            return cls.from_soup(ticker,Soup(html,'html.parser'),logger,
+                                fullname=fullname,exchange_text=exchange_text,labels=labels)
 
-        return fullname
+        return cls(ticker,
+                    fullname=fullname,
+                    exchange=cls.get_exchange_id(exchange_text,ticker,logger),
+                    market_state=cls.get_market_state(labels,logger))
 
-    def get_exchange(self,ticker,logger):
-        FUNCTION='get_exchange'
+    @classmethod
+    def from_soup(cls,ticker,soep,logger,fullname=None,exchange_text=None,labels=None):
         '''
-        Get the exchange on which the given ticker is traded.
+        Parses the fields that weren't extracted yet from the BeautifulSoup tree of the page.
         '''
-        url=self.base_url+"/quote/{}".format(ticker.upper())
-        try:
-            req=requests.get(url)
-        except:
-            logger.debug("Ticker: {}. Error while calling http get request from the yahoo website ({}).".format(ticker,url),extra={'function':FUNCTION})
+        if fullname is None:
+            fullname=cls.parse_fullname(soep,ticker,logger)
+        if exchange_text is None:
+            exchange_text=soep.find(text=re.compile('.*Currency in.*'))
+        if not labels:
+            labels={label for label in MARKET_STATE_LABELS
+                    if soep.find("span",text=re.compile('.*{}.*'.format(label)))}
+
+        return cls(ticker,
+                    fullname=fullname,
+                    exchange=cls.get_exchange_id(exchange_text,ticker,logger),
+                    market_state=cls.get_market_state(labels,logger))
+
+    @classmethod
+    def extract(cls,ticker,html):
+        '''
+        Fast extraction path: returns (fullname,exchange text,set of market state labels)
+        found in the raw bytes of the page, without building a tree. Missing values are None
+        (an empty set for the labels).
+        '''
+        ticker_upper=ticker.upper()
+        fullname=None
+        text=cls.find_text(html,"({})".format(ticker_upper).encode('utf-8'))
+        if text is not None:
+            fullname=unescape(text.decode('utf-8','replace')).split("({})".format(ticker_upper))[0]
+
+        header=html.find(b'Currency in')
+        text=cls.find_text(html,b'Currency in')
+        exchange_text=unescape(text.decode('utf-8','replace')) if text is not None else None
+
+        # Only scan the whole page if the quote header has no market state
+        labels=set()
+        if header>=0:
+            labels=cls.find_labels(html[header:header+QUOTE_HEADER_SIZE])
+        if not labels:
+            labels=cls.find_labels(html)
+
+        return fullname,exchange_text,labels
+
+    @classmethod
+    def find_labels(cls,html):
+        return {label for label in MARKET_STATE_LABELS if cls.find_text(html,label.encode('utf-8'),tag=b'span') is not None}
+
+    @staticmethod
+    def find_text(html,needle,tag=None):
+        '''
+        Returns the first text node (bytes between two tags) of the page containing needle,
+        or None. With tag, only text nodes that are the only content of such a tag count.
+        The needle is located with bytes.find, only the surroundings of a match are inspected.
+        '''
+        index=html.find(needle)
+        while index>=0:
+            start=html.rfind(b'>',0,index)+1
+            end=html.find(b'<',index)
+            # Not a text node if the needle is part of a tag
+            if html.rfind(b'<',0,index)<start and end>=0:
+                if tag is None:
+                    return html[start:end]
+                if html.startswith(tag,html.rfind(b'<',0,start)+1) and html.startswith(b'</'+tag+b'>',end):
+                    return html[start:end]
+            index=html.find(needle,index+len(needle))
+
+        return None
+
+    @staticmethod
+    def parse_fullname(soep,ticker,logger):
+        FUNCTION='parse_fullname'
+        ticker_upper=ticker.upper()
+        text=soep.find(text=re.compile(r'.*\({}\)'.format(re.escape(ticker_upper))))
+        if not text:
+            logger.debug("Ticker: {}. No fullname found on the yahoo website.".format(ticker),extra={'function':FUNCTION})
             return None
 
-        if not req.status_code==200:
-            logger.debug("Ticker: {}. No valid resonse was obtained from the yahoo website. Status code: {}.".format(ticker,req.status_code),extra={'function':FUNCTION})
+        return text.split("({})".format(ticker_upper))[0]
+
+    @staticmethod
+    def get_exchange_id(string,ticker,logger):
+        FUNCTION='get_exchange_id'
+        '''
+        Returns the exchange id from the text with the market information ("NasdaqGS - ... Currency in USD").
+        '''
+        if not string:
+            logger.debug("Ticker: {}. No market information found on the yahoo website.".format(ticker),extra={'function':FUNCTION})
             return None
 
-        soep=Soup(req.text,'html.parser')
-        string=soep.find(text=re.compile('.*Currency in.*'))
         words=string.replace(".","").split("-")
         words=[word.replace(" ","") for word in words]
 
@@ -71,31 +163,20 @@ class YahooScraper:
             result=MARKET_IDS[words[0]]
         except KeyError:
             result=words[0]
-             
+
         return result
 
-    def check_market_state(self,ticker,logger):
-        FUNCTION='check_market_state'
+    @staticmethod
+    def get_market_state(labels,logger):
+        FUNCTION='get_market_state'
         '''
-        Returns true if market for the provided ticker is open at this moment.
+        Returns the market state from the set of market state labels found on the page.
         '''
-        url=self.base_url+"/quote/{}".format(ticker.upper())
         result="UNKNOWN"
-        try:
-            req=requests.get(url)
-        except:
-            logger.debug("Ticker: {}. Error while calling http get request from the yahoo website ({}).".format(ticker,url),extra={'function':FUNCTION})
-            return result
-
-        if not req.status_code==200:
-            logger.debug("Ticker: {}. No valid resonse was obtained from the yahoo website. \n\nUrl: {} \n\nStatus code: {}.".format(ticker,req.url,req.status_code),extra={'function':FUNCTION})
-            return result
-
-        soep=Soup(req.text,'html.parser')
-        market_open=soep.find("span",text=re.compile('.*Market open.*'))
-        market_closed=soep.find("span",text=re.compile('.*At close.*'))
-        before_hours=soep.find("span",text=re.compile('.*Before hours.*'))
-        after_hours=soep.find("span",text=re.compile('.*After hours.*'))
+        market_open='Market open' in labels
+        market_closed='At close' in labels
+        before_hours='Before hours' in labels
+        after_hours='After hours' in labels
 
         if market_open:
             result="OPEN"
@@ -110,21 +191,96 @@ class YahooScraper:
 
         return result
 
-    def all_markets_closed(self,all_stocks,config_params,logger):
-        #FUNCTION='all_markets_closed'
+# Snapshots shared by all scrapers {TICKER:QuoteSnapshot}, cleared at the start of every loop (see clear_snapshots)
+_snapshots={}
+_snapshots_lock=threading.Lock()
+# Lock per ticker {TICKER:Lock}, held while its quote page is downloaded so concurrent callers wait for that snapshot
+_snapshot_fetch_locks={}
+
+def clear_snapshots():
+    '''
+    Forgets all quote snapshots, so the next calls download the quote pages again.
+    '''
+    with _snapshots_lock:
+        _snapshots.clear()
+
+class YahooScraper:
+    def __init__(self):
+        self.base_url="https://finance.yahoo.com"
+
+    def get_quote_snapshot(self,ticker,logger):
+        # FUNCTION='get_quote_snapshot'
         '''
-        This function returns True if all relevant stock markets are closed at this moment.
+        Returns the QuoteSnapshot of the ticker, or None if the quote page couldn't be downloaded.
+        The snapshot is shared with all other callers until clear_snapshots is called (or it
+        is older than SNAPSHOT_MAX_AGE). A quote page is downloaded by one thread at a time,
+        other threads asking for the same ticker wait for its snapshot.
         '''
-        for stock in all_stocks:
-            state=self.check_market_state(stock,logger)
-            if state=="OPEN":
-                return False
-            elif state=="BEFORE_HOURS" and config_params['main']['include_pre_trading']:
-                return False
-            elif state=="AFTER_HOURS" and config_params['main']['include_post_trading']:
-                return False
+        ticker_upper=ticker.upper()
+        with _snapshots_lock:
+            fetch_lock=_snapshot_fetch_locks.setdefault(ticker_upper,threading.Lock())
 
-        return True
+        with fetch_lock:
+            return self.fetch_quote_snapshot(ticker,logger)
+
+    def fetch_quote_snapshot(self,ticker,logger):
+        FUNCTION='fetch_quote_snapshot'
+        '''
+        Returns the cached QuoteSnapshot of the ticker if it is recent enough, else downloads
+        the quote page. Called by get_quote_snapshot, with the fetch lock of the ticker held.
+        '''
+        ticker_upper=ticker.upper()
+        with _snapshots_lock:
+            snapshot=_snapshots.get(ticker_upper)
+        if snapshot and time.monotonic()-snapshot.timestamp<SNAPSHOT_MAX_AGE:
+            return snapshot
+
+        url=self.base_url+"/quote/{}".format(ticker_upper)
+        try:
+            req=http_client.get(url)
+        except:
+            logger.debug("Ticker: {}. Error while calling http get request from the yahoo website ({}).".format(ticker,url),extra={'function':FUNCTION})
+            return None
+
+        if not req.status_code==200:
+            logger.debug("Ticker: {}. No valid resonse was obtained from the yahoo website. \n\nUrl: {} \n\nStatus code: {}.".format(ticker,req.url,req.status_code),extra={'function':FUNCTION})
+            return None
+
+        snapshot=QuoteSnapshot.from_html(ticker,req.content,logger)
+        with _snapshots_lock:
+            _snapshots[ticker_upper]=snapshot
+
+        return snapshot
+
+    def get_fullname(self,ticker,logger):
+        # FUNCTION='get_fullname'
+        snapshot=self.get_quote_snapshot(ticker,logger)
+        if not snapshot:
+            return None
+
+        return snapshot.fullname
+
+    def get_exchange(self,ticker,logger):
+        # FUNCTION='get_exchange'
+        '''
+        Get the exchange on which the given ticker is traded.
+        '''
+        snapshot=self.get_quote_snapshot(ticker,logger)
+        if not snapshot:
+            return None
+
+        return snapshot.exchange
+
+    def check_market_state(self,ticker,logger):
+        # FUNCTION='check_market_state'
+        '''
+        Returns true if market for the provided ticker is open at this moment.
+        '''
+        snapshot=self.get_quote_snapshot(ticker,logger)
+        if not snapshot:
+            return "UNKNOWN"
+
+        return snapshot.market_state
 
     def get_description(self,ticker,logger):
         FUNCTION='get_description'
@@ -134,7 +290,7 @@ class YahooScraper:
         description=""
         url=self.base_url+"/quote/{}/profile".format(ticker)
         try:
-            req=requests.get(url)
+            req=http_client.get(url)
         except:
             logger.debug("Ticker: {}. No valid response was returned from the yahooAPI with url ({})".format(ticker,url),extra={'function':FUNCTION},exc_info=False)
             return description
@@ -182,7 +338,7 @@ class YahooScraper:
         
         url=self.base_url+"quote/{}".format(ticker.upper())
         try:
-            req=requests.get(url)
+            req=http_client.get(url)
         except:
             return None
 
@@ -221,7 +377,7 @@ class YahooScraper:
 
     def get_gainers(self):
         url=self.base_url+"gainers"
-        req=requests.get(url)
+        req=http_client.get(url)
         empty_df=pd.DataFrame()
         
         if not req.status_code==200: